@@ -1,6 +1,6 @@
 from django.contrib import admin
-from app_run.models import Run, AthleteInfo, Challenge, Position
+from app_run.models import Run, AthleteInfo, Challenge, Position, PositionArchive
 
 # Register your models here.
 admin.site.register(Run)
-admin.site.register([AthleteInfo, Challenge, Position])
+admin.site.register([AthleteInfo, Challenge, Position, PositionArchive])
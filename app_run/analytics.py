@@ -0,0 +1,157 @@
+from django.conf import settings
+
+from app_run.distance import np, segment_distances
+from app_run.track import iter_track
+
+
+# Аналитика забега по его точкам: скорость по отрезкам, сплиты по километрам,
+# время в движении, максимальная скорость. Все считается массивами за один проход
+# по треку (numpy, если он установлен), без запросов на каждую точку.
+# Время точки - created_at: время записи на устройстве, если клиент его прислал (поле time),
+# иначе время приема сервером. У точек, загруженных пачкой без time, время почти одинаковое -
+# тогда скорости и сплиты не считаются (None), чтобы не отдавать заведомо неверные цифры
+
+UNTIMED_SEGMENT_S = 0.5 # отрезок короче по времени считаем "без времени"
+
+
+def _load(run):
+    latitudes, longitudes, times = [], [], []
+    for lat, lon, created_at in iter_track(run):
+        latitudes.append(float(lat))
+        longitudes.append(float(lon))
+        times.append(created_at.timestamp())
+    return latitudes, longitudes, times
+
+
+def _segments(latitudes, longitudes, times):
+    # длины отрезков в метрах, время на отрезок в секундах, скорость в м/с (0 там, где время не шло)
+    meters = segment_distances(latitudes, longitudes)
+    if np is not None:
+        meters = meters * 1000
+        seconds = np.diff(np.asarray(times, dtype=np.float64))
+        speeds = np.divide(meters, seconds, out=np.zeros_like(meters), where=seconds > 0)
+        return meters, seconds, speeds
+    meters = [m * 1000 for m in meters]
+    seconds = [b - a for a, b in zip(times, times[1:])]
+    speeds = [m / s if s > 0 else 0.0 for m, s in zip(meters, seconds)]
+    return meters, seconds, speeds
+
+
+def _outliers(speeds, max_speed):
+    """
+    Индексы точек-выбросов: GPS "прыгнул" в сторону и вернулся, т.е. и отрезок до точки,
+    и отрезок после нее быстрее max_speed. Первая и последняя точки выбросами не считаются
+    """
+    if np is not None:
+        fast = np.asarray(speeds) > max_speed
+        return (np.flatnonzero(fast[:-1] & fast[1:]) + 1).tolist()
+    return [i + 1 for i in range(len(speeds) - 1) if speeds[i] > max_speed and speeds[i + 1] > max_speed]
+
+
+def _mark_times(meters, seconds):
+    # моменты (с от старта), когда пройдена каждая полная тысяча метров, и общие дистанция/время
+    if np is not None:
+        covered = np.concatenate(([0.0], np.cumsum(meters)))
+        elapsed = np.concatenate(([0.0], np.cumsum(seconds)))
+        marks = np.arange(1000.0, covered[-1] + 1e-9, 1000.0)
+        # внутри отрезка считаем скорость постоянной - линейная интерполяция
+        return np.interp(marks, covered, elapsed).tolist(), float(covered[-1]), float(elapsed[-1])
+    mark_times = []
+    covered = elapsed = 0.0
+    mark = 1000.0
+    for m, s in zip(meters, seconds):
+        while m > 0 and covered + m >= mark:
+            mark_times.append(elapsed + s * (mark - covered) / m)
+            mark += 1000
+        covered += m
+        elapsed += s
+    return mark_times, covered, elapsed
+
+
+def _splits(meters, seconds):
+    # сплиты по километрам плюс последний неполный кусок
+    mark_times, covered, elapsed = _mark_times(meters, seconds)
+    splits = []
+    previous = 0.0
+    for km, mark_time in enumerate(mark_times, start=1):
+        splits.append({'km': km, 'distance_m': 1000, 'time_s': round(mark_time - previous, 1)})
+        previous = mark_time
+    rest = covered - 1000 * len(mark_times)
+    if rest >= 1 and elapsed > previous:
+        splits.append({'km': len(splits) + 1, 'distance_m': round(rest), 'time_s': round(elapsed - previous, 1)})
+    for split in splits:
+        split['pace_s_per_km'] = round(split['time_s'] * 1000 / split['distance_m'], 1)
+    return splits
+
+
+def _timestamps_ok(times):
+    # время точек пригодно для скоростей, если отрезков "без времени" не больше ANALYTICS_MAX_UNTIMED_SHARE
+    untimed = sum(1 for a, b in zip(times, times[1:]) if b - a < UNTIMED_SEGMENT_S)
+    return untimed <= settings.ANALYTICS_MAX_UNTIMED_SHARE * (len(times) - 1)
+
+
+def _moving_time(seconds, speeds, moving_speed):
+    if np is not None:
+        return float(seconds[speeds >= moving_speed].sum())
+    return sum(s for s, v in zip(seconds, speeds) if v >= moving_speed)
+
+
+def compute_analytics(run, include_segments=False):
+    latitudes, longitudes, times = _load(run)
+    points = len(latitudes)
+    if points < 2:
+        return {'run': run.id, 'points': points, 'points_dropped': 0, 'distance_km': 0.0,
+                'elapsed_time_s': 0.0, 'moving_time_s': 0.0, 'avg_speed_kmh': None, 'max_speed_kmh': None,
+                'avg_pace_s_per_km': None, 'splits': [], 'timestamps_ok': True}
+
+    meters, seconds, speeds = _segments(latitudes, longitudes, times)
+    if not _timestamps_ok(times):
+        # есть только дистанция; выбросы тоже не ищем - они определяются по скорости
+        result = {'run': run.id, 'points': points, 'points_dropped': 0,
+                  'distance_km': round(float(sum(meters)) / 1000, 3), 'elapsed_time_s': None, 'moving_time_s': None,
+                  'avg_speed_kmh': None, 'max_speed_kmh': None, 'avg_pace_s_per_km': None, 'splits': [],
+                  'timestamps_ok': False}
+        if include_segments:
+            result['segment_speeds_kmh'] = None
+        return result
+    dropped = _outliers(speeds, settings.ANALYTICS_MAX_SPEED)
+    if dropped:
+        drop = set(dropped)
+        keep = [i for i in range(points) if i not in drop]
+        latitudes = [latitudes[i] for i in keep]
+        longitudes = [longitudes[i] for i in keep]
+        times = [times[i] for i in keep]
+        meters, seconds, speeds = _segments(latitudes, longitudes, times)
+
+    distance_m = float(sum(meters))
+    moving_time = _moving_time(seconds, speeds, settings.ANALYTICS_MOVING_SPEED)
+    result = {
+        'run': run.id,
+        'points': points,
+        'points_dropped': len(dropped),
+        'distance_km': round(distance_m / 1000, 3),
+        'elapsed_time_s': round(times[-1] - times[0], 1),
+        'moving_time_s': round(moving_time, 1),
+        'avg_speed_kmh': round(distance_m / moving_time * 3.6, 2) if moving_time else None,
+        'max_speed_kmh': round(float(max(speeds)) * 3.6, 2),
+        'avg_pace_s_per_km': round(moving_time * 1000 / distance_m, 1) if distance_m else None,
+        'splits': _splits(meters, seconds),
+        'timestamps_ok': True,
+    }
+    if include_segments:
+        # скорость на каждом отрезке (км/ч) - только по запросу, для длинного трека это большой список
+        result['segment_speeds_kmh'] = [round(float(v) * 3.6, 2) for v in speeds]
+    return result
+
+
+def run_analytics(run, include_segments=False):
+    """
+    Аналитика забега. Для законченного забега результат сохраняется в run.analytics
+    и дальше отдается оттуда без пересчета
+    """
+    if include_segments or run.status != 'finished':
+        return compute_analytics(run, include_segments)
+    if run.analytics is None:
+        run.analytics = compute_analytics(run)
+        run.save(update_fields=['analytics'])
+    return run.analytics
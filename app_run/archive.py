@@ -0,0 +1,86 @@
+import time
+
+from django.db import transaction
+
+from app_run.models import Run, Position, PositionArchive
+
+
+# Архив точек законченных забегов.
+# Почти все чтения и записи Position касаются забегов, которые идут прямо сейчас, поэтому оперативная таблица
+# Position держит только их, а точки законченных забегов переносятся в PositionArchive (те же поля и id).
+# Перенос - при подсчете итогов забега (POSITIONS_ARCHIVE_ON_FINISH) или командой manage.py archive_positions.
+# Где сейчас точки забега, говорит Run.positions_archived, читать их - через run.positions()
+
+COLUMNS = ['id', 'run_id', 'latitude', 'longitude', 'created_at', 'cell']
+
+
+def _move(source, target, run, chunk_size):
+    # копируем кусками по id (keyset), потом удаляем из источника одним DELETE
+    moved = 0
+    last_id = 0
+    while True:
+        rows = list(source.objects.filter(run_id=run.id, id__gt=last_id).order_by('id').values(*COLUMNS)[:chunk_size])
+        if not rows:
+            break
+        target.objects.bulk_create([target(**row) for row in rows])
+        moved += len(rows)
+        last_id = rows[-1]['id']
+    source.objects.filter(run_id=run.id).delete()
+    return moved
+
+
+def archive_run(run, chunk_size=1000):
+    """
+    Переносит точки законченного забега в архив. Одна короткая транзакция на забег,
+    блокируется только сам забег. Возвращает кол-во перенесенных точек или None, если переносить нечего
+    """
+    with transaction.atomic():
+        run = Run.objects.select_for_update().get(id=run.id)
+        if run.status != 'finished' or run.positions_archived or run.track is not None:
+            return None
+        moved = _move(Position, PositionArchive, run, chunk_size)
+        run.positions_archived = True
+        run.save(update_fields=['positions_archived'])
+    return moved
+
+
+def restore_run(run, chunk_size=1000):
+    """Обратная операция: возвращает точки забега из архива в Position (например, чтобы их поправить)"""
+    with transaction.atomic():
+        run = Run.objects.select_for_update().get(id=run.id)
+        if not run.positions_archived:
+            return 0
+        moved = _move(PositionArchive, Position, run, chunk_size)
+        run.positions_archived = False
+        run.save(update_fields=['positions_archived'])
+    return moved
+
+
+def archive_finished_runs(limit=None, chunk_size=1000, pause=0):
+    """
+    Переносит в архив все законченные забеги, которые еще не там (старые данные, накопленные до архива).
+    Забеги идут по одному, каждый в своей транзакции - долгих блокировок нет, работу можно прервать
+    и продолжить. pause - секунд паузы между забегами, чтобы не нагружать БД.
+    Возвращает (кол-во забегов, кол-во точек)
+    """
+    runs = moved = 0
+    last_id = 0
+    while limit is None or runs < limit:
+        run_ids = list(
+            Run.objects.filter(status='finished', positions_archived=False, track__isnull=True, id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)[:100]
+        )
+        if not run_ids:
+            break
+        for run_id in run_ids:
+            last_id = run_id
+            result = archive_run(Run(id=run_id), chunk_size)
+            if result is None:
+                continue
+            runs += 1
+            moved += result
+            if limit is not None and runs >= limit:
+                break
+            if pause:
+                time.sleep(pause)
+    return runs, moved
@@ -0,0 +1,134 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse, Http404
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_GET
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from app_run.cache import bump
+from app_run.finalize import stop_run
+from app_run.idempotency import async_idempotent
+from app_run.ingest import parse_position, create_position, ingest_positions
+from app_run.live import notify, subscribe
+from app_run.models import Run
+from app_run.serializers import RunSerializer, PositionSerializer
+
+
+# Асинхронные версии горячих эндпоинтов трекера (работают под ASGI: uvicorn, daphne и т.п.).
+# DRF асинхронные вьюхи не поддерживает, поэтому здесь обычные async-функции Django.
+# Чтения и простые UPDATE идут через асинхронный ORM (afirst, aupdate), а запись точки и остановка забега -
+# через sync_to_async: им нужна транзакция с select_for_update, а транзакции в асинхронном ORM не работают.
+# Ответы такие же, как у синхронных вьюх (те же сериализаторы, те же тексты ошибок)
+
+
+def _json(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status_code)
+
+
+def _run_queryset():
+    return Run.objects.select_related('athlete')
+
+
+@csrf_exempt
+@require_POST
+async def positions_ingest(request):
+    """
+    /api/async/positions/ - одна точка {"run": 1, "latitude": 55.7558, "longitude": 37.6173}
+    (ответ как у POST /api/positions/) или массив таких точек (ответ как у /api/positions/bulk/).
+    Дубли и шум GPS не сохраняются (app_run/noise.py)
+    """
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return _json({'message': 'Некорректный JSON'}, status.HTTP_400_BAD_REQUEST)
+
+    if isinstance(data, list):
+        if len(data) > settings.POSITIONS_BULK_MAX_ITEMS:
+            return _json({'message': f'Не больше {settings.POSITIONS_BULK_MAX_ITEMS} точек за запрос'},
+                         status.HTTP_400_BAD_REQUEST)
+        created, dropped, errors = await sync_to_async(ingest_positions)(data, settings.POSITIONS_BULK_CHUNK_SIZE)
+        if created:
+            failed = {error['index'] for error in errors}
+            for run_id in {int(item['run']) for index, item in enumerate(data) if index not in failed}:
+                notify(run_id)
+        return _json({'created': created, 'dropped': dropped, 'errors': errors},
+                     status.HTTP_201_CREATED if created or dropped else status.HTTP_400_BAD_REQUEST)
+
+    parsed = parse_position(data)
+    if isinstance(parsed, str):
+        return _json({'message': parsed}, status.HTTP_400_BAD_REQUEST)
+    run_id, latitude, longitude, created_at = parsed
+
+    # быстрая проверка без блокировки: заведомо неподходящие точки не занимают поток под sync_to_async
+    run_status = await Run.objects.filter(id=run_id).values_list('status', flat=True).afirst()
+    if run_status is None:
+        return _json({'message': f'Забег {run_id} не найден'}, status.HTTP_400_BAD_REQUEST)
+    if run_status != 'in_progress':
+        return _json({'message': 'Забег должен быть в статусе "in progress"'}, status.HTTP_400_BAD_REQUEST)
+
+    position, error, dropped = await sync_to_async(create_position)(run_id, latitude, longitude, created_at)
+    if error:
+        return _json({'message': error}, status.HTTP_400_BAD_REQUEST)
+    if dropped:
+        return _json({'dropped': dropped})
+    notify(run_id)
+    return _json(PositionSerializer(position).data, status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@require_POST
+@async_idempotent
+async def run_start(request, run_id):
+    """/api/async/runs/<id>/start/ - то же, что StartRunAPIView (и так же понимает Idempotency-Key)"""
+    # проверка статуса и смена - один UPDATE, два одновременных старта не пройдут оба
+    updated = await Run.objects.filter(id=run_id, status='init').aupdate(status='in_progress')
+    if updated:
+        await sync_to_async(bump)('runs') # UPDATE не шлет post_save
+    run = await _run_queryset().filter(id=run_id).afirst()
+    if run is None:
+        raise Http404
+    if not updated:
+        return _json({'message': 'Забег уже идет или закончен'}, status.HTTP_400_BAD_REQUEST)
+    return _json(RunSerializer(run).data)
+
+
+@csrf_exempt
+@require_POST
+@async_idempotent
+async def run_stop(request, run_id):
+    """/api/async/runs/<id>/stop/ - то же, что StopRunAPIView (и так же понимает Idempotency-Key)"""
+    run = await _run_queryset().filter(id=run_id).afirst()
+    if run is None:
+        raise Http404
+    if run.status != 'in_progress' or await sync_to_async(stop_run)(run) is None:
+        return _json({'message': 'Забег еще не начат или уже закончен'}, status.HTTP_400_BAD_REQUEST)
+    run = await _run_queryset().aget(id=run_id) # если пул выключен (RUN_FINALIZE_WORKERS = 0), итоги уже посчитаны
+    notify(run_id)
+    return _json(RunSerializer(run).data)
+
+
+@require_GET
+async def run_live(request, run_id):
+    """
+    /api/runs/<id>/live/ - живая трансляция забега (text/event-stream, см. app_run/live.py).
+    События: position - новая точка (id события = id точки), run - статус и дистанция забега.
+    Работает только под ASGI: под WSGI (в т.ч. Zappa/Lambda) Django дочитывает асинхронный поток до конца,
+    прежде чем отдать хоть что-то, - зритель ничего не получит, а процесс будет занят до конца забега
+    """
+    if not isinstance(request, ASGIRequest):
+        return _json({'message': 'Живая трансляция доступна только при запуске под ASGI'},
+                     status.HTTP_501_NOT_IMPLEMENTED)
+    if not await Run.objects.filter(id=run_id).aexists():
+        raise Http404
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    response = StreamingHttpResponse(
+        subscribe(run_id, int(last_event_id) if last_event_id.isdigit() else None),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # nginx не должен копить поток в буфере
+    return response
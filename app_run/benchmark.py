@@ -0,0 +1,175 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, close_old_connections
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from app_run.challenges import backfill_challenges
+from app_run.models import Run, Position, AthleteInfo
+from app_run.stats import rebuild_stats
+
+
+# Бенчмарк горячих точек АПИ (manage.py bench_api).
+# Каждый эндпоинт вызывается через тестовый клиент Django (весь стек: middleware, DRF, сериализаторы),
+# для каждого меряется время и кол-во SQL-запросов. Кол-во запросов не должно зависеть от объема данных,
+# поэтому для него есть жесткий бюджет - его превышение означает N+1 или лишний запрос
+
+# имя: (метод, URL, бюджет SQL-запросов)
+ENDPOINTS = {
+    'runs_list': ('get', '/api/runs/?size=50', 2),
+    'users_list': ('get', '/api/users/?size=50', 2),
+    'users_roster': ('get', '/api/users/?size=50&expand=athlete_info,challenges', 3),
+    'athlete_info_batch': ('get', '/api/athlete_info/?ids={ids}', 1),
+    'position_create': ('post', '/api/positions/', 5),
+    'run_stop': ('post', '/api/runs/{run}/stop/', 6),
+    'challenges': ('get', '/api/challenges/', 1),
+    'runs_summary': ('get', '/api/runs/summary/?athlete={athlete}&group_by=week', 1),
+}
+
+
+def seed(athletes=100, runs=10, positions=50, batch_size=1000):
+    """
+    Синтетические данные: athletes атлетов, у каждого runs законченных забегов по positions точек,
+    плюс профили, статистика атлетов и челленджи. Все вставки - bulk_create. Возвращает список id атлетов
+    """
+    prefix = f'bench_{time.time_ns()}_'
+    User.objects.bulk_create(
+        (User(username=f'{prefix}{i}', password='!') for i in range(athletes)),
+        batch_size=batch_size,
+    )
+    athlete_ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+
+    now = timezone.now()
+    new_runs = [
+        Run(athlete_id=athlete_id, comment='bench', status='finished', distance=random.uniform(1, 20),
+            created_at=now - timedelta(days=day))
+        for athlete_id in athlete_ids for day in range(runs)
+    ]
+    new_runs = Run.objects.bulk_create(new_runs, batch_size=batch_size)
+
+    buffer = []
+    for run in new_runs:
+        lat, lon = Decimal('55.7558'), Decimal('37.6173')
+        for second in range(positions):
+            lat += Decimal(random.randint(-10, 10)) / 10000
+            lon += Decimal(random.randint(-10, 10)) / 10000
+            buffer.append(Position(run_id=run.id, latitude=lat, longitude=lon,
+                                   created_at=run.created_at + timedelta(seconds=second)))
+        if len(buffer) >= batch_size:
+            Position.objects.bulk_create(buffer, batch_size=batch_size)
+            buffer = []
+    Position.objects.bulk_create(buffer, batch_size=batch_size)
+
+    # профиль заполнен у каждого второго атлета - у остальных отдается пустой
+    AthleteInfo.objects.bulk_create(
+        (AthleteInfo(user_id_id=athlete_id, goals='bench', weight=70) for athlete_id in athlete_ids[::2]),
+        batch_size=batch_size,
+    )
+    rebuild_stats()
+    backfill_challenges()
+    return athlete_ids
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+def _request(client, name, athlete_id, athlete_ids):
+    method, url, _ = ENDPOINTS[name]
+    if name == 'athlete_info_batch':
+        url = url.format(ids=','.join(map(str, random.sample(athlete_ids, min(50, len(athlete_ids))))))
+    if name in ('position_create', 'run_stop'):
+        # для записи каждый раз свой забег в статусе in_progress, его подготовка в замер не входит
+        run = Run.objects.create(athlete_id=athlete_id, comment='bench', status='in_progress')
+        if name == 'position_create':
+            data = {'run': run.id, 'latitude': 55.7558, 'longitude': 37.6173}
+            return lambda: client.post(url, data, content_type='application/json')
+        Position.objects.create(run=run, latitude=Decimal('55.7558'), longitude=Decimal('37.6173'))
+        return lambda: client.post(url.format(run=run.id))
+    return lambda: getattr(client, method)(url.format(athlete=athlete_id))
+
+
+def run_benchmark(athlete_ids, repeat=20, names=None):
+    """
+    Гоняет эндпоинты по repeat раз. Кэш ответов (app_run/cache.py) сбрасывается перед каждым вызовом,
+    чтобы мерить реальную работу, а не чтение из кэша.
+    Возвращает dict: имя -> median_ms, p95_ms, min_ms, queries (максимум за все вызовы), budget, status
+    """
+    client = Client()
+    results = {}
+    for name in names or ENDPOINTS:
+        timings = []
+        queries = 0
+        status_code = None
+        for _ in range(repeat):
+            call = _request(client, name, random.choice(athlete_ids), athlete_ids)
+            cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = call()
+                timings.append((time.perf_counter() - start) * 1000)
+            # SAVEPOINT-ы появляются только внутри внешней транзакции (бенчмарк, тесты) - их не считаем
+            queries = max(queries, sum(1 for query in captured if 'SAVEPOINT' not in query['sql']))
+            status_code = response.status_code
+        results[name] = {
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(_percentile(timings, 95), 3),
+            'min_ms': round(min(timings), 3),
+            'queries': queries,
+            'budget': ENDPOINTS[name][2],
+            'status': status_code,
+        }
+    return results
+
+
+def write_throughput(requests=200, conn_max_age=0, health_checks=False):
+    """
+    Пропускная способность пути записи: POST /api/positions/ подряд в один забег, запросов в секунду.
+    Тестовый клиент сам соединения с БД не закрывает, поэтому здесь это делается как на настоящем сервере -
+    close_old_connections() до и после каждого запроса, с заданными CONN_MAX_AGE и CONN_HEALTH_CHECKS.
+    Транзакции коммитятся по-настоящему (это часть замера), данные удаляются в конце.
+    Нельзя вызывать внутри transaction.atomic()
+    """
+    settings_dict = connection.settings_dict
+    old = settings_dict['CONN_MAX_AGE'], settings_dict['CONN_HEALTH_CHECKS']
+    athlete = User.objects.create(username=f'bench_{time.time_ns()}', password='!')
+    run = Run.objects.create(athlete_id=athlete.id, comment='bench', status='in_progress')
+    client = Client()
+    try:
+        settings_dict['CONN_MAX_AGE'], settings_dict['CONN_HEALTH_CHECKS'] = conn_max_age, health_checks
+        connection.close() # новые настройки действуют с нового соединения
+        start = time.perf_counter()
+        # отсев шума (app_run/noise.py) запросов к БД не делает, а точки подряд без пауз он мог бы отбросить
+        with override_settings(POSITIONS_FILTER_ENABLED=False):
+            for i in range(requests):
+                close_old_connections()
+                data = {'run': run.id, 'latitude': f'{55.7558 + i / 10000:.4f}', 'longitude': '37.6173'}
+                response = client.post('/api/positions/', data, content_type='application/json')
+                close_old_connections()
+                if response.status_code != 201:
+                    raise RuntimeError(f'POST /api/positions/ ответил {response.status_code}: {response.content[:200]}')
+        elapsed = time.perf_counter() - start
+    finally:
+        settings_dict['CONN_MAX_AGE'], settings_dict['CONN_HEALTH_CHECKS'] = old
+        connection.close()
+        athlete.delete() # забег и точки удалятся каскадом
+    return round(requests / elapsed, 1)
+
+
+def over_budget(results):
+    """Эндпоинты, которые превысили бюджет запросов или ответили ошибкой: [(имя, описание), ...]"""
+    problems = []
+    for name, result in results.items():
+        if result['queries'] > result['budget']:
+            problems.append((name, f'{result["queries"]} SQL-запросов при бюджете {result["budget"]}'))
+        if result['status'] >= 400:
+            problems.append((name, f'ответ {result["status"]}'))
+    return problems
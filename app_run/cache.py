@@ -0,0 +1,89 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponseNotModified
+from rest_framework.response import Response
+
+
+# Кэш ответов АПИ.
+# Ключ ответа = URL + отсортированные query-параметры + "версии" данных, от которых ответ зависит.
+# Версия - это счетчик в кэше, его увеличивают сигналы post_save/post_delete (app_run/signals.py).
+# Поменялись данные -> поменялась версия -> поменялся ключ, и старый ответ просто больше не читается.
+# Тот же ключ служит ETag-ом: если клиент прислал If-None-Match с ним, отвечаем 304,
+# не доставая ничего из кэша и ничего не сериализуя
+
+VERSION_KEY = 'app_run:version:{}'
+RESPONSE_KEY = 'app_run:response:{}'
+
+
+def get_versions(names):
+    keys = [VERSION_KEY.format(name) for name in names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # версии нет (кэш перезапущен или ключ вытеснен) - начинаем с уникального значения,
+            # чтобы случайно не совпасть со старыми ответами, которые могли остаться в кэше
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _incr(names):
+    for name in names:
+        key = VERSION_KEY.format(name)
+        try:
+            cache.incr(key)
+        except ValueError: # версии еще нет
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump(*names):
+    """
+    Данные поменялись - все закэшированные ответы, которые от них зависят, устаревают.
+    Версия увеличивается сразу и еще раз после коммита транзакции: иначе параллельный запрос
+    мог бы успеть закэшировать еще старые (незакоммиченные) данные уже под новой версией
+    """
+    _incr(names)
+    transaction.on_commit(lambda: _incr(names))
+
+
+def _response_digest(request, depends_on):
+    params = sorted(request.query_params.lists())
+    versions = get_versions(depends_on)
+    raw = f'{request.path}?{params}|{versions}'
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def cache_response(*depends_on):
+    """
+    Декоратор для GET-обработчиков DRF (функции с @api_view или методы APIView/ViewSet).
+    depends_on - имена групп данных ('runs', 'challenges' ...), при изменении которых ответ устаревает
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(*args, **kwargs):
+            # у методов первым аргументом идет self, request - следующий
+            request = args[0] if hasattr(args[0], 'query_params') else args[1]
+            digest = _response_digest(request, depends_on)
+            etag = f'"{digest}"'
+            if etag in request.headers.get('If-None-Match', ''):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+
+            cached = cache.get(RESPONSE_KEY.format(digest))
+            if cached is not None:
+                response = Response(cached)
+            else:
+                response = view_func(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(RESPONSE_KEY.format(digest), response.data, settings.API_CACHE_TIMEOUT)
+            response['ETag'] = etag
+            return response
+        return wrapper
+    return decorator
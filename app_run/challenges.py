@@ -0,0 +1,63 @@
+from dataclasses import dataclass
+
+from app_run.cache import bump
+from app_run.models import Challenge
+from app_run.stats import collect_stats
+
+
+@dataclass(frozen=True)
+class ChallengeRule:
+    """
+    Правило челленджа: челлендж full_name выдается, когда показатель metric
+    из статистики атлета (AthleteStats) достигает threshold.
+    metric - 'runs_finished' (кол-во забегов), 'total_distance' (км) или 'best_streak' (дней подряд)
+    """
+    full_name: str
+    metric: str
+    threshold: float
+
+    def is_met(self, stats):
+        return getattr(stats, self.metric) >= self.threshold
+
+
+# Реестр правил. Новый челлендж - это просто еще одна строка здесь (или register_rule() из другого модуля)
+RULES = [
+    ChallengeRule('Сделай 10 Забегов!', 'runs_finished', 10),
+    ChallengeRule('Пробеги 50 километров!', 'total_distance', 50),
+    ChallengeRule('Бегай 7 дней подряд!', 'best_streak', 7),
+]
+
+
+def register_rule(rule):
+    RULES.append(rule)
+
+
+def earned_challenges(athlete_id, stats):
+    """Все челленджи, которые положены атлету по его статистике (объекты Challenge без сохранения)"""
+    return [Challenge(athlete_id=athlete_id, full_name=rule.full_name) for rule in RULES if rule.is_met(stats)]
+
+
+def award_challenges(stats):
+    """
+    Проверяет все правила по одной записи статистики атлета и выдает положенные челленджи.
+    Повторный вызов ничего не дублирует: уникальность (athlete, full_name) держит сама БД
+    """
+    challenges = earned_challenges(stats.athlete_id, stats)
+    if challenges:
+        Challenge.objects.bulk_create(challenges, ignore_conflicts=True)
+        bump('challenges') # bulk_create не шлет post_save
+
+
+def backfill_challenges(batch_size=1000):
+    """
+    Проверяет правила для всех атлетов сразу. Запросов - фиксированное кол-во
+    (статистика считается двумя запросами, плюс вставки пачками), а не по несколько на атлета.
+    Возвращает (кол-во атлетов, кол-во положенных челленджей)
+    """
+    challenges = []
+    all_stats = collect_stats()
+    for stats in all_stats:
+        challenges.extend(earned_challenges(stats.athlete_id, stats))
+    Challenge.objects.bulk_create(challenges, batch_size=batch_size, ignore_conflicts=True)
+    bump('challenges')
+    return len(all_stats), len(challenges)
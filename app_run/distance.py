@@ -0,0 +1,171 @@
+from math import radians, sin, cos, asin, sqrt
+
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from app_run import leaderboard
+from app_run.challenges import award_challenges
+from app_run.geo import cell_of
+from app_run.lazy import lazy_import
+from app_run.models import Position
+from app_run.stats import add_distance
+
+
+# numpy не обязателен - без него считаем на чистом Python.
+# Импортируется при первом расчете, а не при старте процесса (см. app_run/lazy.py)
+np = lazy_import('numpy')
+
+# Средний радиус Земли в км - такой же, как в библиотеке haversine,
+# чтобы результаты совпадали с тем, что раньше считалось через haversine()
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _segment_distances_numpy(latitudes, longitudes):
+    # вся формула гаверсинуса считается сразу для всего трека, без цикла на Python
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    d = np.sin(np.diff(lat) * 0.5) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) * 0.5) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(d))
+
+
+def _segment_distances_python(latitudes, longitudes):
+    # запасной вариант: один проход по точкам, cos широты считаем один раз на точку
+    segments = []
+    prev_lat = prev_lon = prev_cos = None
+    for lat, lon in zip(latitudes, longitudes):
+        lat = radians(lat)
+        lon = radians(lon)
+        cos_lat = cos(lat)
+        if prev_lat is not None:
+            d = sin((lat - prev_lat) * 0.5) ** 2 + prev_cos * cos_lat * sin((lon - prev_lon) * 0.5) ** 2
+            segments.append(2 * EARTH_RADIUS_KM * asin(sqrt(d)))
+        prev_lat, prev_lon, prev_cos = lat, lon, cos_lat
+    return segments
+
+
+def segment_distances(latitudes, longitudes, use_numpy=None):
+    """
+    Расстояния (в км) между соседними точками трека.
+    Если numpy установлен - возвращается numpy-массив, иначе обычный список.
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    if use_numpy:
+        return _segment_distances_numpy(latitudes, longitudes)
+    return _segment_distances_python(latitudes, longitudes)
+
+
+def track_distance(latitudes, longitudes, use_numpy=None):
+    """Суммарная длина трека в км (то же самое, что сумма haversine() по всем соседним парам)"""
+    if len(latitudes) < 2:
+        return 0.0
+    return float(sum(segment_distances(latitudes, longitudes, use_numpy)))
+
+
+def distances_from(lat, lon, latitudes, longitudes):
+    """Расстояния (в км) от точки (lat, lon) до каждой из точек latitudes/longitudes"""
+    if np is not None:
+        lat1, lon1 = np.radians(lat), np.radians(lon)
+        lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+        lon2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+        d = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(d))
+    lat1, lon1 = radians(lat), radians(lon)
+    cos_lat1 = cos(lat1)
+    result = []
+    for lat2, lon2 in zip(latitudes, longitudes):
+        lat2, lon2 = radians(lat2), radians(lon2)
+        d = sin((lat2 - lat1) * 0.5) ** 2 + cos_lat1 * cos(lat2) * sin((lon2 - lon1) * 0.5) ** 2
+        result.append(2 * EARTH_RADIUS_KM * asin(sqrt(d)))
+    return result
+
+
+def load_coordinates(run_id, model=Position):
+    """
+    Достаем координаты забега одним запросом.
+    Cast во float делаем прямо в БД, чтобы не создавать Decimal на каждую точку.
+    model - Position или PositionArchive (у забега с точками в архиве)
+    """
+    rows = model.objects.filter(run_id=run_id).order_by('id').values_list(
+        Cast('latitude', FloatField()),
+        Cast('longitude', FloatField()),
+    )
+    if np is not None:
+        coordinates = np.array(list(rows), dtype=np.float64).reshape(-1, 2)
+        return coordinates[:, 0], coordinates[:, 1]
+    latitudes, longitudes = [], []
+    for lat, lon in rows:
+        latitudes.append(lat)
+        longitudes.append(lon)
+    return latitudes, longitudes
+
+
+def run_distance(run_id):
+    """Дистанция забега в км по всем его точкам Position"""
+    latitudes, longitudes = load_coordinates(run_id)
+    return track_distance(latitudes, longitudes)
+
+
+START_FIELDS = ['start_latitude', 'start_longitude', 'start_cell']
+
+
+def set_start(run, latitudes, longitudes):
+    """Точка старта забега (для поиска забегов рядом, app_run/nearby.py) - первая точка трека"""
+    if len(latitudes):
+        run.start_latitude = float(latitudes[0])
+        run.start_longitude = float(longitudes[0])
+        run.start_cell = cell_of(latitudes[0], longitudes[0])
+    else:
+        run.start_latitude = run.start_longitude = run.start_cell = None
+
+
+def append_positions(run, latitudes, longitudes):
+    """
+    Прибавляет к run.distance отрезки до новых точек (они уже должны быть сохранены в Position).
+    Забег должен быть заблокирован через select_for_update() внутри transaction.atomic(),
+    иначе параллельные вставки точек одного забега могут потерять отрезок.
+    """
+    if not len(latitudes):
+        return
+    if run.last_latitude is None:
+        # первая точка забега (или забег, начатый до появления инкрементального подсчета) -
+        # один раз считаем весь трек целиком, дальше только по одному отрезку
+        all_latitudes, all_longitudes = load_coordinates(run.id)
+        run.distance = track_distance(all_latitudes, all_longitudes)
+        set_start(run, all_latitudes, all_longitudes)
+    else:
+        run.distance = (run.distance or 0.0) + track_distance(
+            [run.last_latitude, *latitudes],
+            [run.last_longitude, *longitudes],
+        )
+    run.last_latitude = float(latitudes[-1])
+    run.last_longitude = float(longitudes[-1])
+    run.save(update_fields=['distance', 'last_latitude', 'last_longitude', *START_FIELDS])
+
+
+def recalculate_run(run):
+    """
+    Полный пересчет distance и последней точки (после изменения или удаления точек).
+    Если забег уже закончен, разница дистанций переносится в статистику атлета, таблицу лидеров и челленджи.
+    Забег должен быть заблокирован (select_for_update)
+    """
+    latitudes, longitudes = load_coordinates(run.id, run.positions().model)
+    old_distance = run.distance or 0.0
+    run.distance = track_distance(latitudes, longitudes)
+    if run.status == 'finished' and run.distance != old_distance:
+        _apply_finished_distance(run, run.distance - old_distance)
+    if len(latitudes):
+        run.last_latitude = float(latitudes[-1])
+        run.last_longitude = float(longitudes[-1])
+    else:
+        run.last_latitude = run.last_longitude = None
+    set_start(run, latitudes, longitudes)
+    run.analytics = None # трек поменялся - аналитику надо будет посчитать заново
+    run.save(update_fields=['distance', 'last_latitude', 'last_longitude', 'analytics', *START_FIELDS])
+
+
+def _apply_finished_distance(run, delta):
+    leaderboard.add_distance(run, delta)
+    stats = add_distance(run, delta)
+    if stats is not None and delta > 0:
+        award_challenges(stats) # челленджи по километрам могли стать положены; выданные не отзываем
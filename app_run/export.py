@@ -0,0 +1,60 @@
+from xml.sax.saxutils import escape
+
+from app_run.track import iter_track
+
+
+# Выгрузка трека забега в GPX / NDJSON / CSV.
+# Все форматы - генераторы строк: точки читаются кусками (app_run.track.iter_track)
+# и сразу отдаются дальше, поэтому память не растет с длиной трека
+
+CONTENT_TYPES = {
+    'gpx': 'application/gpx+xml',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+LINES_PER_CHUNK = 500 # сколько точек склеивать в один кусок ответа
+
+
+def _time(created_at):
+    # с точностью до мс - как время хранится в упакованном треке
+    return created_at.isoformat(timespec='milliseconds').replace('+00:00', 'Z')
+
+
+def _gpx(run, points):
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="project_run" xmlns="http://www.topografix.com/GPX/1/1">\n'
+           f'<trk><name>{escape(run.comment or f"Забег {run.id}")}</name><trkseg>\n')
+    for lat, lon, created_at in points:
+        yield f'<trkpt lat="{lat}" lon="{lon}"><time>{_time(created_at)}</time></trkpt>\n'
+    yield '</trkseg></trk>\n</gpx>\n'
+
+
+def _ndjson(run, points):
+    for lat, lon, created_at in points:
+        yield f'{{"run": {run.id}, "latitude": {lat}, "longitude": {lon}, "created_at": "{_time(created_at)}"}}\n'
+
+
+def _csv(run, points):
+    yield 'latitude,longitude,created_at\n'
+    for lat, lon, created_at in points:
+        yield f'{lat},{lon},{_time(created_at)}\n'
+
+
+WRITERS = {
+    'gpx': _gpx,
+    'ndjson': _ndjson,
+    'csv': _csv,
+}
+
+
+def export_track(run, fmt, chunk_size=2000):
+    """Генератор кусков (str) выгрузки трека забега в формате fmt"""
+    lines = []
+    for line in WRITERS[fmt](run, iter_track(run, chunk_size)):
+        lines.append(line)
+        if len(lines) >= LINES_PER_CHUNK:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
@@ -0,0 +1,188 @@
+import re
+from decimal import Decimal
+
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from app_run.lazy import lazy_import
+
+# orjson не обязателен - без него рендерим обычным JSONRenderer. Импортируется при первом рендере
+orjson = lazy_import('orjson')
+
+
+# Быстрые сериализаторы для списков (только чтение).
+# Обычный ModelSerializer на каждую строку создает объект модели и прогоняет его через механизм полей DRF.
+# Здесь строки берутся сразу из .values(), а dict для ответа собирается заранее подготовленными
+# функциями-конвертерами - по одной на поле. Вывод ровно такой же, как у соответствующего ModelSerializer
+# (те же поля, в том же порядке, в том же формате), это проверяется в тестах.
+# Во вьюхе включается через FastListMixin и атрибут values_serializer_class
+
+
+def as_is(value):
+    return value
+
+
+def as_float(value):
+    return None if value is None else float(value)
+
+
+def as_decimal_string(decimal_places):
+    # как DecimalField с COERCE_DECIMAL_TO_STRING: округление до decimal_places и запись без экспоненты
+    step = Decimal(1).scaleb(-decimal_places)
+
+    def convert(value):
+        if value is None:
+            return ''
+        if not isinstance(value, Decimal):
+            value = Decimal(str(value).strip())
+        return '{:f}'.format(value.quantize(step))
+    return convert
+
+
+def as_datetime(value):
+    # как DateTimeField в формате ISO 8601: в текущей временной зоне, UTC пишется как Z
+    if not value:
+        return None
+    value = value.astimezone(timezone.get_current_timezone()).isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class ValuesSerializer:
+    """
+    Сериализатор строк .values(). fields - список (имя в ответе, поле для values(), конвертер)
+    или (имя в ответе, [вложенные поля]) для вложенного объекта.
+    extra_columns - поля, которые нужно достать из БД, но не выводить (например, ключ keyset-пагинации)
+    """
+    fields = []
+    extra_columns = []
+
+    def __init__(self):
+        self._columns = list(dict.fromkeys([*self._collect_columns(self.fields), *self.extra_columns]))
+        self._build = self._compile(self.fields)
+
+    @classmethod
+    def _collect_columns(cls, fields):
+        columns = []
+        for field in fields:
+            if isinstance(field[1], list):
+                columns.extend(cls._collect_columns(field[1]))
+            else:
+                columns.append(field[1])
+        return columns
+
+    @classmethod
+    def _compile(cls, fields):
+        # заранее раскладываем поля на (имя, колонка, конвертер), чтобы на строку был только один проход
+        plain = []
+        nested = []
+        for position, field in enumerate(fields):
+            if isinstance(field[1], list):
+                nested.append((position, field[0], cls._compile(field[1])))
+            else:
+                plain.append((position, field[0], field[1], field[2]))
+
+        if not nested:
+            items = [(name, column, convert) for _, name, column, convert in plain]
+
+            def build(row):
+                return {name: convert(row[column]) for name, column, convert in items}
+            return build
+
+        ordered = sorted(
+            [(position, name, column, convert, None) for position, name, column, convert in plain]
+            + [(position, name, None, None, build_nested) for position, name, build_nested in nested]
+        )
+
+        def build(row):
+            data = {}
+            for _, name, column, convert, build_nested in ordered:
+                data[name] = build_nested(row) if build_nested else convert(row[column])
+            return data
+        return build
+
+    def columns(self):
+        return self._columns
+
+    def to_representation(self, rows):
+        build = self._build
+        return [build(row) for row in rows]
+
+
+class RunValuesSerializer(ValuesSerializer):
+    # то же, что RunSerializer (с вложенным UserRunSerializer)
+    fields = [
+        ('id', 'id', as_is),
+        ('athlete_data', [
+            ('id', 'athlete__id', as_is),
+            ('username', 'athlete__username', as_is),
+            ('last_name', 'athlete__last_name', as_is),
+            ('first_name', 'athlete__first_name', as_is),
+        ]),
+        ('created_at', 'created_at', as_datetime),
+        ('comment', 'comment', as_is),
+        ('status', 'status', as_is),
+        ('distance', 'distance', as_float),
+        ('athlete', 'athlete_id', as_is),
+    ]
+
+
+class PositionValuesSerializer(ValuesSerializer):
+    # то же, что PositionSerializer
+    fields = [
+        ('id', 'id', as_is),
+        ('run', 'run_id', as_is),
+        ('latitude', 'latitude', as_decimal_string(4)),
+        ('longitude', 'longitude', as_decimal_string(4)),
+    ]
+    extra_columns = ['created_at'] # для keyset-пагинации
+
+
+EXPONENT = re.compile(rb'\de[-+]?\d')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer через orjson, если он установлен. Байты те же, что у обычного JSONRenderer
+    (компактный JSON в UTF-8). Если orjson нет, нужен отступ (?indent, browsable API)
+    или в данных есть типы, которые orjson не знает, - рендерит обычный JSONRenderer
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii \
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if EXPONENT.search(ret):
+            # экспоненту orjson пишет иначе (1e-5 вместо 1e-05) - такие ответы отдаем обычному JSONRenderer
+            return super().render(data, accepted_media_type, renderer_context)
+        # как и JSONRenderer, экранируем \u2028 и \u2029
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class FastListMixin:
+    """
+    Для ViewSet-а: list() отдает строки через values_serializer_class, минуя ModelSerializer.
+    Фильтры, сортировка и пагинация работают как обычно. Если values_serializer_class = None - обычный list()
+    """
+    values_serializer_class = None
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if self.values_serializer_class is None:
+            return renderers
+        return [FastJSONRenderer() if type(renderer) is JSONRenderer else renderer for renderer in renderers]
+
+    def list(self, request, *args, **kwargs):
+        if self.values_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+        serializer = self.values_serializer_class()
+        queryset = self.filter_queryset(self.get_queryset()).values(*serializer.columns())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(queryset))
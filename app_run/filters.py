@@ -0,0 +1,21 @@
+from django_filters import rest_framework as filters
+
+from app_run.models import Run
+
+
+class RunFilter(filters.FilterSet):
+    """
+    Фильтры списка забегов (и /api/runs/summary/):
+    ?status=finished, ?athlete=1, диапазоны ?created_at__gte=2026-01-01&created_at__lt=2026-02-01
+    и ?distance__gte=5&distance__lte=10
+    """
+    # по id, без лишнего запроса на проверку, что такой юзер есть (у несуществующего просто нет забегов)
+    athlete = filters.NumberFilter(field_name='athlete_id')
+
+    class Meta:
+        model = Run
+        fields = {
+            'status': ['exact'],
+            'created_at': ['gte', 'lt'],
+            'distance': ['gte', 'lte'],
+        }
@@ -0,0 +1,181 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from app_run.archive import archive_run
+from app_run.cache import bump
+from app_run.challenges import award_challenges
+from app_run.distance import run_distance
+from app_run.leaderboard import record_run
+from app_run.models import Run, RunFinalizeJob
+from app_run.stats import add_finished_run
+from app_run.track import pack_run
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def finalize_run(run_id):
+    """
+    Подсчет итогов остановленного забега: дистанция, статус 'finished', статистика атлета, челленджи и таблица лидеров.
+    Все в одной транзакции под блокировкой забега. Повторный вызов для уже законченного забега ничего не делает
+    """
+    with transaction.atomic():
+        run = Run.objects.select_for_update().get(id=run_id)
+        if run.status != 'finalizing':
+            return run
+        # дистанция обычно уже накоплена по мере поступления точек (PositionViewSet.perform_create)
+        if run.distance is None:
+            run.distance = run_distance(run.id)
+        run.status = 'finished'
+        run.save()
+        award_challenges(add_finished_run(run))
+        record_run(run)
+
+    # по желанию сразу переводим трек законченного забега в компактное хранение или в архив точек -
+    # уже после коммита, отдельной транзакцией, чтобы не держать блокировку забега дольше нужного
+    if settings.TRACK_PACK_ON_FINISH:
+        pack_run(run, settings.TRACK_SIMPLIFY_TOLERANCE_M)
+    elif settings.POSITIONS_ARCHIVE_ON_FINISH:
+        archive_run(run)
+    return run
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RUN_FINALIZE_WORKERS,
+                thread_name_prefix='run-finalize',
+            )
+    return _executor
+
+
+def _claimable():
+    # задачи, которые можно взять: ждущие своей очереди и зависшие в 'running' (например, процесс упал)
+    now = timezone.now()
+    stuck = now - timedelta(seconds=settings.RUN_FINALIZE_STUCK_AFTER)
+    return RunFinalizeJob.objects.filter(
+        Q(status='pending', next_attempt_at__lte=now) | Q(status='running', updated_at__lt=stuck)
+    )
+
+
+def process_job(job_id):
+    """
+    Берет задачу из очереди и выполняет ее. Задачу забирает тот, чей UPDATE ее "захватил",
+    поэтому одну и ту же задачу два воркера не выполнят.
+    При ошибке задача возвращается в очередь с растущей задержкой, пока не кончатся попытки.
+    Возвращает True, если задача была выполнена этим вызовом
+    """
+    claimed = _claimable().filter(id=job_id).update(
+        status='running', attempts=F('attempts') + 1, updated_at=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    job = RunFinalizeJob.objects.get(id=job_id)
+    try:
+        finalize_run(job.run_id)
+    except Exception as e:
+        logger.exception('Ошибка подсчета итогов забега %s (попытка %s)', job.run_id, job.attempts)
+        if job.attempts >= settings.RUN_FINALIZE_MAX_ATTEMPTS:
+            # забег так и останется 'finalizing' - вернуть задачу в очередь: drain_finalize_queue --retry-failed
+            logger.error('Попытки подсчета итогов забега %s кончились, задача %s в статусе failed', job.run_id, job.id)
+            job.status = 'failed'
+        else:
+            job.status = 'pending'
+            # 1x, 2x, 4x... от базовой задержки
+            delay = settings.RUN_FINALIZE_RETRY_DELAY * 2 ** (job.attempts - 1)
+            job.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+            if settings.RUN_FINALIZE_WORKERS:
+                retry = threading.Timer(delay, submit_job, args=[job.id])
+                retry.daemon = True
+                retry.start()
+        job.last_error = f'{type(e).__name__}: {e}'
+        job.save(update_fields=['status', 'next_attempt_at', 'last_error', 'updated_at'])
+        return False
+
+    job.status = 'done'
+    job.last_error = ''
+    job.save(update_fields=['status', 'last_error', 'updated_at'])
+    return True
+
+
+def _run_in_worker(job_id):
+    # у каждого потока свое соединение с БД - закрываем его, чтобы не копились
+    close_old_connections()
+    try:
+        process_job(job_id)
+    except Exception:
+        logger.exception('Воркер не смог обработать задачу %s', job_id)
+    finally:
+        close_old_connections()
+
+
+def submit_job(job_id):
+    """Отдает задачу в пул потоков, а при RUN_FINALIZE_WORKERS = 0 выполняет ее сразу"""
+    if settings.RUN_FINALIZE_WORKERS:
+        _get_executor().submit(_run_in_worker, job_id)
+    else:
+        process_job(job_id)
+
+
+def stop_run(run):
+    """
+    Останавливает забег: статус 'in_progress' -> 'finalizing' и задача в очередь.
+    Сам подсчет итогов идет уже после коммита, в пуле потоков (или прямо здесь, если пул выключен).
+    Статус меняется условным UPDATE: если забег уже не 'in_progress' (например, его только что
+    остановил параллельный запрос), ничего не делает и возвращает None
+    """
+    with transaction.atomic():
+        if not Run.objects.filter(id=run.id, status='in_progress').update(status='finalizing'):
+            return None
+        bump('runs') # UPDATE не шлет post_save
+        run.status = 'finalizing'
+        job, created = RunFinalizeJob.objects.update_or_create(
+            run=run, defaults={'status': 'pending', 'attempts': 0, 'next_attempt_at': timezone.now()}
+        )
+    if settings.RUN_FINALIZE_WORKERS:
+        # поток должен увидеть уже закоммиченную задачу
+        transaction.on_commit(lambda: submit_job(job.id))
+    else:
+        process_job(job.id)
+    return job
+
+
+def drain(limit=None):
+    """
+    Выполняет все задачи, которые можно взять прямо сейчас (в текущем потоке).
+    Для manage.py drain_finalize_queue - подобрать то, что не успел пул потоков.
+    Возвращает (выполнено, с ошибкой)
+    """
+    done = errors = 0
+    job_ids = _claimable().order_by('next_attempt_at').values_list('id', flat=True)
+    if limit:
+        job_ids = job_ids[:limit]
+    for job_id in list(job_ids):
+        if process_job(job_id):
+            done += 1
+        else:
+            errors += 1
+    return done, errors
+
+
+def scheduled_drain(event=None, context=None):
+    """
+    То же, что manage.py drain_finalize_queue, для расписания Zappa (events в zappa_settings.json) -
+    на Lambda некому повторить задачи, которые упали при остановке забега
+    """
+    done, errors = drain()
+    logger.info('Очередь подсчета итогов: выполнено %s, с ошибкой %s', done, errors)
+    return {'done': done, 'errors': errors}
@@ -0,0 +1,66 @@
+from math import cos, degrees, radians
+
+from django.conf import settings
+
+
+# Сетка ячеек для поиска "рядом" без PostGIS.
+# Земля делится на квадраты GEO_CELL_DEGREES x GEO_CELL_DEGREES градусов, ячейки нумеруются
+# по строкам (широта) и колонкам (долгота): cell = row * COLUMNS + col.
+# Поэтому ячейки одной строки идут подряд, и прямоугольник на карте - это несколько
+# диапазонов cell BETWEEN a AND b (по одному на строку), которые обычный индекс отдает быстро.
+# Считаем в целых десятитысячных долях градуса - в Position координаты хранятся с 4 знаками,
+# так номер ячейки не зависит от ошибок округления float
+
+UNITS = 10_000 # единиц в градусе
+EARTH_RADIUS_KM = 6371.0088 # как в app_run/distance.py
+
+
+def _cell_size():
+    return max(1, round(settings.GEO_CELL_DEGREES * UNITS))
+
+
+def _columns():
+    return 360 * UNITS // _cell_size() + 1
+
+
+def _row(lat):
+    return (round(float(lat) * UNITS) + 90 * UNITS) // _cell_size()
+
+
+def _col(lon):
+    return (round(float(lon) * UNITS) + 180 * UNITS) // _cell_size()
+
+
+def cell_of(lat, lon):
+    """Номер ячейки сетки для точки (float или Decimal)"""
+    return _row(lat) * _columns() + _col(lon)
+
+
+def cell_ranges(lat, lon, radius_km):
+    """
+    Диапазоны номеров ячеек [(первая, последняя), ...], которые покрывают круг радиуса radius_km вокруг точки.
+    Покрытие с запасом (по описанному прямоугольнику), точное расстояние проверяется потом
+    """
+    columns = _columns()
+    dlat = degrees(radius_km / EARTH_RADIUS_KM)
+    south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+
+    # чем ближе к полюсу, тем "уже" градус долготы - берем самую дальнюю от экватора широту прямоугольника
+    widest = max(abs(south), abs(north))
+    if widest >= 89.9 or radius_km / (EARTH_RADIUS_KM * cos(radians(widest))) >= radians(180):
+        col_ranges = [(0, columns - 1)]
+    else:
+        dlon = degrees(radius_km / (EARTH_RADIUS_KM * cos(radians(widest))))
+        west, east = lon - dlon, lon + dlon
+        if west < -180: # прямоугольник переходит через 180-й меридиан - две части
+            col_ranges = [(_col(west + 360), columns - 1), (0, _col(east))]
+        elif east > 180:
+            col_ranges = [(_col(west), columns - 1), (0, _col(east - 360))]
+        else:
+            col_ranges = [(_col(west), _col(east))]
+
+    ranges = []
+    for row in range(_row(south), _row(north) + 1):
+        for first, last in col_ranges:
+            ranges.append((row * columns + first, row * columns + last))
+    return ranges
@@ -0,0 +1,181 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from app_run.models import IdempotencyKey
+
+
+# Поддержка заголовка Idempotency-Key для POST-эндпоинтов.
+# Мобильный клиент на плохой сети повторяет запрос, не зная, дошел ли первый. С ключом повтор
+# не выполняется заново, а получает сохраненный ответ первого запроса (с заголовком Idempotent-Replayed).
+# Ключ "захватывается" вставкой строки с уникальным (key, path) - из одновременных запросов
+# с одним ключом выполняется только один, остальные получают 409 и повторяют позже.
+# Строка ключа должна жить вне транзакции самого запроса: иначе откат (ответ 4xx в AtomicWriteMixin)
+# стер бы и сохраненный ответ. Поэтому у вьюх с AtomicWriteMixin ключ захватывает и сохраняет
+# сам mixin (idempotent_dispatch) до и после своей транзакции, а декоратор только помечает обработчик
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+
+
+def _error(message, status_code):
+    return {'message': message}, status_code, False
+
+
+def _replay(record, request_hash):
+    # ответ на повторный запрос: (данные, код ответа, это сохраненный ответ первого запроса)
+    if record is None:
+        # первый запрос упал с ошибкой и освободил ключ - можно повторить
+        return _error('Запрос с этим Idempotency-Key не выполнен, повторите его', status.HTTP_409_CONFLICT)
+    if record.request_hash != request_hash:
+        return _error('Idempotency-Key уже использован с другим телом запроса',
+                      status.HTTP_422_UNPROCESSABLE_ENTITY)
+    if record.status_code is None:
+        return _error('Запрос с этим Idempotency-Key еще выполняется', status.HTTP_409_CONFLICT)
+    return record.response, record.status_code, True
+
+
+def _claim(request):
+    """
+    Захват ключа из заголовка запроса: (IdempotencyKey, None) - выполняем запрос,
+    (None, ответ как у _replay) - запрос повторный или ключ некорректный
+    """
+    key = request.headers[IDEMPOTENCY_HEADER]
+    if len(key) > 255:
+        return None, _error('Idempotency-Key длиннее 255 символов', status.HTTP_400_BAD_REQUEST)
+    path = f'{request.method} {request.path}'[:255]
+    request_hash = hashlib.md5(request.body).hexdigest()
+    expired = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    IdempotencyKey.objects.filter(key=key, path=path, created_at__lt=expired).delete()
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(key=key, path=path, request_hash=request_hash)
+    except IntegrityError: # ключ уже захвачен - этот запрос повторный
+        return None, _replay(IdempotencyKey.objects.filter(key=key, path=path).first(), request_hash)
+    return record, None
+
+
+def _release(record):
+    # освобождаем ключ, чтобы запрос можно было повторить
+    if transaction.get_connection().in_atomic_block and transaction.get_rollback():
+        return # внешняя транзакция и так откатится вместе с ключом
+    try:
+        with transaction.atomic():
+            record.delete()
+    except DatabaseError:
+        pass # транзакция сломана ошибкой БД - не подменяем исходное исключение новым
+
+
+def _finish(record, status_code, data):
+    # ответы 5xx не сохраняются - ключ освобождается, и такой запрос можно повторить
+    if status_code >= 500:
+        _release(record)
+    else:
+        record.status_code = status_code
+        record.response = data
+        record.save(update_fields=['status_code', 'response'])
+
+
+def _drf_response(data, status_code, replayed):
+    response = Response(data, status=status_code)
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _json_response(data, status_code, replayed):
+    response = HttpResponse(JSONRenderer().render(data), content_type='application/json', status=status_code)
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent_dispatch(request, dispatch):
+    """
+    Выполняет dispatch() (-> ответ DRF) с учетом заголовка Idempotency-Key. Ключ захватывается
+    и ответ сохраняется отдельными запросами к БД, поэтому dispatch может сам открыть транзакцию
+    и откатить ее (так делает AtomicWriteMixin) - сохраненный ответ это не затронет
+    """
+    record, replay = _claim(request)
+    if replay:
+        return _json_response(*replay) # ответ отдается мимо DRF, поэтому рендерим сами
+    request.idempotency_claimed = True # чтобы @idempotent у обработчика не захватывал ключ второй раз
+    try:
+        response = dispatch()
+    except Exception:
+        _release(record)
+        raise
+    if not isinstance(response, Response):
+        _release(record)
+        return response
+    _finish(record, response.status_code, response.data)
+    return response
+
+
+def idempotent(view_func):
+    """
+    Декоратор для POST-обработчиков DRF (функции с @api_view или методы APIView/ViewSet).
+    Без заголовка Idempotency-Key запрос выполняется как обычно. Ответы 5xx не сохраняются - такой запрос можно повторить.
+    Во вьюхах с AtomicWriteMixin ключ обрабатывает mixin вне своей транзакции, здесь обработчик просто вызывается
+    """
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        # у методов первым аргументом идет self, request - следующий
+        request = args[0] if hasattr(args[0], 'query_params') else args[1]
+        if not request.headers.get(IDEMPOTENCY_HEADER) or getattr(request, 'idempotency_claimed', False):
+            return view_func(*args, **kwargs)
+        record, replay = _claim(request)
+        if replay:
+            return _drf_response(*replay)
+
+        try:
+            response = view_func(*args, **kwargs)
+        except Exception:
+            _release(record)
+            raise
+        if not isinstance(response, Response):
+            _release(record)
+            return response
+        _finish(record, response.status_code, response.data)
+        return response
+    wrapper.idempotent = True
+    return wrapper
+
+
+def async_idempotent(view_func):
+    """То же для асинхронных вьюх Django (app_run/async_views.py), которые отвечают JSON в HttpResponse"""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        if not request.headers.get(IDEMPOTENCY_HEADER):
+            return await view_func(request, *args, **kwargs)
+        record, replay = await sync_to_async(_claim)(request)
+        if replay:
+            return _json_response(*replay)
+
+        try:
+            response = await view_func(request, *args, **kwargs)
+        except Exception:
+            await sync_to_async(_release)(record)
+            raise
+        if response.get('Content-Type') != 'application/json':
+            await sync_to_async(_release)(record)
+            return response
+        await sync_to_async(_finish)(record, response.status_code, json.loads(response.content))
+        return response
+    return wrapper
+
+
+def purge_expired_keys():
+    """Удаляет ключи старше IDEMPOTENCY_KEY_TTL. Возвращает кол-во удаленных"""
+    expired = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=expired).delete()
+    return deleted
@@ -0,0 +1,45 @@
+from django.db import transaction
+from django.utils import timezone
+
+from app_run.distance import track_distance, set_start
+from app_run.finalize import finalize_run
+from app_run.models import Run, Position
+from app_run.trackfiles import TrackImportError, parse_track
+
+
+# Импорт треков из файлов GPX и TCX: разбор - в app_run/trackfiles.py, здесь - запись забега в БД
+
+
+def import_track(athlete, track, comment=None, chunk_size=1000):
+    """
+    Создает законченный забег из разобранного трека (результат parse_track):
+    Run и все Position (bulk_create кусками), дистанция считается здесь же, по уже разобранным координатам.
+    Статистика атлета и челленджи - как у обычного забега, через finalize_run
+    """
+    if not track['latitudes']:
+        raise TrackImportError('В файле нет точек трека')
+    now = timezone.now()
+    times = [time or now for time in track['times']]
+    latitudes = [float(lat) for lat in track['latitudes']]
+    longitudes = [float(lon) for lon in track['longitudes']]
+
+    with transaction.atomic():
+        run = Run(
+            athlete=athlete,
+            comment=comment or track['name'] or '',
+            status='finalizing',
+            created_at=times[0],
+            distance=track_distance(latitudes, longitudes),
+            last_latitude=latitudes[-1],
+            last_longitude=longitudes[-1],
+        )
+        set_start(run, latitudes, longitudes)
+        run.save()
+        Position.objects.bulk_create(
+            (
+                Position(run=run, latitude=lat, longitude=lon, created_at=time)
+                for lat, lon, time in zip(track['latitudes'], track['longitudes'], times)
+            ),
+            batch_size=chunk_size,
+        )
+    return finalize_run(run.id)
@@ -0,0 +1,147 @@
+from datetime import timezone as dt_timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app_run.distance import np, append_positions
+from app_run.models import Run, Position
+from app_run.noise import filter_positions
+
+
+COORDINATE_STEP = Decimal('0.0001') # в Position хранится 4 знака после запятой
+COORDINATES_ERROR = 'Широта должна быть между -90 и 90, долгота - между -180 и 180'
+TIME_ERROR = 'Некорректное время точки (time), нужна дата и время в ISO 8601'
+
+
+def parse_time(value):
+    """
+    Время записи точки на устройстве (необязательное поле time, ISO 8601) -> aware datetime.
+    Без часового пояса считается UTC, как в файлах GPX/TCX. None - времени нет, ValueError - некорректное
+    """
+    if value is None:
+        return None
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError(TIME_ERROR)
+    return parsed if timezone.is_aware(parsed) else parsed.replace(tzinfo=dt_timezone.utc)
+
+
+def _parse_item(item):
+    # разбор одного элемента без запросов в БД: (run_id, широта, долгота, время или None) или текст ошибки
+    if not isinstance(item, dict):
+        return 'Ожидается объект с полями run, latitude, longitude'
+    try:
+        run_id = int(item['run'])
+        latitude = Decimal(str(item['latitude'])).quantize(COORDINATE_STEP, rounding=ROUND_HALF_EVEN)
+        longitude = Decimal(str(item['longitude'])).quantize(COORDINATE_STEP, rounding=ROUND_HALF_EVEN)
+    except KeyError as e:
+        return f'Не указано поле {e.args[0]}'
+    except (TypeError, ValueError, InvalidOperation):
+        return 'Некорректное значение run, latitude или longitude'
+    try:
+        created_at = parse_time(item.get('time'))
+    except ValueError:
+        return TIME_ERROR
+    return run_id, latitude, longitude, created_at
+
+
+def _coordinates_mask(latitudes, longitudes):
+    # проверка диапазонов сразу для всей пачки (те же границы, что в PositionSerializer)
+    if np is not None:
+        lat = np.asarray(latitudes, dtype=np.float64)
+        lon = np.asarray(longitudes, dtype=np.float64)
+        return ((lat > -90) & (lat < 90) & (lon > -180) & (lon < 180)).tolist()
+    return [-90 < lat < 90 and -180 < lon < 180 for lat, lon in zip(latitudes, longitudes)]
+
+
+def parse_position(item):
+    """Разбор и проверка одной точки без запросов в БД: (run_id, широта, долгота, время или None) или текст ошибки"""
+    result = _parse_item(item)
+    if isinstance(result, str):
+        return result
+    if not _coordinates_mask([float(result[1])], [float(result[2])])[0]:
+        return COORDINATES_ERROR
+    return result
+
+
+def create_position(run_id, latitude, longitude, created_at=None):
+    """
+    Сохраняет одну точку так же, как PositionViewSet.perform_create: под блокировкой забега,
+    с проверкой статуса, отсевом дублей и шума (app_run/noise.py) и прибавлением отрезка к дистанции.
+    Возвращает (Position, None, None), (None, текст ошибки, None) или (None, None, почему точка отброшена)
+    """
+    with transaction.atomic():
+        run = Run.objects.select_for_update().filter(id=run_id).first()
+        if run is None:
+            return None, f'Забег {run_id} не найден', None
+        if run.status != 'in_progress':
+            return None, 'Забег должен быть в статусе "in progress"', None
+        dropped = filter_positions(run, [latitude], [longitude], [created_at])[0]
+        if dropped:
+            return None, None, dropped
+        position = Position.objects.create(run=run, latitude=latitude, longitude=longitude,
+                                           created_at=created_at or timezone.now())
+        append_positions(run, [float(latitude)], [float(longitude)])
+    return position, None, None
+
+
+def ingest_positions(items, chunk_size=1000):
+    """
+    Пакетное сохранение точек.
+    Статус забега проверяется один раз на забег (один запрос на все забеги пачки),
+    координаты - одной векторной проверкой, вставка - bulk_create кусками по chunk_size.
+    Ошибочные элементы пропускаются и возвращаются в errors с индексом, остальные сохраняются.
+    Координаты с большей точностью округляются до 4 знаков, как они и хранятся в Position.
+    Время записи точки на устройстве (time) сохраняется в created_at, без него - время приема.
+    Дубли и шум GPS отсеиваются (app_run/noise.py). Возвращает (сохранено, отброшено, errors)
+    """
+    errors = []
+    parsed = []
+    for index, item in enumerate(items):
+        result = _parse_item(item)
+        if isinstance(result, str):
+            errors.append({'index': index, 'error': result})
+        else:
+            parsed.append((index, *result))
+
+    mask = _coordinates_mask([float(p[2]) for p in parsed], [float(p[3]) for p in parsed])
+    by_run = {}
+    now = timezone.now()
+    for ok, (index, run_id, latitude, longitude, created_at) in zip(mask, parsed):
+        if not ok:
+            errors.append({'index': index, 'error': COORDINATES_ERROR})
+        else:
+            by_run.setdefault(run_id, []).append((index, latitude, longitude, created_at))
+
+    created = dropped = 0
+    runs = Run.objects.in_bulk(list(by_run))
+    for run_id, points in by_run.items():
+        run = runs.get(run_id)
+        error = None
+        if run is None:
+            error = f'Забег {run_id} не найден'
+        elif run.status != 'in_progress':
+            error = 'Забег должен быть в статусе "in progress"'
+        else:
+            with transaction.atomic():
+                # блокируем забег так же, как PositionViewSet.perform_create, и проверяем статус еще раз
+                run = Run.objects.select_for_update().get(id=run_id)
+                if run.status != 'in_progress':
+                    error = 'Забег должен быть в статусе "in progress"'
+                else:
+                    reasons = filter_positions(run, [p[1] for p in points], [p[2] for p in points], [p[3] for p in points])
+                    kept = [point for point, reason in zip(points, reasons) if reason is None]
+                    Position.objects.bulk_create(
+                        (Position(run=run, latitude=lat, longitude=lon, created_at=time or now) for _, lat, lon, time in kept),
+                        batch_size=chunk_size,
+                    )
+                    append_positions(run, [float(p[1]) for p in kept], [float(p[2]) for p in kept])
+                    created += len(kept)
+                    dropped += len(points) - len(kept)
+        if error:
+            errors.extend({'index': index, 'error': error} for index, *_ in points)
+
+    errors.sort(key=lambda e: e['index'])
+    return created, dropped, errors
@@ -0,0 +1,29 @@
+import importlib
+import importlib.util
+
+
+# Отложенный импорт тяжелых необязательных библиотек (numpy ~100 мс).
+# На холодном старте (Lambda) процесс должен подняться как можно быстрее, а numpy нужен только
+# при расчете дистанции и аналитики - поэтому модуль импортируется при первом обращении к его атрибуту.
+# Проверка "установлен ли" (lazy_import(...) is None) при этом ничего не импортирует
+
+
+class LazyModule:
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        # вызывается, только если атрибута еще нет - дальше он берется из __dict__ без импорта
+        value = getattr(importlib.import_module(self._name), attr)
+        setattr(self, attr, value)
+        return value
+
+    def __repr__(self):
+        return f'<LazyModule {self._name}>'
+
+
+def lazy_import(name):
+    """LazyModule для модуля name или None, если он не установлен (сам модуль при этом не импортируется)"""
+    if importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
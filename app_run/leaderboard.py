@@ -0,0 +1,151 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DateField, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from app_run.models import Run, LeaderboardEntry
+
+
+# Таблица лидеров. Итоги атлета хранятся по "корзинам" времени (неделя, месяц, все время)
+# в LeaderboardEntry и увеличиваются при остановке каждого забега, поэтому:
+# - топ-N - это чтение первых N строк по индексу (period, bucket, -показатель);
+# - "мое место" - COUNT атлетов с большим значением по тому же индексу (см. rank_in_bucket).
+#   Это диапазон индекса перед атлетом: чем ниже место, тем длиннее диапазон (цифры - manage.py bench_leaderboard),
+#   зато место всегда точное и записи при остановке забега не становятся дороже;
+# - размер корзины (total) меняется редко и кэшируется на LEADERBOARD_TOTAL_TTL секунд
+
+PERIODS = ('week', 'month', 'all')
+METRICS = ('distance', 'runs')
+ALL_TIME = date(1970, 1, 1) # единственная корзина периода 'all'
+
+
+def bucket_start(period, day):
+    """Начало корзины периода period, в которую попадает день day"""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return ALL_TIME
+
+
+def record_run(run):
+    """
+    Учитывает законченный забег в таблице лидеров: по строке на каждый период, двумя запросами.
+    Увеличение идет через F(), поэтому параллельные остановки забегов ничего не теряют
+    """
+    buckets = _buckets_of(run)
+    LeaderboardEntry.objects.bulk_create(
+        [LeaderboardEntry(athlete_id=run.athlete_id, period=period, bucket=bucket) for period, bucket in buckets.items()],
+        ignore_conflicts=True,
+    )
+    _entries_of(run, buckets).update(
+        runs=F('runs') + 1,
+        distance=F('distance') + (run.distance or 0),
+    )
+
+
+def add_distance(run, delta):
+    """Поправка дистанции уже учтенного забега (правка или удаление точки законченного забега)"""
+    _entries_of(run, _buckets_of(run)).update(distance=F('distance') + delta)
+
+
+def _buckets_of(run):
+    day = timezone.localdate(run.created_at)
+    return {period: bucket_start(period, day) for period in PERIODS}
+
+
+def _entries_of(run, buckets):
+    condition = Q()
+    for period, bucket in buckets.items():
+        condition |= Q(period=period, bucket=bucket)
+    return LeaderboardEntry.objects.filter(condition, athlete_id=run.athlete_id)
+
+
+def rank_in_bucket(metric, period, bucket, value):
+    """
+    Место значения value: 1 + сколько атлетов корзины строго впереди (при равенстве места одинаковые).
+    COUNT по индексу (period, bucket, -показатель) - читается только диапазон индекса перед value,
+    ничего не держится в кэше и не пересчитывается при каждом новом забеге
+    """
+    return LeaderboardEntry.objects.filter(period=period, bucket=bucket, **{f'{metric}__gt': value}).count() + 1
+
+
+def bucket_size(period, bucket):
+    """Сколько атлетов в корзине. Из кэша - может отставать на LEADERBOARD_TOTAL_TTL секунд"""
+    key = f'app_run:leaderboard_total:{period}:{bucket.isoformat()}'
+    total = cache.get(key)
+    if total is None:
+        total = LeaderboardEntry.objects.filter(period=period, bucket=bucket).count()
+        cache.set(key, total, timeout=settings.LEADERBOARD_TOTAL_TTL)
+    return total
+
+
+def top(metric, period, bucket, size=10):
+    """Первые size атлетов корзины: список dict с rank, athlete_id, username, value"""
+    entries = LeaderboardEntry.objects.filter(period=period, bucket=bucket).select_related('athlete').order_by(
+        f'-{metric}', 'athlete_id'
+    )[:size]
+    rows = []
+    for position, entry in enumerate(entries, start=1):
+        value = getattr(entry, metric)
+        # все, кто впереди, - выше в этом же списке, поэтому место считается без запросов
+        rank = rows[-1]['rank'] if rows and rows[-1]['value'] == value else position
+        rows.append({'rank': rank, 'athlete_id': entry.athlete_id, 'username': entry.athlete.username, 'value': value})
+    return rows
+
+
+def athlete_rank(athlete_id, metric, period, bucket):
+    """Место атлета в корзине (dict как у top() плюс total - сколько всего атлетов) или None, если забегов нет"""
+    entry = LeaderboardEntry.objects.filter(period=period, bucket=bucket, athlete_id=athlete_id).select_related(
+        'athlete'
+    ).first()
+    if entry is None:
+        return None
+    value = getattr(entry, metric)
+    rank = rank_in_bucket(metric, period, bucket, value)
+    return {
+        'rank': rank,
+        'athlete_id': entry.athlete_id,
+        'username': entry.athlete.username,
+        'value': value,
+        'total': max(bucket_size(period, bucket), rank), # кэш мог не застать новых атлетов
+    }
+
+
+def collect_entries():
+    """
+    Вся таблица лидеров с нуля по законченным забегам (объекты LeaderboardEntry без сохранения).
+    По одному агрегирующему запросу на период
+    """
+    finished = Run.objects.filter(status='finished')
+    entries = []
+    for period, trunc in (('week', TruncWeek), ('month', TruncMonth), ('all', None)):
+        rows = finished
+        if trunc is not None:
+            rows = rows.annotate(bucket=trunc('created_at', output_field=DateField()))
+            rows = rows.values('athlete', 'bucket')
+        else:
+            rows = rows.values('athlete')
+        rows = rows.annotate(runs=Count('id'), total=Coalesce(Sum('distance'), 0.0)).order_by()
+        for row in rows.iterator():
+            entries.append(LeaderboardEntry(
+                athlete_id=row['athlete'],
+                period=period,
+                bucket=row.get('bucket', ALL_TIME),
+                runs=row['runs'],
+                distance=row['total'],
+            ))
+    return entries
+
+
+def rebuild_leaderboard(batch_size=1000):
+    """Полностью пересобирает таблицу лидеров, возвращает кол-во строк"""
+    entries = collect_entries()
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+        LeaderboardEntry.objects.bulk_create(entries, batch_size=batch_size)
+    return len(entries)
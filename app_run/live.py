@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import weakref
+
+from django.conf import settings
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from app_run.fastpath import as_datetime
+from app_run.models import Run, Position
+
+
+# Живая трансляция забега для зрителей (SSE, /api/runs/<id>/live/).
+# На каждый забег в процессе работает ОДНА задача RunFeed: раз в LIVE_POLL_INTERVAL секунд
+# она одним запросом забирает новые точки и одним - дистанцию и статус забега,
+# и раздает события во все очереди подписчиков. Сколько бы зрителей ни было,
+# запросов к БД столько же, сколько при одном. Зрителей нет - задача завершается.
+# Асинхронная загрузка точек (app_run/async_views.py) будит задачу сразу, не дожидаясь интервала
+
+logger = logging.getLogger(__name__)
+
+_feeds = weakref.WeakKeyDictionary() # цикл событий -> {run_id: RunFeed}
+
+
+def _loop_feeds():
+    return _feeds.setdefault(asyncio.get_running_loop(), {})
+
+
+def format_event(event, data, event_id=None):
+    """Одно событие в формате text/event-stream"""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append('data: ' + json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+
+def _positions(run_id, **filters):
+    return Position.objects.filter(run_id=run_id, **filters).order_by('id').values_list(
+        'id', Cast('latitude', FloatField()), Cast('longitude', FloatField()), 'created_at'
+    )
+
+
+def _position_event(row):
+    position_id, lat, lon, created_at = row
+    data = {'id': position_id, 'latitude': lat, 'longitude': lon, 'created_at': as_datetime(created_at)}
+    return format_event('position', data, event_id=position_id)
+
+
+class RunFeed:
+    def __init__(self, run_id, last_position_id):
+        self.run_id = run_id
+        self.last_position_id = last_position_id
+        self.subscribers = set()
+        self.wakeup = asyncio.Event()
+        self.state = None # (status, distance) - чтобы слать 'run' только при изменении
+        self.task = asyncio.create_task(self._run())
+
+    async def _poll(self):
+        events = []
+        async for row in _positions(self.run_id, id__gt=self.last_position_id):
+            events.append(_position_event(row))
+            self.last_position_id = row[0]
+
+        state = await Run.objects.filter(id=self.run_id).values_list('status', 'distance').afirst()
+        if state != self.state:
+            self.state = state
+            status, distance = state if state else ('deleted', None)
+            events.append(format_event('run', {'status': status, 'distance': distance}))
+        return events
+
+    async def _run(self):
+        try:
+            while self.subscribers:
+                for event in await self._poll():
+                    self.publish(event)
+                if self.state is None or self.state[0] == 'finished':
+                    break # забег закончен (или удален)
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), settings.LIVE_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        except Exception:
+            logger.exception('Трансляция забега %s остановлена из-за ошибки', self.run_id)
+        finally:
+            # закрываем все потоки, как бы ни завершилась задача - иначе зрители получали бы ping вечно.
+            # Переподключившись, зритель получит новую трансляцию
+            self.publish(None)
+            feeds = _loop_feeds()
+            if feeds.get(self.run_id) is self:
+                del feeds[self.run_id]
+
+    def publish(self, event):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # зритель не успевает читать - отключаем его, а не копим события в памяти
+                # (он переподключится с Last-Event-ID и получит пропущенные точки)
+                self.subscribers.discard(queue)
+
+
+def notify(run_id):
+    """Новые точки забега только что сохранены - разбудить его трансляцию (если она есть в этом процессе)"""
+    feed = _loop_feeds().get(run_id)
+    if feed is not None:
+        feed.wakeup.set()
+
+
+async def subscribe(run_id, last_event_id=None):
+    """
+    Асинхронный генератор событий SSE забега. last_event_id - id последней полученной точки
+    (заголовок Last-Event-ID при переподключении): пропущенные точки придут первыми
+    """
+    queue = asyncio.Queue(maxsize=settings.LIVE_QUEUE_SIZE)
+    feeds = _loop_feeds()
+    feed = feeds.get(run_id)
+    if feed is None:
+        # новая трансляция начинается с текущего момента: точки до нее зритель берет из /api/positions/?run=
+        last = await Position.objects.filter(run_id=run_id).order_by('-id').values_list('id', flat=True).afirst()
+        feed = feeds.get(run_id) # пока ждали запрос, трансляцию мог создать другой зритель
+        if feed is None:
+            feed = feeds[run_id] = RunFeed(run_id, last or 0)
+    # все, что новее upto, придет через очередь, а пропущенное до upto догоняем сами (без await между ними)
+    upto = feed.last_position_id
+    feed.subscribers.add(queue)
+    feed.wakeup.set() # новому зрителю сразу нужно текущее состояние забега
+
+    try:
+        if last_event_id is not None and last_event_id < upto:
+            # догоняем пропущенное отдельным запросом - это только при подключении, не на каждое событие
+            async for row in _positions(run_id, id__gt=last_event_id, id__lte=upto):
+                yield _position_event(row)
+        if feed.state is not None:
+            yield format_event('run', {'status': feed.state[0], 'distance': feed.state[1]})
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), settings.LIVE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                if queue not in feed.subscribers:
+                    break
+                yield ': ping\n\n' # комментарий SSE, чтобы прокси не закрывали соединение
+                continue
+            if event is None or queue not in feed.subscribers:
+                break
+            yield event
+    finally:
+        feed.subscribers.discard(queue)
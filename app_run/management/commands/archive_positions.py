@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from app_run.archive import archive_finished_runs, restore_run
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    help = ('Переносит точки законченных забегов из Position в архив PositionArchive. '
+            'Каждый забег - отдельная короткая транзакция, команду можно прервать и запустить снова. '
+            'На Postgres после большого переноса стоит сделать VACUUM таблицы app_run_position')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Сколько забегов перенести за один запуск')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='По сколько точек копировать за раз')
+        parser.add_argument('--pause', type=float, default=0, help='Пауза между забегами в секундах')
+        parser.add_argument('--restore', type=int, nargs='+', metavar='RUN_ID',
+                            help='Вместо переноса вернуть точки указанных забегов из архива в Position')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            for run in Run.objects.filter(id__in=options['restore']):
+                self.stdout.write(f'Забег {run.id}: возвращено точек {restore_run(run, options["chunk_size"])}')
+            return
+
+        runs, points = archive_finished_runs(options['limit'], options['chunk_size'], options['pause'])
+        self.stdout.write(f'Перенесено в архив забегов: {runs}, точек: {points}')
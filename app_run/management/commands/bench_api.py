@@ -0,0 +1,60 @@
+import json
+import platform
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from app_run.benchmark import ENDPOINTS, seed, run_benchmark, over_budget
+
+
+class Command(BaseCommand):
+    help = ('Бенчмарк горячих точек АПИ на синтетических данных: время и кол-во SQL-запросов на эндпоинт. '
+            'Данные создаются в транзакции, которая в конце откатывается. '
+            'Превышение бюджета запросов - ошибка (код возврата 1)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--athletes', type=int, default=100)
+        parser.add_argument('--runs', type=int, default=10, help='забегов на атлета')
+        parser.add_argument('--positions', type=int, default=50, help='точек на забег')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=None)
+        parser.add_argument('--output', help='куда записать результаты в JSON')
+        parser.add_argument('--compare', help='JSON с прошлыми результатами, чтобы показать изменения')
+
+    def handle(self, *args, **options):
+        if 'debug_toolbar' in settings.INSTALLED_APPS:
+            self.stderr.write('Включен debug_toolbar (settings/local.py) - он сильно замедляет каждый ответ, '
+                              'время будет завышено. Кол-во SQL-запросов от этого не меняется')
+        with transaction.atomic():
+            athlete_ids = seed(options['athletes'], options['runs'], options['positions'])
+            results = run_benchmark(athlete_ids, options['repeat'], options['endpoints'])
+            transaction.set_rollback(True)
+
+        previous = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                previous = json.load(f)['endpoints']
+
+        for name, result in results.items():
+            line = (f'{name:<16} median {result["median_ms"]:9.2f} мс | p95 {result["p95_ms"]:9.2f} мс | '
+                    f'SQL {result["queries"]:>3} (бюджет {result["budget"]})')
+            if name in previous and previous[name]['median_ms']:
+                line += f' | было {previous[name]["median_ms"]:.2f} мс ({result["median_ms"] / previous[name]["median_ms"]:.2f}x)'
+            self.stdout.write(line)
+
+        if options['output']:
+            report = {
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'data': {key: options[key] for key in ('athletes', 'runs', 'positions', 'repeat')},
+                'endpoints': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        problems = over_budget(results)
+        if problems:
+            raise CommandError('\n'.join(f'{name}: {problem}' for name, problem in problems))
@@ -0,0 +1,63 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from haversine import haversine
+
+from app_run import distance
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк расчета дистанции трека: старый способ (haversine на каждую пару) против app_run.distance'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        for size in options['sizes']:
+            # синтетический трек: случайное блуждание с шагом ~10 м, координаты как в БД (Decimal, 4 знака)
+            lat, lon = 55.7558, 37.6173
+            points = []
+            for _ in range(size):
+                lat += random.uniform(-0.0001, 0.0001)
+                lon += random.uniform(-0.0001, 0.0001)
+                points.append((Decimal(f'{lat:.4f}'), Decimal(f'{lon:.4f}')))
+
+            legacy_time, legacy = self._timeit(options['repeat'], self._legacy, points)
+
+            # новый способ получает из БД уже float-ы (Cast в запросе), поэтому конвертацию не считаем
+            latitudes = [float(p[0]) for p in points]
+            longitudes = [float(p[1]) for p in points]
+            python_time, python_result = self._timeit(
+                options['repeat'], distance.track_distance, latitudes, longitudes, False
+            )
+            line = (f'{size:>7} точек: haversine() {legacy_time * 1000:9.2f} мс | '
+                    f'python {python_time * 1000:9.2f} мс')
+            results = [python_result]
+
+            if distance.np is not None:
+                numpy_time, numpy_result = self._timeit(
+                    options['repeat'], distance.track_distance, latitudes, longitudes, True
+                )
+                line += f' | numpy {numpy_time * 1000:9.2f} мс'
+                results.append(numpy_result)
+
+            max_diff = max(abs(result - legacy) for result in results)
+            self.stdout.write(f'{line} | {legacy:.3f} км, расхождение {max_diff:.2e} км')
+
+    @staticmethod
+    def _legacy(points):
+        # ровно то, что раньше делал StopRunAPIView
+        return sum(haversine(points[i], points[i + 1]) for i in range(len(points) - 1))
+
+    @staticmethod
+    def _timeit(repeat, func, *args):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
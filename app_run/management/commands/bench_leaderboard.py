@@ -0,0 +1,116 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from app_run.leaderboard import bucket_start, rebuild_leaderboard, record_run, top, athlete_rank
+from app_run.models import Run, LeaderboardEntry
+
+
+class Command(BaseCommand):
+    help = ('Бенчмарк таблицы лидеров: агрегация по всей таблице Run на каждый запрос против LeaderboardEntry. '
+            'Синтетические данные создаются в транзакции, которая в конце откатывается')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--athletes', type=int, default=100_000)
+        parser.add_argument('--runs', type=int, default=10_000_000)
+        parser.add_argument('--days', type=int, default=60, help='забеги распределяются по последним N дням')
+        parser.add_argument('--batch', type=int, default=10_000)
+        parser.add_argument('--lookups', type=int, default=1000, help='сколько раз искать "мое место"')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            athlete_ids = self._seed(options)
+            self._bench(athlete_ids, options)
+            transaction.set_rollback(True)
+
+    def _seed(self, options):
+        start = time.perf_counter()
+        User.objects.bulk_create(
+            (User(username=f'bench_lb_{i}', password='!') for i in range(options['athletes'])),
+            batch_size=options['batch'],
+        )
+        athlete_ids = list(User.objects.filter(username__startswith='bench_lb_').values_list('id', flat=True))
+
+        now = timezone.now()
+        seconds = options['days'] * 86400
+        left = options['runs']
+        while left > 0:
+            size = min(left, options['batch'])
+            Run.objects.bulk_create([
+                Run(
+                    athlete_id=random.choice(athlete_ids),
+                    comment='',
+                    status='finished',
+                    created_at=now - timedelta(seconds=random.randrange(seconds)),
+                    distance=random.uniform(1, 20),
+                )
+                for _ in range(size)
+            ])
+            left -= size
+        self.stdout.write(f'Данные: {len(athlete_ids)} атлетов, {options["runs"]} забегов '
+                          f'({time.perf_counter() - start:.1f} с)')
+        return athlete_ids
+
+    def _bench(self, athlete_ids, options):
+        week = bucket_start('week', timezone.localdate())
+        week_runs = Run.objects.filter(status='finished', created_at__date__gte=week)
+        sample = random.sample(athlete_ids, min(options['lookups'], len(athlete_ids)))
+
+        # как было бы "в лоб": GROUP BY по таблице Run на каждый запрос
+        naive_top, _ = self._timeit(lambda: list(
+            week_runs.values('athlete').annotate(total=Sum('distance')).order_by('-total')[:10]
+        ))
+        naive_rank, _ = self._timeit(lambda: self._naive_rank(week_runs, sample[0]))
+        self.stdout.write(f'Агрегация по Run:   топ-10 {naive_top * 1000:10.2f} мс | место атлета {naive_rank * 1000:10.2f} мс')
+
+        rebuild_time, rows = self._timeit(rebuild_leaderboard)
+        self.stdout.write(f'Пересборка таблицы лидеров: {rebuild_time:.1f} с, строк {rows}')
+
+        top_time, _ = self._timeit(lambda: top('distance', 'week', week, 10))
+        cold_time, _ = self._timeit(lambda: athlete_rank(sample[0], 'distance', 'week', week))
+        start = time.perf_counter()
+        for athlete_id in sample:
+            athlete_rank(athlete_id, 'distance', 'week', week)
+        warm_time = (time.perf_counter() - start) / len(sample)
+        self.stdout.write(f'LeaderboardEntry:   топ-10 {top_time * 1000:10.2f} мс | место атлета {warm_time * 1000:10.2f} мс '
+                          f'(первое, с подсчетом размера корзины: {cold_time * 1000:.2f} мс)')
+
+        # место ищется COUNT-ом по диапазону индекса перед атлетом - смотрим, как оно дорожает к концу таблицы
+        ranked = list(LeaderboardEntry.objects.filter(period='week', bucket=week).order_by('-distance')
+                      .values_list('athlete_id', flat=True))
+        for share in (0, 0.1, 0.5, 0.9, 1):
+            index = min(int(share * len(ranked)), len(ranked) - 1)
+            athlete_id = ranked[index]
+            lookups = 20
+            start = time.perf_counter()
+            for _ in range(lookups):
+                athlete_rank(athlete_id, 'distance', 'week', week)
+            self.stdout.write(f'  место ~{index + 1} из {len(ranked)}: '
+                              f'{(time.perf_counter() - start) / lookups * 1000:.2f} мс')
+
+        runs = list(Run.objects.filter(athlete_id__in=sample[:100])[:100])
+        start = time.perf_counter()
+        for run in runs:
+            record_run(run)
+        if runs:
+            self.stdout.write(f'Учет забега при остановке: {(time.perf_counter() - start) / len(runs) * 1000:.2f} мс')
+
+    @staticmethod
+    def _naive_rank(runs, athlete_id):
+        totals = runs.values('athlete').annotate(total=Sum('distance')).order_by()
+        mine = list(totals.filter(athlete=athlete_id).values_list('total', flat=True))
+        if not mine:
+            return None
+        return totals.filter(total__gt=mine[0]).count() + 1
+
+    @staticmethod
+    def _timeit(func):
+        start = time.perf_counter()
+        result = func()
+        return time.perf_counter() - start, result
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from app_run.benchmark import seed
+from app_run.fastpath import FastJSONRenderer, RunValuesSerializer, PositionValuesSerializer, orjson
+from app_run.models import Run, Position
+from app_run.serializers import RunSerializer, PositionSerializer
+
+
+class Command(BaseCommand):
+    help = ('Бенчмарк сериализации списков: ModelSerializer + JSONRenderer против .values() + '
+            'быстрых сериализаторов (app_run/fastpath.py). Данные создаются в транзакции, которая откатывается')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000, help='сколько забегов и точек сериализовать')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            seed(athletes=max(1, rows // 10), runs=10, positions=1)
+            cases = [
+                ('runs', Run.objects.select_related('athlete').order_by('id')[:rows], RunSerializer, RunValuesSerializer),
+                ('positions', Position.objects.order_by('id')[:rows], PositionSerializer, PositionValuesSerializer),
+            ]
+            self.stdout.write(f'orjson: {"есть" if orjson is not None else "нет (FastJSONRenderer = JSONRenderer)"}')
+            for name, queryset, model_serializer, values_serializer in cases:
+                old = self._best(options['repeat'], lambda: JSONRenderer().render(
+                    model_serializer(list(queryset), many=True).data
+                ))
+                serializer = values_serializer()
+                new = self._best(options['repeat'], lambda: FastJSONRenderer().render(
+                    serializer.to_representation(queryset.values(*serializer.columns()))
+                ))
+                same = (JSONRenderer().render(model_serializer(list(queryset), many=True).data)
+                        == FastJSONRenderer().render(serializer.to_representation(queryset.values(*serializer.columns()))))
+                self.stdout.write(f'{name:<10} {rows} строк: ModelSerializer {old * 1000:9.1f} мс | '
+                                  f'values {new * 1000:9.1f} мс | {old / new:5.1f}x | вывод совпадает: {same}')
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def _best(repeat, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,57 @@
+import json
+import platform
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from app_run.benchmark import write_throughput
+
+
+class Command(BaseCommand):
+    help = ('Пропускная способность записи точек (POST /api/positions/) при разных CONN_MAX_AGE: '
+            '0 - новое соединение на каждый запрос, N секунд или none - переиспользование. '
+            'Запускать на копии боевой БД (Postgres): данные пишутся по-настоящему и удаляются в конце')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--conn-max-age', nargs='+', default=['0', '60'],
+                            help='значения CONN_MAX_AGE для сравнения (none - без ограничения)')
+        parser.add_argument('--health-checks', action='store_true', help='включить CONN_HEALTH_CHECKS')
+        parser.add_argument('--output', help='куда записать результаты в JSON')
+        parser.add_argument('--compare', help='JSON с прошлыми результатами, чтобы показать изменения')
+
+    def handle(self, *args, **options):
+        if 'debug_toolbar' in settings.INSTALLED_APPS:
+            self.stderr.write('Включен debug_toolbar (settings/local.py) - он сильно замедляет каждый ответ, '
+                              'запросов в секунду будет намного меньше')
+        if connection.vendor != 'postgresql':
+            self.stderr.write(f'БД {connection.vendor}: открыть соединение здесь почти ничего не стоит, '
+                              f'разница будет намного меньше, чем на Postgres по сети')
+        previous = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                previous = json.load(f)['results']
+
+        results = {}
+        for value in options['conn_max_age']:
+            conn_max_age = None if value.lower() == 'none' else int(value)
+            rps = write_throughput(options['requests'], conn_max_age, options['health_checks'])
+            results[value] = rps
+            line = f'CONN_MAX_AGE={value:<6} {rps:9.1f} запросов/с'
+            if previous.get(value):
+                line += f' | было {previous[value]:.1f} ({rps / previous[value]:.2f}x)'
+            self.stdout.write(line)
+
+        if options['output']:
+            report = {
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'requests': options['requests'],
+                'health_checks': options['health_checks'],
+                'results': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app_run.finalize import drain
+from app_run.models import RunFinalizeJob
+
+
+class Command(BaseCommand):
+    help = ('Выполняет задачи подсчета итогов забегов, которые ждут в очереди '
+            '(не успел пул потоков, процесс перезапускался, подошло время повтора)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Сколько задач выполнить максимум')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Вернуть в очередь задачи, у которых закончились попытки')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            returned = RunFinalizeJob.objects.filter(status='failed').update(
+                status='pending', attempts=0, next_attempt_at=timezone.now()
+            )
+            self.stdout.write(f'Возвращено в очередь задач: {returned}')
+        done, errors = drain(options['limit'])
+        self.stdout.write(f'Выполнено задач: {done}, с ошибкой: {errors}')
+
+        # у этих забегов попытки кончились - они остаются в статусе 'finalizing', пока задачу не вернут в очередь
+        failed = RunFinalizeJob.objects.filter(status='failed').order_by('run_id').values_list('run_id', 'last_error')
+        for run_id, last_error in failed:
+            self.stderr.write(f'Забег {run_id}: итоги не посчитаны ({last_error})')
+        if failed:
+            self.stderr.write('Вернуть их в очередь: manage.py drain_finalize_queue --retry-failed')
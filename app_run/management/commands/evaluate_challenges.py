@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_run.challenges import backfill_challenges
+
+
+class Command(BaseCommand):
+    help = 'Проверяет правила челленджей для всех атлетов и выдает недостающие челленджи'
+
+    def handle(self, *args, **options):
+        athletes, challenges = backfill_challenges()
+        self.stdout.write(f'Проверено атлетов: {athletes}, положено челленджей: {challenges} (уже выданные не дублируются)')
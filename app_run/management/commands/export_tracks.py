@@ -0,0 +1,37 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from app_run.export import WRITERS, export_track
+from app_run.models import Run
+
+
+class Command(BaseCommand):
+    help = 'Выгружает треки всех забегов за период (по дате создания забега) в файлы run_<id>.<формат>'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', required=True, help='Дата начала, YYYY-MM-DD (включительно)')
+        parser.add_argument('--to', dest='date_to', required=True, help='Дата конца, YYYY-MM-DD (включительно)')
+        parser.add_argument('--format', choices=sorted(WRITERS), default='gpx')
+        parser.add_argument('--dir', default='export', help='Папка для файлов')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='По сколько точек читать из БД')
+
+    def handle(self, *args, **options):
+        date_from, date_to = parse_date(options['date_from']), parse_date(options['date_to'])
+        if date_from is None or date_to is None:
+            raise CommandError('Даты нужно указывать в формате YYYY-MM-DD')
+        directory = Path(options['dir'])
+        directory.mkdir(parents=True, exist_ok=True)
+
+        runs = Run.objects.filter(created_at__date__gte=date_from, created_at__date__lte=date_to).order_by('id')
+        started = time.perf_counter()
+        exported = 0
+        for run in runs.iterator(chunk_size=100):
+            path = directory / f'run_{run.id}.{options["format"]}'
+            with open(path, 'w', encoding='utf-8') as file:
+                for chunk in export_track(run, options['format'], options['chunk_size']):
+                    file.write(chunk)
+            exported += 1
+        self.stdout.write(f'Выгружено забегов: {exported} в {directory} за {time.perf_counter() - started:.1f} с')
@@ -0,0 +1,51 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.importers import import_track
+# в процессы пула уходит parse_file из модуля без Django - он работает при любом способе запуска процессов
+from app_run.trackfiles import PARSERS, TrackImportError, parse_file
+
+
+class Command(BaseCommand):
+    help = ('Импортирует все файлы GPX/TCX из папки как законченные забеги атлета. '
+            'Файлы разбираются параллельно в пуле процессов, в БД пишет основной процесс')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--athlete', type=int, required=True, help='id атлета')
+        parser.add_argument('--workers', type=int, default=None, help='Процессов для разбора (по умолчанию - по числу CPU)')
+
+    def handle(self, *args, **options):
+        athlete = User.objects.filter(id=options['athlete']).first()
+        if athlete is None:
+            raise CommandError(f'Нет юзера с id {options["athlete"]}')
+        files = sorted(p for p in Path(options['directory']).iterdir() if p.suffix.lower().lstrip('.') in PARSERS)
+        if not files:
+            raise CommandError('В папке нет файлов .gpx или .tcx')
+
+        started = time.perf_counter()
+        imported = points = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {pool.submit(parse_file, path): path for path in files}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    track = future.result()
+                    run = import_track(athlete, track)
+                except TrackImportError as e:
+                    failed += 1
+                    self.stderr.write(f'{path.name}: {e}')
+                    continue
+                imported += 1
+                points += len(track['latitudes'])
+                self.stdout.write(f'{path.name}: забег {run.id}, точек {len(track["latitudes"])}, {run.distance:.2f} км')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Импортировано файлов: {imported} (ошибок: {failed}), точек: {points} '
+            f'за {elapsed:.1f} с - {points / elapsed:.0f} точек/с'
+        )
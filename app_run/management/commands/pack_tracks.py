@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from app_run.models import Run, Position
+from app_run.track import pack_run, unpack_run
+
+
+class Command(BaseCommand):
+    help = ('Упаковывает треки законченных забегов в Run.track и удаляет их строки Position. '
+            'На Postgres после большой упаковки стоит сделать VACUUM таблицы app_run_position')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simplify', type=float, default=None,
+                            help='Допуск упрощения Дугласа-Пекера в метрах (по умолчанию без упрощения)')
+        parser.add_argument('--limit', type=int, default=None, help='Сколько забегов упаковать за один запуск')
+        parser.add_argument('--unpack', type=int, nargs='+', metavar='RUN_ID',
+                            help='Вместо упаковки восстановить строки Position у указанных забегов')
+
+    def handle(self, *args, **options):
+        if options['unpack']:
+            for run in Run.objects.filter(id__in=options['unpack']):
+                self.stdout.write(f'Забег {run.id}: восстановлено точек {unpack_run(run)}')
+            return
+
+        runs = Run.objects.filter(status='finished', track__isnull=True).filter(
+            Exists(Position.objects.filter(run=OuterRef('pk')))
+        ).order_by('id').only('id')
+        if options['limit']:
+            runs = runs[:options['limit']]
+
+        packed = points = size = 0
+        for run in list(runs):
+            result = pack_run(run, options['simplify'])
+            if result is None:
+                continue
+            packed += 1
+            points += result[0]
+            size += result[1]
+        self.stdout.write(f'Упаковано забегов: {packed}, точек в треках: {points}, размер треков: {size} байт')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from app_run.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = 'Удаляет сохраненные ответы на запросы с Idempotency-Key старше IDEMPOTENCY_KEY_TTL (запускать по крону)'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Удалено ключей: {purge_expired_keys()}')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from app_run.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает статистику атлетов (AthleteStats) с нуля по законченным забегам'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Статистика пересобрана, атлетов: {rebuild_stats()}')
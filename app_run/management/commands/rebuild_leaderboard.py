@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from app_run.leaderboard import rebuild_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает таблицу лидеров (LeaderboardEntry) с нуля по законченным забегам'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Таблица лидеров пересобрана, строк: {rebuild_leaderboard()}')
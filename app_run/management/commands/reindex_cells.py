@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app_run.nearby import reindex_cells
+
+
+class Command(BaseCommand):
+    help = 'Заново считает ячейки сетки у всех точек и точки старта забегов (после смены GEO_CELL_DEGREES)'
+
+    def handle(self, *args, **options):
+        positions, runs = reindex_cells()
+        self.stdout.write(f'Ячейки пересчитаны: точек {positions}, забегов {runs}')
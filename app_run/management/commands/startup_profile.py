@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_run.startup import profile_startup
+
+
+class Command(BaseCommand):
+    help = ('Профиль холодного старта: время подъема WSGI-приложения и загрузки urls.py в отдельном процессе '
+            'и время импорта по модулям и пакетам (python -X importtime)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profile-settings', default=None,
+                            help='Модуль настроек для замера, например project_run.settings.production '
+                                 '(по умолчанию текущий)')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--top', type=int, default=20, help='Сколько самых долгих модулей показать')
+        parser.add_argument('--output', help='куда записать результаты в JSON')
+        parser.add_argument('--compare', help='JSON с прошлыми результатами, чтобы показать изменения')
+
+    def handle(self, *args, **options):
+        try:
+            result = profile_startup(options['profile_settings'], options['repeat'])
+        except RuntimeError as e:
+            raise CommandError(f'Процесс не стартовал: {e}')
+
+        previous = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                previous = json.load(f)
+
+        self.stdout.write(f'Настройки: {result["settings"]}')
+        for key, title in (('wall_ms', 'Холодный старт'), ('import_ms', 'Из них импорты')):
+            line = f'{title}: {result[key]:.1f} мс (медиана из {options["repeat"]})'
+            if previous and previous.get(key):
+                line += f' | было {previous[key]:.1f} мс ({result[key] / previous[key]:.2f}x)'
+            self.stdout.write(line)
+
+        self.stdout.write('\nПо пакетам (собственное время импорта):')
+        for package, self_us in list(result['packages'].items())[:options['top']]:
+            line = f'  {package:<30} {self_us / 1000:8.1f} мс'
+            if previous and package in previous['packages']:
+                line += f' | было {previous["packages"][package] / 1000:.1f} мс'
+            elif previous:
+                line += ' | новый'
+            self.stdout.write(line)
+        if previous:
+            gone = [package for package in previous['packages'] if package not in result['packages']]
+            if gone:
+                self.stdout.write(f'  больше не импортируются: {", ".join(gone)}')
+
+        self.stdout.write('\nМодули (вместе с вложенными импортами):')
+        modules = sorted(result['modules'].items(), key=lambda item: -item[1]['cumulative_us'])
+        for name, times in modules[:options['top']]:
+            self.stdout.write(f'  {name:<50} {times["cumulative_us"] / 1000:8.1f} мс '
+                              f'(сам {times["self_us"] / 1000:.1f} мс)')
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
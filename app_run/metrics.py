@@ -0,0 +1,214 @@
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+
+# Метрики запросов прямо в памяти процесса: для каждой вьюхи - гистограммы общего времени ответа,
+# кол-ва SQL-запросов, времени в БД и времени рендера готового ответа (JSON и т.п.), плюс простые счетчики.
+# Сериализаторы DRF работают внутри вьюхи, их время входит в общее время ответа, а не в рендер.
+# Отдаются в текстовом формате Prometheus через /api/_metrics (только суперпользователям).
+# Если процессов несколько, у каждого свои метрики - Prometheus опрашивает их по отдельности
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+# метод запроса в метках - только из этого списка, иначе клиент мог бы плодить серии своими методами
+HTTP_METHODS = {'GET', 'HEAD', 'OPTIONS', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+HISTOGRAMS = {
+    # имя: (описание, границы корзин)
+    'http_request_duration_seconds': ('Время ответа целиком', SECONDS_BUCKETS),
+    'http_request_db_queries': ('Кол-во SQL-запросов на один запрос к АПИ', QUERIES_BUCKETS),
+    'http_request_db_seconds': ('Время выполнения SQL-запросов', SECONDS_BUCKETS),
+    'http_response_render_seconds': ('Время рендера готового ответа в JSON и т.п. (после вьюхи)', SECONDS_BUCKETS),
+}
+COUNTERS = {
+    'http_responses_total': 'Кол-во ответов по кодам',
+    'positions_dropped_total': 'Кол-во точек, отброшенных при приеме как дубли или шум GPS (app_run/noise.py)',
+}
+
+_lock = threading.Lock()
+_histograms = {} # (имя, метки) -> [счетчики по корзинам..., +Inf], сумма
+_counters = {} # (имя, метки) -> значение
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def observe(name, value, **labels):
+    """Добавляет значение в гистограмму name"""
+    buckets = HISTOGRAMS[name][1]
+    key = (name, _labels(labels))
+    with _lock:
+        counts, total = _histograms.get(key) or ([0] * (len(buckets) + 1), 0.0)
+        counts[bisect_left(buckets, value)] += 1
+        _histograms[key] = (counts, total + value)
+
+
+def increment(name, value=1, **labels):
+    """Увеличивает счетчик name (счетчики из других модулей тоже сюда - описание в COUNTERS)"""
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def _format_labels(labels, extra=()):
+    items = [*labels, *extra]
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in items)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+
+def render_prometheus():
+    """Все метрики в текстовом формате Prometheus (version 0.0.4)"""
+    with _lock:
+        histograms = sorted((key, (list(counts), total)) for key, (counts, total) in _histograms.items())
+        counters = sorted(_counters.items())
+
+    lines = []
+    for name, (description, buckets) in HISTOGRAMS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), (counts, total) in histograms:
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    for name in sorted({metric for (metric, _), _ in counters} | set(COUNTERS)):
+        lines.append(f'# HELP {name} {COUNTERS.get(name, name)}')
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in counters:
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def fingerprint(sql):
+    """
+    "Отпечаток" SQL: параметры и так передаются отдельно (%s), остается свернуть списки IN (%s, %s, ...)
+    и пробелы, чтобы одинаковые по форме запросы (например, N+1 в цикле) склеились в одну строку
+    """
+    sql = re.sub(r'%s(, %s)+', '%s, ...', sql)
+    return re.sub(r'\s+', ' ', sql).strip()
+
+
+class _QueryCollector:
+    # обертка над выполнением SQL (connection.execute_wrapper): считает запросы и их время
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+            self.statements[sql] += 1
+
+
+class MetricsMiddleware:
+    """
+    Ставится первым в MIDDLEWARE. Для каждого запроса записывает в гистограммы (по маршруту urls.py и методу)
+    время ответа, кол-во SQL-запросов, время в БД и время рендера. Запросы дольше METRICS_SLOW_REQUEST_MS
+    пишутся в лог warning-ом вместе с самыми частыми SQL (по отпечаткам) - так видно N+1
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        collector = _QueryCollector()
+        request._metrics_render = None
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(collector))
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, collector)
+        return response
+
+    async def __acall__(self, request):
+        # под ASGI SQL выполняется в других потоках (sync_to_async), у каждого свое соединение -
+        # execute_wrapper отсюда их не видит, поэтому пишем только время ответа и рендера
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        start = time.perf_counter()
+        request._metrics_render = None
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, None)
+        return response
+
+    def _record(self, request, response, duration, collector):
+        match = getattr(request, 'resolver_match', None)
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        labels = {'view': match.route if match else 'unmatched', 'method': method}
+        observe('http_request_duration_seconds', duration, **labels)
+        if collector is not None:
+            observe('http_request_db_queries', collector.count, **labels)
+            observe('http_request_db_seconds', collector.seconds, **labels)
+        if request._metrics_render is not None:
+            observe('http_response_render_seconds', request._metrics_render, **labels)
+        increment('http_responses_total', status=response.status_code, **labels)
+
+        slow_ms = settings.METRICS_SLOW_REQUEST_MS
+        if slow_ms is not None and duration * 1000 >= slow_ms:
+            self._log_slow(request, labels['view'], duration, collector)
+
+    def process_template_response(self, request, response):
+        # вызывается после вьюхи, но до рендера ответа (DRF Response рендерится здесь же, в обработчике Django)
+        if settings.METRICS_ENABLED:
+            view_finished = time.perf_counter()
+
+            def rendered(response):
+                request._metrics_render = time.perf_counter() - view_finished
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def _log_slow(request, view, duration, collector):
+        if collector is None:
+            logger.warning('Медленный запрос %s %s (%s): %.0f мс', request.method, request.path, view, duration * 1000)
+            return
+        fingerprints = Counter()
+        for sql, count in collector.statements.items():
+            fingerprints[fingerprint(sql)] += count
+        top = '\n'.join(f'  {count} x {sql}' for sql, count in fingerprints.most_common(5))
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.0f мс, SQL-запросов %s (%.0f мс)\n%s',
+            request.method, request.path, view, duration * 1000, collector.count, collector.seconds * 1000, top,
+        )
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 17:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0007_run_distance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='last_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='last_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2 on 2026-10-18 17:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum, Max
+from django.db.models.functions import Coalesce
+
+
+def fill_stats(apps, schema_editor):
+    # сразу заполняем статистику по уже законченным забегам
+    Run = apps.get_model('app_run', 'Run')
+    AthleteStats = apps.get_model('app_run', 'AthleteStats')
+    rows = Run.objects.filter(status='finished').values('athlete').annotate(
+        runs_finished=Count('id'),
+        total_distance=Coalesce(Sum('distance'), 0.0),
+        last_run_at=Max('created_at'),
+    ).order_by()
+    AthleteStats.objects.bulk_create([
+        AthleteStats(
+            athlete_id=row['athlete'],
+            runs_finished=row['runs_finished'],
+            total_distance=row['total_distance'],
+            last_run_at=row['last_run_at'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0009_run_track'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AthleteStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('runs_finished', models.PositiveIntegerField(db_index=True, default=0)),
+                ('total_distance', models.FloatField(db_index=True, default=0)),
+                ('last_run_at', models.DateTimeField(blank=True, null=True)),
+                ('athlete', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2 on 2026-10-18 17:51
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+from django.db.models.functions import TruncDate
+
+
+def count_streaks(days):
+    # копия app_run.stats.count_streaks на момент миграции (миграции не импортируют код приложения):
+    # days - отсортированные уникальные даты, результат - (текущая серия, лучшая серия)
+    current = best = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous is not None and (day - previous).days == 1 else 1
+        best = max(best, current)
+        previous = day
+    return current, best
+
+
+def remove_duplicate_challenges(apps, schema_editor):
+    # раньше "10 забегов" выдавался через create, поэтому могли появиться дубли - оставляем самый первый
+    Challenge = apps.get_model('app_run', 'Challenge')
+    keep_ids = Challenge.objects.values('athlete', 'full_name').annotate(keep_id=Min('id')).values_list('keep_id', flat=True)
+    Challenge.objects.exclude(id__in=list(keep_ids)).delete()
+
+
+def fill_streaks(apps, schema_editor):
+    Run = apps.get_model('app_run', 'Run')
+    AthleteStats = apps.get_model('app_run', 'AthleteStats')
+    days = Run.objects.filter(status='finished').annotate(day=TruncDate('created_at')).values_list(
+        'athlete', 'day'
+    ).distinct().order_by('athlete', 'day')
+    days_by_athlete = {}
+    for athlete_id, day in days:
+        days_by_athlete.setdefault(athlete_id, []).append(day)
+    for athlete_id, athlete_days in days_by_athlete.items():
+        current, best = count_streaks(athlete_days)
+        AthleteStats.objects.filter(athlete_id=athlete_id).update(current_streak=current, best_streak=best)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0010_athletestats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='athletestats',
+            name='best_streak',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='athletestats',
+            name='current_streak',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_streaks, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_challenges, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='challenge',
+            constraint=models.UniqueConstraint(fields=('athlete', 'full_name'), name='unique_challenge_per_athlete'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 17:53
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0011_challenge_rules'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='run',
+            name='status',
+            field=models.CharField(choices=[('init', 'Забег инициализирован'), ('in_progress', 'Забег начат'), ('finalizing', 'Забег остановлен, идет подсчет итогов'), ('finished', 'Забег закончен')], default='init', max_length=50),
+        ),
+        migrations.CreateModel(
+            name='RunFinalizeJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Ждет обработки'), ('running', 'Обрабатывается'), ('done', 'Готово'), ('failed', 'Ошибка (попытки закончились)')], default='pending', max_length=20)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='finalize_job', to='app_run.run')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='app_run_run_status_4c3e61_idx')],
+            },
+        ),
+    ]
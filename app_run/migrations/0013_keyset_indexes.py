@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 17:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0012_run_finalize_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='position',
+            index=models.Index(fields=['run', 'created_at'], name='app_run_pos_run_id_d12f43_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['athlete', 'status', 'created_at'], name='app_run_run_athlete_70f697_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['created_at', 'id'], name='app_run_run_created_dedccc_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-18 17:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0013_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='position',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='run',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0014_created_at_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='analytics',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2 on 2026-10-18 18:01
+
+from datetime import date
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import Coalesce, TruncMonth, TruncWeek
+
+
+def fill_leaderboard(apps, schema_editor):
+    # сразу заполняем таблицу лидеров по уже законченным забегам (то же, что app_run.leaderboard.collect_entries)
+    Run = apps.get_model('app_run', 'Run')
+    LeaderboardEntry = apps.get_model('app_run', 'LeaderboardEntry')
+    finished = Run.objects.filter(status='finished')
+    entries = []
+    for period, trunc in (('week', TruncWeek), ('month', TruncMonth), ('all', None)):
+        if trunc is not None:
+            rows = finished.annotate(bucket=trunc('created_at', output_field=DateField())).values('athlete', 'bucket')
+        else:
+            rows = finished.values('athlete')
+        rows = rows.annotate(runs=Count('id'), total=Coalesce(Sum('distance'), 0.0)).order_by()
+        for row in rows:
+            entries.append(LeaderboardEntry(
+                athlete_id=row['athlete'],
+                period=period,
+                bucket=row.get('bucket', date(1970, 1, 1)),
+                runs=row['runs'],
+                distance=row['total'],
+            ))
+    LeaderboardEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0015_run_analytics'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('week', 'Неделя'), ('month', 'Месяц'), ('all', 'Все время')], max_length=10)),
+                ('bucket', models.DateField()),
+                ('runs', models.PositiveIntegerField(default=0)),
+                ('distance', models.FloatField(default=0)),
+                ('athlete', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'bucket', '-distance'], name='app_run_lea_period_92ea46_idx'), models.Index(fields=['period', 'bucket', '-runs'], name='app_run_lea_period_d97e9a_idx')],
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket', 'athlete'), name='unique_leaderboard_entry')],
+            },
+        ),
+        migrations.RunPython(fill_leaderboard, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2 on 2026-10-18 18:04
+
+import struct
+import zlib
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def cell_of(lat, lon):
+    # копия app_run.geo.cell_of на момент миграции: миграции не импортируют код приложения,
+    # иначе они сломаются, когда этот код поменяется
+    units = 10_000
+    size = max(1, round(settings.GEO_CELL_DEGREES * units))
+    columns = 360 * units // size + 1
+    row = (round(float(lat) * units) + 90 * units) // size
+    col = (round(float(lon) * units) + 180 * units) // size
+    return row * columns + col
+
+
+def track_start(blob):
+    # первая точка упакованного трека (формат - app_run/track.py): колонки широт и долгот int32 идут первыми,
+    # а первая дельта - это само значение в микроградусах
+    version, count, base_ms = struct.unpack_from('<BIq', blob)
+    if not count:
+        return None
+    payload = zlib.decompress(bytes(blob[struct.calcsize('<BIq'):]))
+    lat = struct.unpack_from('<i', payload, 0)[0] / 1_000_000
+    lon = struct.unpack_from('<i', payload, count * 4)[0] / 1_000_000
+    return lat, lon
+
+
+def fill_cells(apps, schema_editor):
+    # ячейки сетки для уже сохраненных точек и точки старта забегов (то же, что app_run.nearby.reindex_cells)
+    Position = apps.get_model('app_run', 'Position')
+    Run = apps.get_model('app_run', 'Run')
+    batch = []
+    for position_id, lat, lon in Position.objects.values_list('id', 'latitude', 'longitude').iterator(1000):
+        batch.append(Position(id=position_id, cell=cell_of(lat, lon)))
+        if len(batch) >= 1000:
+            Position.objects.bulk_update(batch, ['cell'])
+            batch = []
+    Position.objects.bulk_update(batch, ['cell'])
+
+    first_ids = Position.objects.values('run').annotate(first_id=Min('id')).order_by().values_list('first_id', flat=True)
+    runs = [
+        Run(id=run_id, start_latitude=float(lat), start_longitude=float(lon), start_cell=cell_of(lat, lon))
+        for run_id, lat, lon in Position.objects.filter(id__in=first_ids).values_list('run_id', 'latitude', 'longitude')
+    ]
+    # у забегов с упакованным треком (Run.track) строк Position нет - старт берем из самого трека
+    # (архива точек, PositionArchive, на момент этой миграции еще нет - он появляется в 0019)
+    for run_id, blob in Run.objects.filter(track__isnull=False).values_list('id', 'track').iterator(1000):
+        start = track_start(blob)
+        if start is not None:
+            runs.append(Run(id=run_id, start_latitude=start[0], start_longitude=start[1], start_cell=cell_of(*start)))
+    Run.objects.bulk_update(runs, ['start_latitude', 'start_longitude', 'start_cell'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0016_leaderboard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='position',
+            name='cell',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='start_cell',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='start_latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='run',
+            name='start_longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 18:15
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0018_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='positions_archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='PositionArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('latitude', models.DecimalField(decimal_places=4, max_digits=6)),
+                ('longitude', models.DecimalField(decimal_places=4, max_digits=7)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('cell', models.BigIntegerField(blank=True, db_index=True, null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app_run.run')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['run', 'created_at'], name='app_run_pos_run_id_f3d2b8_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 18:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_run', '0019_position_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='run',
+            index=models.Index(fields=['athlete', 'created_at', 'distance'], name='app_run_run_athlete_896cf1_idx'),
+        ),
+    ]
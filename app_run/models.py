@@ -1,9 +1,13 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+
+from app_run.geo import cell_of
 
 # Create your models here.
 class Run(models.Model):
-    created_at = models.DateTimeField(auto_now_add=True)
+    # default вместо auto_now_add - чтобы при импорте трека из файла можно было указать реальное время забега
+    created_at = models.DateTimeField(default=timezone.now)
     comment = models.TextField()
     athlete = models.ForeignKey(User, on_delete=models.CASCADE)
 
@@ -11,6 +15,7 @@ class Run(models.Model):
     STATUS_CHOICES = {
         'init': 'Забег инициализирован',
         'in_progress': 'Забег начат',
+        'finalizing': 'Забег остановлен, идет подсчет итогов', # см. app_run/finalize.py
         'finished': 'Забег закончен',
     }
     status = models.CharField(choices=STATUS_CHOICES, max_length=50, default='init')
@@ -18,6 +23,41 @@ class Run(models.Model):
     # Задача №12. Добавляем в модель поле 'distance'
     distance = models.FloatField(blank=True, null=True)
 
+    # Последняя принятая точка забега. Нужна, чтобы при каждой новой Position
+    # прибавлять к distance только один отрезок, а не пересчитывать весь трек
+    last_latitude = models.FloatField(blank=True, null=True)
+    last_longitude = models.FloatField(blank=True, null=True)
+
+    # Точка старта (первая точка трека) и ее ячейка сетки - для поиска забегов рядом (app_run/nearby.py)
+    start_latitude = models.FloatField(blank=True, null=True)
+    start_longitude = models.FloatField(blank=True, null=True)
+    start_cell = models.BigIntegerField(blank=True, null=True, db_index=True)
+
+    # Упакованный трек законченного забега (см. app_run/track.py).
+    # Если он есть, то строк Position у забега уже нет - точки хранятся здесь
+    track = models.BinaryField(blank=True, null=True)
+
+    # Закэшированная аналитика законченного забега (сплиты, скорость и т.п., см. app_run/analytics.py)
+    analytics = models.JSONField(blank=True, null=True)
+
+    # Точки законченного забега перенесены из Position в архив PositionArchive (см. app_run/archive.py)
+    positions_archived = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # для списка забегов атлета с фильтром по статусу и keyset-пагинацией по created_at
+            models.Index(fields=['athlete', 'status', 'created_at']),
+            models.Index(fields=['created_at', 'id']),
+            # для диапазонов дат и итогов по периодам (/api/runs/summary/) по одному атлету:
+            # distance в конце индекса - сумма считается по индексу, не читая саму таблицу
+            models.Index(fields=['athlete', 'created_at', 'distance']),
+        ]
+
+    def positions(self):
+        """Точки забега (строки) - из оперативной таблицы Position или из архива, смотря где они сейчас"""
+        model = PositionArchive if self.positions_archived else Position
+        return model.objects.filter(run_id=self.id)
+
 
 # для задачи №9 создаем модель AthleteInfo (OneToOne к User)
 class AthleteInfo(models.Model):
@@ -31,11 +71,133 @@ class Challenge(models.Model):
     full_name = models.CharField(max_length=100) # это будет название челленджа
     athlete = models.ForeignKey(User, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            # один и тот же челлендж атлет получает только один раз (см. app_run/challenges.py)
+            models.UniqueConstraint(fields=['athlete', 'full_name'], name='unique_challenge_per_athlete'),
+        ]
 
-# для задачи №11 создаем модель Position
-class Position(models.Model):
+
+class PositionQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # bulk_create не вызывает save(), поэтому ячейку сетки заполняем здесь
+        objs = list(objs)
+        for obj in objs:
+            if obj.cell is None:
+                obj.cell = cell_of(obj.latitude, obj.longitude)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+# Общие поля точки трека - для оперативной таблицы Position и архива PositionArchive
+class BasePosition(models.Model):
     latitude = models.DecimalField(max_digits=6, decimal_places=4) # широта (от -90.0 до +90.0 градусов вкл.)
     longitude = models.DecimalField(max_digits=7, decimal_places=4) # долгота (от -180.0 до +180.0 градусов вкл.)
-    created_at = models.DateTimeField(auto_now_add=True) # кажется, что это тоже должно пригодиться
+    # кажется, что это тоже должно пригодиться.
+    # default вместо auto_now_add - иначе bulk_create (импорт, распаковка трека) затирает время точек
+    created_at = models.DateTimeField(default=timezone.now)
     run = models.ForeignKey(Run, on_delete=models.CASCADE)
+    # ячейка сетки (app_run/geo.py) - для поиска забегов, которые проходили рядом с точкой
+    cell = models.BigIntegerField(blank=True, null=True, db_index=True)
+
+    objects = PositionQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        self.cell = cell_of(self.latitude, self.longitude) # координаты могли поменяться
+        super().save(*args, **kwargs)
+
+
+# для задачи №11 создаем модель Position
+# Здесь только точки забегов, которые еще идут (и законченных, но еще не перенесенных в архив)
+class Position(BasePosition):
+    class Meta:
+        indexes = [
+            # точки одного забега по порядку (?run=... с keyset-пагинацией)
+            models.Index(fields=['run', 'created_at']),
+        ]
+
+
+# Архив точек законченных забегов (app_run/archive.py). id точек при переносе сохраняются,
+# поэтому /api/positions/<id>/ и keyset-пагинация по архиву работают так же
+class PositionArchive(BasePosition):
+    class Meta:
+        indexes = [
+            models.Index(fields=['run', 'created_at']),
+        ]
+
+
+# Накопленная статистика атлета по законченным забегам.
+# Обновляется при остановке забега (app_run/stats.py), чтобы список юзеров
+# не считал COUNT по забегам для каждого юзера на странице
+class AthleteStats(models.Model):
+    athlete = models.OneToOneField(User, on_delete=models.CASCADE, related_name='stats')
+    runs_finished = models.PositiveIntegerField(default=0, db_index=True)
+    total_distance = models.FloatField(default=0, db_index=True) # в км
+    last_run_at = models.DateTimeField(blank=True, null=True) # created_at последнего законченного забега
+    # серии дней подряд с законченными забегами (день - по created_at забега): текущая и лучшая
+    current_streak = models.PositiveIntegerField(default=0)
+    best_streak = models.PositiveIntegerField(default=0)
+
+
+# Таблица лидеров: итоги атлета по законченным забегам за неделю, месяц и за все время (app_run/leaderboard.py).
+# Строки обновляются при остановке забега, поэтому рейтинг не агрегирует таблицу Run на каждый запрос
+class LeaderboardEntry(models.Model):
+    PERIOD_CHOICES = {
+        'week': 'Неделя',
+        'month': 'Месяц',
+        'all': 'Все время',
+    }
+    athlete = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    period = models.CharField(choices=PERIOD_CHOICES, max_length=10)
+    bucket = models.DateField() # начало недели (понедельник) или месяца; для 'all' - 1970-01-01
+    runs = models.PositiveIntegerField(default=0)
+    distance = models.FloatField(default=0) # в км
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket', 'athlete'], name='unique_leaderboard_entry'),
+        ]
+        indexes = [
+            # топ по каждому показателю внутри одного периода
+            models.Index(fields=['period', 'bucket', '-distance']),
+            models.Index(fields=['period', 'bucket', '-runs']),
+        ]
+
+
+# Очередь подсчета итогов остановленных забегов (дистанция, статистика, челленджи) - см. app_run/finalize.py.
+# Очередь лежит прямо в БД, поэтому никакой внешний брокер не нужен
+class RunFinalizeJob(models.Model):
+    STATUS_CHOICES = {
+        'pending': 'Ждет обработки',
+        'running': 'Обрабатывается',
+        'done': 'Готово',
+        'failed': 'Ошибка (попытки закончились)',
+    }
+    run = models.OneToOneField(Run, on_delete=models.CASCADE, related_name='finalize_job')
+    status = models.CharField(choices=STATUS_CHOICES, max_length=20, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now) # когда можно брать (для повторов с задержкой)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+
+# Ответы на запросы с заголовком Idempotency-Key (см. app_run/idempotency.py):
+# повтор запроса с тем же ключом получает сохраненный ответ, а не выполняется второй раз
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=255)
+    path = models.CharField(max_length=255) # метод и путь запроса: один ключ на разных эндпоинтах не пересекается
+    request_hash = models.CharField(max_length=32) # md5 тела запроса - тот же ключ с другим телом это ошибка клиента
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True) # None - первый запрос еще выполняется
+    response = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['key', 'path'], name='unique_idempotency_key'),
+        ]
@@ -0,0 +1,100 @@
+from math import asin, cos, radians, sin, sqrt
+
+from django.db.models import FloatField, Min, Q, Value
+from django.db.models.functions import Cast, Cos, Power, Radians, Sin
+
+from app_run.distance import EARTH_RADIUS_KM, distances_from
+from app_run.geo import cell_of, cell_ranges
+from app_run.models import Run, Position, PositionArchive
+from app_run.track import iter_decoded
+
+
+# Поиск забегов рядом с точкой. Сначала индекс отбирает кандидатов по ячейкам сетки (app_run/geo.py),
+# и только для них считается точное расстояние гаверсинусом. Работает на любой БД, PostGIS не нужен
+
+def _cells_filter(field, ranges):
+    condition = Q()
+    for first, last in ranges:
+        condition |= Q(**{f'{field}__range': (first, last)})
+    return condition
+
+
+def runs_started_near(queryset, lat, lon, radius_km):
+    """Забеги из queryset, которые начались не дальше radius_km от точки: [(забег, расстояние в км), ...] по возрастанию"""
+    # трек (track) и аналитика - самые тяжелые поля забега, для поиска и ответа они не нужны
+    candidates = list(
+        queryset.filter(_cells_filter('start_cell', cell_ranges(lat, lon, radius_km))).defer('track', 'analytics')
+    )
+    if not candidates:
+        return []
+    distances = distances_from(
+        lat, lon, [run.start_latitude for run in candidates], [run.start_longitude for run in candidates]
+    )
+    found = [(run, float(d)) for run, d in zip(candidates, distances) if d <= radius_km]
+    return sorted(found, key=lambda item: item[1])
+
+
+def _haversine_term(lat, lon):
+    # подкоренное выражение формулы гаверсинуса от точки (lat, lon) до точки строки - в SQL.
+    # Расстояние растет вместе с ним, поэтому ближайшую точку забега можно искать через MIN прямо в БД
+    row_lat = Radians(Cast('latitude', FloatField()))
+    row_lon = Radians(Cast('longitude', FloatField()))
+    return (
+        Power(Sin((row_lat - Value(radians(lat))) / Value(2.0)), 2)
+        + Value(cos(radians(lat))) * Cos(row_lat) * Power(Sin((row_lon - Value(radians(lon))) / Value(2.0)), 2)
+    )
+
+
+def runs_passed_near(queryset, lat, lon, radius_km, limit=None):
+    """
+    Забеги из queryset, трек которых проходил не дальше radius_km от точки (по ближайшей точке трека),
+    не больше limit ближайших. Ищет и в оперативной таблице, и в архиве (app_run/archive.py).
+    Точки в Python не читаются: БД сама отбирает их по ячейкам сетки и отдает по строке на забег
+    (расстояние до ближайшей точки, GROUP BY run_id).
+    Забеги с упакованным треком (app_run/track.py) строк точек не имеют и находятся только по старту
+    """
+    cells = _cells_filter('cell', cell_ranges(lat, lon, radius_km))
+    max_term = sin(radius_km / EARTH_RADIUS_KM / 2) ** 2
+    closest = {}
+    for model in (Position, PositionArchive):
+        rows = model.objects.filter(cells, run__in=queryset.order_by().values('id')).values('run_id').annotate(
+            term=Min(_haversine_term(lat, lon)),
+        ).filter(term__lte=max_term).order_by('term').values_list('run_id', 'term')
+        for run_id, term in rows[:limit] if limit else rows:
+            d = 2 * EARTH_RADIUS_KM * asin(sqrt(max(term, 0.0)))
+            closest[run_id] = min(d, closest.get(run_id, d)) # у забега могут быть точки в обеих таблицах
+    runs = queryset.defer('track', 'analytics').in_bulk(list(closest))
+    found = sorted(((run, closest[run_id]) for run_id, run in runs.items()), key=lambda item: item[1])
+    return found[:limit] if limit else found
+
+
+def reindex_cells(batch_size=1000):
+    """
+    Заново считает ячейки всех точек и точки старта всех забегов (например, после смены GEO_CELL_DEGREES).
+    Возвращает (кол-во точек, кол-во забегов)
+    """
+    positions = 0
+    runs = []
+    for model in (Position, PositionArchive):
+        batch = []
+        for position_id, lat, lon in model.objects.values_list('id', 'latitude', 'longitude').iterator(batch_size):
+            batch.append(model(id=position_id, cell=cell_of(lat, lon)))
+            if len(batch) >= batch_size:
+                model.objects.bulk_update(batch, ['cell'])
+                positions += len(batch)
+                batch = []
+        model.objects.bulk_update(batch, ['cell'])
+        positions += len(batch)
+
+        # старт - первая точка забега
+        first_ids = model.objects.values('run').annotate(first_id=Min('id')).order_by().values_list('first_id', flat=True)
+        for run_id, lat, lon in model.objects.filter(id__in=first_ids).values_list('run_id', 'latitude', 'longitude'):
+            runs.append(Run(id=run_id, start_latitude=float(lat), start_longitude=float(lon), start_cell=cell_of(lat, lon)))
+    # у забегов с упакованным треком строк точек нет - первую точку берем из самого трека
+    for run_id, blob in Run.objects.filter(track__isnull=False).values_list('id', 'track').iterator(batch_size):
+        start = next(iter_decoded(blob), None)
+        if start is not None:
+            lat, lon, _ = start
+            runs.append(Run(id=run_id, start_latitude=float(lat), start_longitude=float(lon), start_cell=cell_of(lat, lon)))
+    Run.objects.bulk_update(runs, ['start_latitude', 'start_longitude', 'start_cell'], batch_size=batch_size)
+    return positions, len(runs)
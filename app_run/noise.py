@@ -0,0 +1,99 @@
+import time
+from math import radians, sin, cos, asin, sqrt
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from app_run import metrics
+from app_run.distance import EARTH_RADIUS_KM
+
+
+# Отсев дублей и шума GPS при приеме точек (POST /api/positions/, /api/positions/bulk/, /api/async/positions/).
+# Точка не сохраняется, если она повторяет предыдущую, отстоит от нее меньше чем на POSITIONS_MIN_DISTANCE_M,
+# пришла раньше чем через POSITIONS_MIN_INTERVAL секунд или до нее пришлось бы бежать быстрее POSITIONS_MAX_SPEED.
+# Предыдущая точка - это run.last_latitude/last_longitude (забег и так читается под блокировкой при вставке),
+# а ее время лежит в кэше по ключу забега. Лишних запросов в БД нет.
+# Время точки - время записи на устройстве (поле time), если устройство его прислало, иначе - момент приема:
+# при пакетной или отложенной загрузке момент приема ничего не говорит о скорости.
+# Кэш обновляется только после COMMIT: если вставку откатили, в кэше осталась бы точка, которой нет в БД.
+# Отброшенные точки считаются в метрике positions_dropped_total с причиной в метке reason
+
+STATE_KEY = 'app_run:last_position:{}'
+
+DUPLICATE = 'duplicate'
+TOO_CLOSE = 'too_close'
+TOO_SOON = 'too_soon'
+TOO_FAST = 'too_fast'
+
+
+def _meters(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    d = sin((lat2 - lat1) * 0.5) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) * 0.5) ** 2
+    return 2 * EARTH_RADIUS_KM * 1000 * asin(sqrt(d))
+
+
+def _reason(last, latitude, longitude, now):
+    # почему точку надо отбросить (или None). last - (широта, долгота, время приема или None)
+    last_latitude, last_longitude, last_time = last
+    if last_latitude is None:
+        return None
+    if latitude == last_latitude and longitude == last_longitude:
+        return DUPLICATE
+    meters = _meters(last_latitude, last_longitude, latitude, longitude)
+    if meters < settings.POSITIONS_MIN_DISTANCE_M:
+        return TOO_CLOSE
+    if last_time is None or now is None:
+        return None
+    seconds = now - last_time
+    if seconds < 0:
+        return None # точка записана раньше предыдущей (пришла не по порядку) - по времени не судим
+    if settings.POSITIONS_MIN_INTERVAL and seconds < settings.POSITIONS_MIN_INTERVAL:
+        return TOO_SOON
+    if settings.POSITIONS_MAX_SPEED and meters > settings.POSITIONS_MAX_SPEED * max(seconds, 0.001):
+        return TOO_FAST
+    return None
+
+
+def filter_positions(run, latitudes, longitudes, times=None):
+    """
+    Какие из новых точек забега отбросить: по каждой точке причина (DUPLICATE, TOO_CLOSE ...) или None - сохранять.
+    times - время записи каждой точки на устройстве (datetime или None).
+    Забег должен быть заблокирован (select_for_update), как и для append_positions.
+    Точки со своим временем проверяются по времени и скорости относительно предыдущей принятой.
+    У точек без времени есть только момент приема - общий для всей пачки, поэтому по нему проверяется
+    только первая такая точка пачки, а остальные - только по расстоянию
+    """
+    if not settings.POSITIONS_FILTER_ENABLED:
+        return [None] * len(latitudes)
+    now = time.time()
+    times = times or [None] * len(latitudes)
+    key = STATE_KEY.format(run.id)
+    state = cache.get(key)
+    last_time = None
+    if state is not None and (state[0], state[1]) == (run.last_latitude, run.last_longitude):
+        last_time = state[2] # иначе последнюю точку поменяли мимо фильтра (правка, удаление) - времени не знаем
+    last = (run.last_latitude, run.last_longitude, last_time)
+
+    reasons = []
+    dropped = {}
+    received = now # момент приема - только для первой точки без времени
+    for latitude, longitude, point_time in zip(latitudes, longitudes, times):
+        latitude, longitude = float(latitude), float(longitude)
+        if point_time is not None:
+            point_time = point_time.timestamp()
+        else:
+            point_time, received = received, None
+        reason = _reason(last, latitude, longitude, point_time)
+        reasons.append(reason)
+        if reason is None:
+            last = (latitude, longitude, point_time)
+        else:
+            dropped[reason] = dropped.get(reason, 0) + 1
+
+    for reason, count in dropped.items():
+        metrics.increment('positions_dropped_total', count, reason=reason)
+    if last[0] != run.last_latitude or last[1] != run.last_longitude:
+        state = (last[0], last[1], now if last[2] is None else last[2])
+        transaction.on_commit(lambda: cache.set(key, state, timeout=settings.POSITIONS_FILTER_STATE_TTL))
+    return reasons
@@ -0,0 +1,182 @@
+import heapq
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+# Задача №7. Создаем класс для пагинации
+class RunAndUserPagination(PageNumberPagination):
+    # page_size = 10 # Количество объектов на странице по умолчанию (не обязательный параметр)
+    page_size_query_param = 'size' # Разрешаем изменять количество объектов через query параметр size в url
+    max_page_size = 1000 # Ограничиваем максимальное количество объектов на странице
+
+
+class KeysetPagination(RunAndUserPagination):
+    """
+    Пагинация по ключу (keyset): следующая страница - это "строки после последней строки текущей страницы"
+    (WHERE (created_at, id) > (...) ORDER BY created_at, id LIMIT size), а не OFFSET.
+    Поэтому любая страница стоит столько же, сколько первая, и страницы не "съезжают",
+    если в это время добавляются новые строки.
+
+    /api/runs/?size=50 - первая страница, дальше по ссылкам next/previous (?cursor=...).
+    ?ordering=-created_at - в обратном порядке.
+    ?count=exact|estimate|none - общее кол-во строк: точное (COUNT), оценка планировщика
+    (только Postgres, в остальных БД будет точное) или вообще не считать.
+    По умолчанию count считается точно только на первой странице.
+    Старый вариант с ?page=N (и сортировка по другим полям) работает как раньше, через номера страниц.
+    Вместо одного queryset можно передать список .values() с одинаковыми колонками (точки в Position и в архиве):
+    страница по ключу собирается слиянием страниц каждого из них, по номеру - через UNION ALL
+    """
+    keyset = ('created_at', 'id') # поля ключа, последнее должно быть уникальным
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.descending = self._get_direction(request)
+        self.keyset_mode = self.page_query_param not in request.query_params and self.descending is not None
+        parts = list(queryset) if isinstance(queryset, (list, tuple)) else [queryset]
+        if not self.keyset_mode:
+            queryset = parts[0] if len(parts) == 1 else self.union(parts)
+            if not queryset.ordered: # иначе номера страниц не гарантируют стабильный порядок
+                queryset = queryset.order_by(*self.keyset)
+            return super().paginate_queryset(queryset, request, view)
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        values, backwards = self._decode_cursor(request, parts[0].model)
+        counts = [self._get_count(part, request, has_cursor=values is not None) for part in parts]
+        self.count = None if None in counts else sum(counts)
+
+        # идем назад (ссылка previous) - это тот же запрос в обратном порядке, потом разворачиваем
+        descending = self.descending != backwards
+        prefix = '-' if descending else ''
+        pages = []
+        for part in parts:
+            part = part.order_by(*[prefix + field for field in self.keyset])
+            if values is not None:
+                part = part.filter(self._after(values, descending))
+            pages.append(part[:self.page_size + 1])
+        page = list(heapq.merge(*pages, key=self._sort_key, reverse=descending))[:self.page_size + 1]
+        has_more = len(page) > self.page_size
+        page = page[:self.page_size]
+        if backwards:
+            page.reverse()
+
+        self.next_values = self._key(page[-1]) if page and (has_more or backwards) else None
+        self.previous_values = self._key(page[0]) if page and values is not None and (has_more or not backwards) else None
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.keyset_mode:
+            return super().get_paginated_response(data)
+        response = {}
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self._link(self.next_values, backwards=False)
+        response['previous'] = self._link(self.previous_values, backwards=True)
+        response['results'] = data
+        return Response(response)
+
+    def _get_direction(self, request):
+        # None - сортировка не по ключу, тогда keyset не подходит
+        ordering = request.query_params.get('ordering')
+        if not ordering:
+            return False
+        if ordering == self.keyset[0]:
+            return False
+        if ordering == '-' + self.keyset[0]:
+            return True
+        return None
+
+    def _get_count(self, queryset, request, has_cursor):
+        mode = request.query_params.get(self.count_query_param, 'none' if has_cursor else 'exact')
+        if mode == 'none':
+            return None
+        if mode == 'estimate' and connections[queryset.db].vendor == 'postgresql':
+            return self._estimate_count(queryset)
+        return queryset.count()
+
+    @staticmethod
+    def _estimate_count(queryset):
+        # оценка кол-ва строк из плана запроса - без реального COUNT(*)
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    def _after(self, values, descending):
+        # (f1, f2) > (v1, v2)  =>  f1 > v1 OR (f1 = v1 AND f2 > v2)
+        lookup = 'lt' if descending else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.keyset):
+            step = Q(**{f'{field}__{lookup}': values[i]})
+            for previous_field, previous_value in zip(self.keyset[:i], values[:i]):
+                step &= Q(**{previous_field: previous_value})
+            condition |= step
+        return condition
+
+    @staticmethod
+    def union(parts):
+        """Все строки нескольких .values() одним запросом (UNION ALL), без сортировки"""
+        return parts[0].order_by().union(*[part.order_by() for part in parts[1:]], all=True)
+
+    def _sort_key(self, obj):
+        return tuple(obj[field] if isinstance(obj, dict) else getattr(obj, field) for field in self.keyset)
+
+    def _key(self, obj):
+        values = []
+        for field in self.keyset:
+            # строки могут быть и объектами модели, и dict-ами из .values() (app_run/fastpath.py)
+            value = obj[field] if isinstance(obj, dict) else getattr(obj, field)
+            values.append(value.isoformat() if isinstance(value, datetime) else value)
+        return values
+
+    def _decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            values = cursor['v']
+            if not isinstance(values, list) or len(values) != len(self.keyset):
+                raise ValueError
+            # cursor приходит от клиента - каждое значение приводим к типу поля, иначе мусор дойдет до SQL
+            parsed = []
+            for field, value in zip(self.keyset, values):
+                if not isinstance(value, (str, int)) or isinstance(value, bool):
+                    raise ValueError
+                value = model._meta.get_field(field).to_python(value)
+                if value is None:
+                    raise ValueError
+                parsed.append(value)
+            return parsed, bool(cursor.get('b'))
+        except (ValueError, TypeError, KeyError, AttributeError, ValidationError):
+            raise NotFound('Некорректный cursor')
+
+    def _link(self, values, backwards):
+        if values is None:
+            return None
+        cursor = {'v': values}
+        if backwards:
+            cursor['b'] = 1
+        encoded = urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), self.count_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class UserKeysetPagination(KeysetPagination):
+    keyset = ('date_joined', 'id')
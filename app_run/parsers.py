@@ -0,0 +1,32 @@
+import json
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Парсер для NDJSON (одна JSON-запись на строку), так часы отдают точки пачками.
+    Строки читаются из потока по одной, весь body целиком в память не грузится.
+    Больше POSITIONS_BULK_MAX_ITEMS + 1 записей не читаем: такой запрос вьюха все равно отклонит,
+    и список из миллиона точек собирать незачем.
+    Битая строка не валит весь запрос: вместо нее в список попадает None,
+    а ошибку потом покажем для конкретного элемента.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        items = []
+        if stream is None:
+            return items
+        for line in iter(stream.readline, b''):
+            if len(items) > settings.POSITIONS_BULK_MAX_ITEMS:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
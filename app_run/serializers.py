@@ -18,7 +18,14 @@ class RunSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Run
-        fields = '__all__'
+        # вместо '__all__' перечисляем поля явно (в том же порядке, что и раньше),
+        # чтобы служебные поля модели (last_latitude, last_longitude) не попадали в АПИ
+        fields = ['id', 'athlete_data', 'created_at', 'comment', 'status', 'distance', 'athlete']
+        # distance теперь считается на сервере по мере поступления точек,
+        # created_at проставляется сервером (в модели это default, а не auto_now_add - из-за импорта треков).
+        # status меняется только через /start/ и /stop/: там переход идет условным UPDATE, а итоги
+        # (статистика, челленджи, таблица лидеров) считаются в очереди app_run/finalize.py
+        read_only_fields = ['distance', 'created_at', 'status']
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -26,6 +33,9 @@ class UserSerializer(serializers.ModelSerializer):
 
     # добавим еще одно вычисляемое поле для вывода кол-ва завершенных забегов атлета
     runs_finished = serializers.SerializerMethodField()
+    # и остальная статистика атлета из AthleteStats (приходит через annotate в UserViewSet)
+    total_distance = serializers.FloatField(read_only=True)
+    last_run_at = serializers.DateTimeField(read_only=True)
 
     class Meta:
         model = User
@@ -37,6 +47,8 @@ class UserSerializer(serializers.ModelSerializer):
             'first_name',
             'type', # этого поля изначально нет в модели, оно выше определено как вычисляемое
             'runs_finished', # еще одно вычисляемое поле
+            'total_distance',
+            'last_run_at',
         ]
 
     def get_type(self, obj): # а это метод, который вычисляет значение поля 'type'
@@ -46,12 +58,37 @@ class UserSerializer(serializers.ModelSerializer):
             return 'athlete'
 
     def get_runs_finished(self, obj): # метод для вычисления runs_finished
-        # получается, в obj мы получим объект конкретного юзера
-        # потом вытащим queryset со всеми завершенными забегами
+        # в UserViewSet значение уже пришло из AthleteStats в том же запросе (annotate)
+        if hasattr(obj, 'runs_finished'):
+            return obj.runs_finished
+        # иначе считаем как раньше: queryset со всеми завершенными забегами и их количество
         qs_runs = obj.run_set.filter(status = 'finished')
-        # и вернем их количество
         return qs_runs.count()
 
+    # Вложенные данные по запросу: /api/users/?expand=athlete_info,challenges.
+    # Список полей для вложения приходит в context['expand'], а UserViewSet заранее подтягивает их
+    # через select_related/prefetch_related - иначе здесь был бы запрос на каждого юзера
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in self.context.get('expand', ()):
+            fields[name] = serializers.SerializerMethodField()
+        return fields
+
+    def get_athlete_info(self, obj):
+        return AthleteInfoSerializer(athlete_info_of(obj)).data
+
+    def get_challenges(self, obj):
+        return ChallengeSerializer(obj.challenge_set.all(), many=True).data
+
+
+def athlete_info_of(user):
+    """
+    AthleteInfo юзера, а если его еще нет - пустой несохраненный (такой же, какой создал бы get_or_create).
+    Если AthleteInfo подтянут через select_related('athleteinfo'), запросов к БД нет
+    """
+    info = getattr(user, 'athleteinfo', None) # нет записи - RelatedObjectDoesNotExist, он же AttributeError
+    return info if info is not None else AthleteInfo(user_id=user)
+
 
 # Задача №9. Создаем сериалайзер для модели AthleteInfo
 class AthleteInfoSerializer(serializers.ModelSerializer):
@@ -69,9 +106,13 @@ class ChallengeSerializer(serializers.ModelSerializer):
 
 # Задача №11. Создаем сериалайзер для модели Position
 class PositionSerializer(serializers.ModelSerializer):
+    # время записи точки на устройстве (ISO 8601), необязательное - без него created_at = время приема.
+    # Только на запись: ответ остается прежним
+    time = serializers.DateTimeField(source='created_at', write_only=True, required=False)
+
     class Meta:
         model = Position
-        fields = ['id', 'run', 'latitude', 'longitude']
+        fields = ['id', 'run', 'latitude', 'longitude', 'time']
 
     def validate_latitude(self, value): # валидация поля (validate_<имя поля>)
         if value >= 90 or value <= -90:
@@ -86,6 +127,10 @@ class PositionSerializer(serializers.ModelSerializer):
     def validate(self, data): # вызывается автоматом после валидации всех отдельных полей
         # попробуем прям здесь валидировать статус забега
         status_run = data.get('run').status
+        if self.instance is not None and status_run == 'finished':
+            # исправить точку можно и у законченного забега (она может лежать в архиве) -
+            # дистанция, статистика и таблица лидеров пересчитываются (PositionViewSet.perform_update)
+            return data
         if status_run != 'in_progress':
             raise serializers.ValidationError('Забег должен быть в статусе "in progress"')
         return data
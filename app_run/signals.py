@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from app_run.cache import bump
+from app_run.models import Run, Challenge, Position
+
+
+# Сброс закэшированных ответов АПИ (app_run/cache.py) при изменении данных.
+# Список забегов зависит от забегов, их точек (distance) и юзеров (athlete_data)
+
+@receiver([post_save, post_delete], sender=Run)
+def run_changed(sender, **kwargs):
+    bump('runs')
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, **kwargs):
+    bump('runs')
+
+
+# На удаление точек специально не подписываемся: с обработчиком post_delete Django перестает удалять
+# точки одним DELETE и грузит каждую строку (упаковка трека, удаление забега). А все места,
+# где точки удаляются, и так сохраняют забег (recalculate_run, pack_run) - это сбрасывает 'runs'
+@receiver(post_save, sender=Position)
+def position_changed(sender, **kwargs):
+    bump('runs')
+
+
+@receiver([post_save, post_delete], sender=Challenge)
+def challenge_changed(sender, **kwargs):
+    bump('challenges')
@@ -0,0 +1,80 @@
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+
+
+# Профиль холодного старта (manage.py startup_profile).
+# В отдельном процессе с python -X importtime делается то же, что на холодном старте Lambda:
+# поднимается WSGI-приложение (django.setup(), middleware) и загружается urls.py со всеми вьюхами
+# (это происходит на первом запросе). По выводу importtime видно, сколько стоит импорт каждого модуля
+
+STARTUP_CODE = '''
+import time
+start = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(time.perf_counter() - start)
+'''
+
+
+def parse_importtime(text):
+    """
+    Разбор вывода -X importtime: [(модуль, собственное время в мкс, вместе с вложенными импортами в мкс, глубина), ...].
+    Глубина 0 - модули, которые импортировал сам запускаемый код
+    """
+    rows = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|', 2)
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue # заголовок "self [us] | cumulative | imported package"
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return rows
+
+
+def by_package(rows):
+    """Собственное время импорта, сложенное по пакетам верхнего уровня (django, rest_framework, numpy ...), в мкс"""
+    totals = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        totals[name.split('.')[0]] += self_us
+    return dict(sorted(totals.items(), key=lambda item: -item[1]))
+
+
+def profile_startup(settings_module=None, repeat=5):
+    """
+    Запускает холодный старт repeat раз (плюс один прогревочный - он компилирует .pyc и не считается).
+    Возвращает dict: wall_ms (медиана), import_ms (медиана суммы импортов), modules - все модули
+    последнего запуска, packages - время по пакетам последнего запуска
+    """
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module or settings.SETTINGS_MODULE)
+    walls = []
+    imports = []
+    rows = []
+    for attempt in range(repeat + 1):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        if not attempt:
+            continue
+        rows = parse_importtime(result.stderr)
+        walls.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+        imports.append(sum(cumulative for _, _, cumulative, depth in rows if depth == 0) / 1000)
+    return {
+        'settings': env['DJANGO_SETTINGS_MODULE'],
+        'wall_ms': round(statistics.median(walls), 1),
+        'import_ms': round(statistics.median(imports), 1),
+        'modules': {name: {'self_us': self_us, 'cumulative_us': cumulative} for name, self_us, cumulative, _ in rows},
+        'packages': by_package(rows),
+    }
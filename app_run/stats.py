@@ -0,0 +1,99 @@
+from django.db import transaction
+from django.db.models import Count, Sum, Max
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from app_run.models import Run, AthleteStats
+
+
+def count_streaks(days):
+    """
+    days - отсортированные по возрастанию уникальные даты забегов.
+    Возвращает (текущая серия, т.е. заканчивающаяся последним днем; лучшая серия)
+    """
+    current = best = 0
+    previous = None
+    for day in days:
+        current = current + 1 if previous is not None and (day - previous).days == 1 else 1
+        best = max(best, current)
+        previous = day
+    return current, best
+
+
+def add_finished_run(run):
+    """
+    Учитывает только что законченный забег в статистике атлета и возвращает обновленную AthleteStats.
+    Вызывается в той же транзакции, что и смена статуса забега на 'finished'.
+    Строка статистики блокируется, чтобы параллельные остановки забегов одного атлета не теряли друг друга
+    """
+    # строки еще может не быть, а select_for_update() блокирует только существующие строки: сначала вставка,
+    # которая при гонке молча ничего не делает (как в leaderboard.record_run), потом блокировка
+    AthleteStats.objects.bulk_create([AthleteStats(athlete_id=run.athlete_id)], ignore_conflicts=True)
+    stats = AthleteStats.objects.select_for_update().get(athlete_id=run.athlete_id)
+    stats.runs_finished += 1
+    stats.total_distance += run.distance or 0
+
+    day = timezone.localdate(run.created_at)
+    last_day = timezone.localdate(stats.last_run_at) if stats.last_run_at else None
+    if last_day is None or day > last_day:
+        stats.current_streak = stats.current_streak + 1 if last_day and (day - last_day).days == 1 else 1
+        stats.best_streak = max(stats.best_streak, stats.current_streak)
+        stats.last_run_at = run.created_at
+    elif day == last_day:
+        stats.last_run_at = max(stats.last_run_at, run.created_at)
+    # забег из прошлого (завершен позже более новых) серии не меняет - точно их пересчитает rebuild_stats()
+    stats.save()
+    return stats
+
+
+def add_distance(run, delta):
+    """
+    Поправка total_distance атлета, когда у уже законченного забега поменялась дистанция (правка или удаление точки).
+    Возвращает обновленную AthleteStats (или None, если строки статистики нет)
+    """
+    stats = AthleteStats.objects.select_for_update().filter(athlete_id=run.athlete_id).first()
+    if stats is None:
+        return None
+    stats.total_distance = max(stats.total_distance + delta, 0.0)
+    stats.save(update_fields=['total_distance'])
+    return stats
+
+
+def collect_stats():
+    """
+    Статистика по всем атлетам с нуля (объекты AthleteStats без сохранения).
+    Ровно два запроса: агрегаты по законченным забегам и список дней с забегами для серий
+    """
+    rows = Run.objects.filter(status='finished').values('athlete').annotate(
+        runs_finished=Count('id'),
+        total_distance=Coalesce(Sum('distance'), 0.0),
+        last_run_at=Max('created_at'),
+    ).order_by()
+    stats = {
+        row['athlete']: AthleteStats(
+            athlete_id=row['athlete'],
+            runs_finished=row['runs_finished'],
+            total_distance=row['total_distance'],
+            last_run_at=row['last_run_at'],
+        )
+        for row in rows
+    }
+
+    days = Run.objects.filter(status='finished').annotate(day=TruncDate('created_at')).values_list(
+        'athlete', 'day'
+    ).distinct().order_by('athlete', 'day')
+    days_by_athlete = {}
+    for athlete_id, day in days:
+        days_by_athlete.setdefault(athlete_id, []).append(day)
+    for athlete_id, athlete_days in days_by_athlete.items():
+        stats[athlete_id].current_streak, stats[athlete_id].best_streak = count_streaks(athlete_days)
+    return list(stats.values())
+
+
+def rebuild_stats():
+    """Полностью пересобирает таблицу AthleteStats, возвращает кол-во атлетов со статистикой"""
+    stats = collect_stats()
+    with transaction.atomic():
+        AthleteStats.objects.all().delete()
+        AthleteStats.objects.bulk_create(stats, batch_size=1000)
+    return len(stats)
@@ -1,3 +1,1176 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from haversine import haversine
+
+from app_run import benchmark, distance, finalize, live, metrics, startup, track, trackfiles
+from app_run.archive import archive_run
+from app_run.challenges import backfill_challenges
+from app_run.finalize import drain, finalize_run
+from app_run.importers import parse_track
+from app_run.leaderboard import rebuild_leaderboard
+from app_run.models import Run, Position, AthleteStats, Challenge, RunFinalizeJob, LeaderboardEntry, PositionArchive, \
+    AthleteInfo
+from app_run.nearby import reindex_cells
+from app_run.stats import rebuild_stats, count_streaks
+
 
 # Create your tests here.
+@override_settings(RUN_FINALIZE_WORKERS=0)
+class DistanceTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=self.athlete, comment='test', status='in_progress')
+        self.points = [
+            (Decimal('55.7558'), Decimal('37.6173')),
+            (Decimal('55.7600'), Decimal('37.6200')),
+            (Decimal('55.7650'), Decimal('37.6100')),
+            (Decimal('55.7700'), Decimal('37.6050')),
+        ]
+        for lat, lon in self.points:
+            Position.objects.create(run=self.run, latitude=lat, longitude=lon)
+
+    def expected(self):
+        # так дистанция считалась раньше в StopRunAPIView
+        return sum(haversine(self.points[i], self.points[i + 1]) for i in range(len(self.points) - 1))
+
+    def test_backends_match_haversine(self):
+        latitudes = [float(p[0]) for p in self.points]
+        longitudes = [float(p[1]) for p in self.points]
+        self.assertAlmostEqual(distance.track_distance(latitudes, longitudes, use_numpy=False), self.expected(), places=9)
+        if distance.np is not None:
+            self.assertAlmostEqual(distance.track_distance(latitudes, longitudes, use_numpy=True), self.expected(), places=9)
+
+    def test_short_tracks(self):
+        self.assertEqual(distance.track_distance([], []), 0.0)
+        self.assertEqual(distance.track_distance([55.0], [37.0]), 0.0)
+
+    def test_stop_run_sets_distance(self):
+        response = self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.assertEqual(response.status_code, 200)
+        self.run.refresh_from_db()
+        self.assertAlmostEqual(self.run.distance, self.expected(), places=6)
+
+    def test_distance_accumulates_on_position_create(self):
+        run = Run.objects.create(athlete=self.athlete, comment='live', status='in_progress')
+        for lat, lon in self.points:
+            response = self.client.post('/api/positions/', {'run': run.id, 'latitude': lat, 'longitude': lon})
+            self.assertEqual(response.status_code, 201)
+        # distance видна еще до остановки забега
+        response = self.client.get(f'/api/runs/{run.id}/')
+        self.assertAlmostEqual(response.json()['distance'], self.expected(), places=6)
+
+        self.client.delete(f'/api/positions/{Position.objects.filter(run=run).last().id}/')
+        run.refresh_from_db()
+        self.assertAlmostEqual(run.distance, sum(
+            haversine(self.points[i], self.points[i + 1]) for i in range(len(self.points) - 2)
+        ), places=6)
+        self.assertEqual((run.last_latitude, run.last_longitude), (55.765, 37.61))
+
+
+class BulkPositionsTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=self.athlete, comment='bulk', status='in_progress')
+        self.finished = Run.objects.create(athlete=self.athlete, comment='done', status='finished')
+
+    def test_json_array_with_item_errors(self):
+        items = [
+            {'run': self.run.id, 'latitude': 55.7558, 'longitude': 37.6173},
+            {'run': self.run.id, 'latitude': 95, 'longitude': 37.6173},
+            {'run': self.run.id, 'latitude': 55.7600, 'longitude': 37.6200},
+            {'run': self.finished.id, 'latitude': 55.7600, 'longitude': 37.6200},
+            {'run': self.run.id},
+        ]
+        response = self.client.post('/api/positions/bulk/', items, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual([e['index'] for e in response.json()['errors']], [1, 3, 4])
+        self.run.refresh_from_db()
+        self.assertAlmostEqual(self.run.distance, haversine((55.7558, 37.6173), (55.76, 37.62)), places=6)
+
+    def test_ndjson(self):
+        body = '\n'.join([
+            f'{{"run": {self.run.id}, "latitude": 55.7558, "longitude": 37.6173}}',
+            'not json',
+            f'{{"run": {self.run.id}, "latitude": 55.7600, "longitude": 37.6200}}',
+        ])
+        response = self.client.post('/api/positions/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(response.json()['errors'][0]['index'], 1)
+        self.assertEqual(Position.objects.filter(run=self.run).count(), 2)
+
+    @override_settings(POSITIONS_BULK_MAX_ITEMS=2)
+    def test_ndjson_too_many_items(self):
+        line = f'{{"run": {self.run.id}, "latitude": 55.7558, "longitude": 37.6173}}\n'
+        with mock.patch('app_run.parsers.json.loads', wraps=json.loads) as loads:
+            response = self.client.post('/api/positions/bulk/', line * 100, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(loads.call_count, 3) # дальше третьей строки не читали
+        self.assertFalse(Position.objects.filter(run=self.run).exists())
+
+
+@override_settings(RUN_FINALIZE_WORKERS=0)
+class TrackPackingTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=self.athlete, comment='packed', status='in_progress')
+        self.points = [('55.7558', '37.6173'), ('55.7560', '37.6175'), ('55.7562', '37.6177'), ('55.7600', '37.6300')]
+        for lat, lon in self.points:
+            self.client.post('/api/positions/', {'run': self.run.id, 'latitude': lat, 'longitude': lon})
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.listing = self.client.get(f'/api/positions/?run={self.run.id}').json()
+
+    def test_pack_is_transparent_for_listing(self):
+        self.assertEqual(track.pack_run(self.run)[0], 4)
+        self.assertFalse(Position.objects.filter(run=self.run).exists())
+        packed_listing = self.client.get(f'/api/positions/?run={self.run.id}').json()
+        self.assertEqual(
+            [(p['run'], p['latitude'], p['longitude']) for p in packed_listing],
+            [(p['run'], p['latitude'], p['longitude']) for p in self.listing],
+        )
+
+        # id точек после упаковки те же
+        self.assertEqual(packed_listing, self.listing)
+        page = self.client.get(f'/api/positions/?run={self.run.id}&size=3&page=2').json()
+        self.assertEqual((page['count'], page['results']), (4, self.listing[3:]))
+        self.assertEqual(self.client.get(f'/api/positions/?run={self.run.id}&size=3&cursor=abc').status_code, 400)
+
+        self.assertEqual(track.unpack_run(self.run), 4)
+        restored = Position.objects.filter(run=self.run).order_by('id')
+        self.assertEqual([(str(p.latitude), str(p.longitude)) for p in restored], self.points)
+        self.assertEqual([p.id for p in restored], [p['id'] for p in self.listing])
+
+    def test_simplify_keeps_corners(self):
+        # точки на прямой выкидываются, излом остается
+        self.assertEqual(track.simplify([55.0, 55.001, 55.002, 55.002], [37.0, 37.0, 37.0, 37.01], 1), [0, 2, 3])
+        self.assertEqual(track.pack_run(self.run, tolerance_m=50)[0], 2)
+        self.run.refresh_from_db()
+        self.assertEqual(len(track.decode_track(self.run.track)[0]), 2)
+
+    def test_version_1_tracks(self):
+        # треки, упакованные до появления колонки id, читаются как раньше, id точек - null
+        payload = track._column([55_755_800]) + track._column([37_617_300]) + track._column([0])
+        self.run.track = track.HEADER.pack(1, 1, 1_700_000_000_000) + zlib.compress(payload)
+        self.assertIsNone(track.track_ids(self.run.track))
+        self.assertEqual(track.unpacked_rows(self.run)[0]['id'], None)
+        self.assertEqual(str(track.unpacked_rows(self.run)[0]['latitude']), '55.7558')
+
+    def test_long_pauses_and_version_2_tracks(self):
+        # пауза в 30 суток и id больше 2^31 не помещались в int32
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        times = [start, start + timedelta(days=30), start + timedelta(days=30, seconds=5)]
+        ids = [3_000_000_000, 3_000_000_001, 3_000_000_002]
+        blob = track.encode_track([55.7558, 55.7560, 55.7562], [37.6173] * 3, times, ids)
+        self.assertEqual(track.decode_track(blob)[2], times)
+        self.assertEqual(track.track_ids(blob), ids)
+
+        # треки версии 2 (время и id в int32) читаются как раньше
+        payload = b''.join(track._column(values) for values in ([55_755_800], [37_617_300], [0], [7]))
+        blob = track.HEADER.pack(2, 1, 1_700_000_000_000) + zlib.compress(payload)
+        self.assertEqual(track.track_ids(blob), [7])
+        self.assertEqual(str(track.decode_track(blob)[1][0]), '37.6173')
+
+
+@override_settings(RUN_FINALIZE_WORKERS=0)
+class AthleteStatsTests(TestCase):
+    def setUp(self):
+        self.athletes = [User.objects.create(username=f'runner{i}') for i in range(5)]
+        for i, athlete in enumerate(self.athletes):
+            for _ in range(i):
+                run = Run.objects.create(athlete=athlete, comment='', status='in_progress', distance=2.5)
+                self.client.post(f'/api/runs/{run.id}/stop/')
+
+    def test_users_list_single_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/?ordering=-runs_finished')
+        users = response.json()
+        self.assertEqual([u['runs_finished'] for u in users], [4, 3, 2, 1, 0])
+        self.assertEqual(users[0]['total_distance'], 10.0)
+
+    def test_rebuild_matches_incremental(self):
+        before = sorted(AthleteStats.objects.values_list('athlete', 'runs_finished', 'total_distance', 'last_run_at'))
+        self.assertEqual(rebuild_stats(), 4)
+        after = sorted(AthleteStats.objects.values_list('athlete', 'runs_finished', 'total_distance', 'last_run_at'))
+        self.assertEqual(before, after)
+
+
+@override_settings(RUN_FINALIZE_WORKERS=0)
+class ChallengeRulesTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+
+    def finish_runs(self, count, distance=None):
+        for _ in range(count):
+            run = Run.objects.create(athlete=self.athlete, comment='', status='in_progress', distance=distance)
+            self.assertEqual(self.client.post(f'/api/runs/{run.id}/stop/').status_code, 200)
+
+    def test_thresholds_awarded_once(self):
+        self.finish_runs(12, distance=5)
+        names = list(Challenge.objects.filter(athlete=self.athlete).values_list('full_name', flat=True))
+        self.assertEqual(sorted(names), ['Пробеги 50 километров!', 'Сделай 10 Забегов!'])
+
+    def test_runs_without_positions(self):
+        # раньше здесь падало сравнение None >= 50
+        self.finish_runs(1)
+        self.assertFalse(Challenge.objects.exists())
+
+    def test_streak_and_backfill(self):
+        self.assertEqual(count_streaks([date(2026, 1, 1), date(2026, 1, 2), date(2026, 1, 4)]), (1, 2))
+        self.finish_runs(10, distance=1)
+        Challenge.objects.all().delete()
+        with self.assertNumQueries(3):
+            self.assertEqual(backfill_challenges(), (1, 1))
+        backfill_challenges()
+        self.assertEqual(Challenge.objects.filter(athlete=self.athlete).count(), 1)
+
+
+class FinalizeQueueTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=self.athlete, comment='', status='in_progress', distance=3)
+
+    def test_stop_returns_finalizing_and_drain_finishes(self):
+        response = self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.assertEqual(response.json()['status'], 'finalizing')
+        # в TestCase транзакция не коммитится, поэтому пул потоков задачу не получил - ее подберет drain
+        self.assertEqual(drain(), (1, 0))
+        self.assertEqual(self.client.get(f'/api/runs/{self.run.id}/').json()['status'], 'finished')
+        self.assertEqual(AthleteStats.objects.get(athlete=self.athlete).runs_finished, 1)
+        self.assertEqual(drain(), (0, 0))
+
+    @override_settings(RUN_FINALIZE_WORKERS=0, RUN_FINALIZE_RETRY_DELAY=0)
+    def test_retry_after_error(self):
+        with mock.patch('app_run.finalize.add_finished_run', side_effect=RuntimeError('boom')), \
+                self.assertLogs('app_run.finalize', 'ERROR'):
+            response = self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.assertEqual(response.json()['status'], 'finalizing')
+        job = RunFinalizeJob.objects.get(run=self.run)
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertIn('boom', job.last_error)
+        self.assertEqual(drain(), (1, 0))
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, 'finished')
+
+    @override_settings(RUN_FINALIZE_WORKERS=0, RUN_FINALIZE_MAX_ATTEMPTS=1)
+    def test_failed_runs_are_reported_and_retried(self):
+        with mock.patch('app_run.finalize.add_finished_run', side_effect=RuntimeError('boom')), \
+                self.assertLogs('app_run.finalize', 'ERROR'):
+            self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.assertEqual(RunFinalizeJob.objects.get(run=self.run).status, 'failed')
+
+        out, err = StringIO(), StringIO()
+        call_command('drain_finalize_queue', stdout=out, stderr=err)
+        self.assertIn('Выполнено задач: 0', out.getvalue())
+        self.assertIn(f'Забег {self.run.id}: итоги не посчитаны (RuntimeError: boom)', err.getvalue())
+
+        out, err = StringIO(), StringIO()
+        call_command('drain_finalize_queue', '--retry-failed', stdout=out, stderr=err)
+        self.assertIn('Выполнено задач: 1', out.getvalue())
+        self.assertEqual(err.getvalue(), '')
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, 'finished')
+
+
+    @override_settings(RUN_FINALIZE_WORKERS=0, RUN_FINALIZE_RETRY_DELAY=0)
+    def test_scheduled_drain(self):
+        with mock.patch('app_run.finalize.add_finished_run', side_effect=RuntimeError('boom')), \
+                self.assertLogs('app_run.finalize', 'ERROR'):
+            self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.assertEqual(finalize.scheduled_drain({}, None), {'done': 1, 'errors': 0})
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.status, 'finished')
+
+    def test_status_is_read_only(self):
+        data = {'athlete': self.athlete.id, 'comment': 'new', 'status': 'finished'}
+        response = self.client.post('/api/runs/', data, content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['status']), (201, 'init'))
+        response = self.client.patch(f'/api/runs/{self.run.id}/', {'status': 'finished'}, content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['status']), (200, 'in_progress'))
+        self.assertEqual(Run.objects.filter(status='finished').count(), 0)
+        self.assertFalse(AthleteStats.objects.filter(athlete=self.athlete).exists())
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        for i in range(7):
+            run = Run.objects.create(athlete=self.athlete, comment=str(i))
+            # одинаковое время у пар забегов - порядок внутри пары решает id
+            Run.objects.filter(id=run.id).update(created_at=datetime(2026, 1, 1 + i // 2, tzinfo=dt_timezone.utc))
+        self.expected = list(Run.objects.order_by('created_at', 'id').values_list('id', flat=True))
+
+    def walk(self, url):
+        ids, pages = [], []
+        while url:
+            page = self.client.get(url).json()
+            pages.append(page)
+            ids.extend(r['id'] for r in page['results'])
+            url = page['next']
+        return ids, pages
+
+    def test_forward_and_backward(self):
+        ids, pages = self.walk('/api/runs/?size=3')
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(pages[0]['count'], 7)
+        self.assertNotIn('count', pages[1])
+        self.assertIsNone(pages[0]['previous'])
+        previous = self.client.get(pages[2]['previous']).json()
+        self.assertEqual([r['id'] for r in previous['results']], self.expected[3:6])
+        self.assertEqual([r['id'] for r in self.client.get(previous['previous']).json()['results']], self.expected[:3])
+
+    def test_descending(self):
+        ids, pages = self.walk('/api/runs/?size=2&ordering=-created_at&count=none')
+        self.assertEqual(ids, self.expected[::-1])
+        self.assertNotIn('count', pages[0])
+
+    def test_page_number_still_works(self):
+        page = self.client.get('/api/runs/?size=3&page=3').json()
+        self.assertEqual((page['count'], [r['id'] for r in page['results']]), (7, self.expected[6:]))
+        self.assertEqual(len(self.client.get('/api/runs/').json()), 7) # без size - список без пагинации
+
+    def test_bad_cursor(self):
+        self.assertEqual(self.client.get('/api/runs/?size=3&cursor=zzz').status_code, 404)
+        # значения курсора, которые не привести к типам полей, - тоже 404, а не 500
+        for values in ([None, None], [{}, 1], ['2026-01-01T00:00:00', 'abc'], [True, 1], 'ab'):
+            cursor = base64.urlsafe_b64encode(json.dumps({'v': values}).encode()).decode()
+            self.assertEqual(self.client.get(f'/api/runs/?size=3&cursor={cursor}').status_code, 404, values)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='runner')
+        Run.objects.create(athlete=self.athlete, comment='first')
+
+    def test_cached_until_run_changes(self):
+        first = self.client.get('/api/runs/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/runs/')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(first['ETag'], second['ETag'])
+
+        with self.assertNumQueries(0):
+            not_modified = self.client.get('/api/runs/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        Run.objects.create(athlete=self.athlete, comment='second')
+        third = self.client.get('/api/runs/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(len(third.json()), 2)
+
+    def test_query_params_are_part_of_key(self):
+        self.client.get('/api/challenges/')
+        Challenge.objects.create(athlete=self.athlete, full_name='test')
+        self.assertEqual(len(self.client.get('/api/challenges/').json()), 1)
+        self.assertEqual(len(self.client.get(f'/api/challenges/?athlete={self.athlete.id + 1}').json()), 0)
+
+
+@override_settings(RUN_FINALIZE_WORKERS=0)
+class TrackExportTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=self.athlete, comment='Утро & парк', status='in_progress')
+        for lat, lon in [('55.7558', '37.6173'), ('55.7560', '37.6175')]:
+            self.client.post('/api/positions/', {'run': self.run.id, 'latitude': lat, 'longitude': lon})
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+
+    def body(self, fmt):
+        response = self.client.get(f'/api/runs/{self.run.id}/track.{fmt}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_formats(self):
+        gpx = self.body('gpx')
+        self.assertIn('<name>Утро &amp; парк</name>', gpx)
+        self.assertEqual(gpx.count('<trkpt lat="55.7558" lon="37.6173">'), 1)
+        rows = [json.loads(line) for line in self.body('ndjson').splitlines()]
+        self.assertEqual([(r['latitude'], r['longitude']) for r in rows], [(55.7558, 37.6173), (55.756, 37.6175)])
+        self.assertEqual(self.body('csv').splitlines()[1].split(',')[:2], ['55.7558', '37.6173'])
+        self.assertEqual(self.client.get(f'/api/runs/{self.run.id}/track.kml').status_code, 404)
+
+    def test_packed_track_exports_the_same(self):
+        before = self.body('csv')
+        track.pack_run(self.run)
+        self.assertEqual(self.body('csv'), before)
+
+
+GPX = b'''<?xml version="1.0" encoding="UTF-8"?>
+<gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">
+  <metadata><time>2026-05-01T06:00:00Z</time></metadata>
+  <trk><name>Morning run</name><trkseg>
+    <trkpt lat="55.75581" lon="37.61734"><ele>150</ele><time>2026-05-01T06:00:00Z</time></trkpt>
+    <trkpt lat="55.7600" lon="37.6200"><time>2026-05-01T06:01:00Z</time></trkpt>
+    <trkpt lat="95.0" lon="37.6200"><time>2026-05-01T06:01:30Z</time></trkpt>
+    <trkpt lat="55.7650" lon="37.6100"><time>2026-05-01T06:02:00Z</time></trkpt>
+  </trkseg></trk>
+</gpx>'''
+
+TCX = b'''<?xml version="1.0" encoding="UTF-8"?>
+<TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2">
+  <Activities><Activity Sport="Running"><Lap><Track>
+    <Trackpoint><Time>2026-05-01T06:00:00Z</Time>
+      <Position><LatitudeDegrees>55.7558</LatitudeDegrees><LongitudeDegrees>37.6173</LongitudeDegrees></Position>
+    </Trackpoint>
+    <Trackpoint><Time>2026-05-01T06:00:05Z</Time><HeartRateBpm><Value>120</Value></HeartRateBpm></Trackpoint>
+    <Trackpoint><Time>2026-05-01T06:01:00Z</Time>
+      <Position><LatitudeDegrees>55.7600</LatitudeDegrees><LongitudeDegrees>37.6200</LongitudeDegrees></Position>
+    </Trackpoint>
+  </Track></Lap></Activity></Activities>
+</TrainingCenterDatabase>'''
+
+
+class TrackImportTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+
+    def test_gpx_upload(self):
+        upload = SimpleUploadedFile('morning.gpx', GPX)
+        response = self.client.post('/api/runs/import/', {'file': upload, 'athlete': self.athlete.id})
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data['status'], data['comment'], data['points'], data['skipped']),
+                         ('finished', 'Morning run', 3, 1))
+        self.assertEqual(data['created_at'], '2026-05-01T06:00:00Z')
+        self.assertAlmostEqual(data['distance'], haversine((55.7558, 37.6173), (55.76, 37.62))
+                               + haversine((55.76, 37.62), (55.765, 37.61)), places=6)
+        self.assertEqual(str(Run.objects.get(id=data['id']).positions().order_by('id').last().created_at),
+                         '2026-05-01 06:02:00+00:00')
+        self.assertEqual(AthleteStats.objects.get(athlete=self.athlete).runs_finished, 1)
+
+    def test_tcx_and_errors(self):
+        track_data = parse_track(BytesIO(TCX), 'tcx')
+        self.assertEqual([str(lat) for lat in track_data['latitudes']], ['55.7558', '55.7600'])
+        upload = SimpleUploadedFile('broken.gpx', b'<gpx><trk>')
+        response = self.client.post('/api/runs/import/', {'file': upload, 'athlete': self.athlete.id})
+        self.assertEqual(response.status_code, 400)
+        # сущности в XML не раскрываются (billion laughs)
+        bomb = b'<?xml version="1.0"?><!DOCTYPE gpx [<!ENTITY a "aaaa">]><gpx><trk><name>&a;</name></trk></gpx>'
+        response = self.client.post('/api/runs/import/', {'file': SimpleUploadedFile('bomb.gpx', bomb),
+                                                          'athlete': self.athlete.id})
+        self.assertEqual(response.status_code, 400)
+
+    def test_parse_in_spawned_process(self):
+        # разбор в пуле import_tracks не должен требовать настроенного Django в процессе
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'morning.gpx')
+            with open(path, 'wb') as f:
+                f.write(GPX)
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                track_data = pool.submit(trackfiles.parse_file, path).result()
+        self.assertEqual(len(track_data['latitudes']), 3)
+
+
+class RunAnalyticsTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=self.athlete, status='finished', distance=0)
+        start = datetime(2026, 5, 1, 6, 0, tzinfo=dt_timezone.utc)
+        # 25 точек по меридиану через ~111 м каждые 30 с, плюс GPS-выброс на 10-й точке
+        positions = []
+        for i in range(25):
+            lat = Decimal('55.7000') + Decimal('0.0010') * i
+            lon = Decimal('37.6000') if i != 10 else Decimal('37.7000')
+            positions.append(Position(run=self.run, latitude=lat, longitude=lon,
+                                      created_at=start + timedelta(seconds=30 * i)))
+        Position.objects.bulk_create(positions)
+
+    def test_splits_outliers_and_cache(self):
+        response = self.client.get(f'/api/runs/{self.run.id}/analytics/')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['points'], data['points_dropped']), (25, 1))
+        expected_km = haversine((55.7, 37.6), (55.724, 37.6))
+        self.assertAlmostEqual(data['distance_km'], expected_km, places=2)
+        self.assertEqual(data['elapsed_time_s'], 720)
+        self.assertEqual([split['km'] for split in data['splits']], [1, 2, 3])
+        self.assertAlmostEqual(data['splits'][0]['time_s'], 1000 / (expected_km * 1000 / 720), delta=1)
+        self.assertLess(data['max_speed_kmh'], 15)
+
+        with self.assertNumQueries(1): # только сам забег, аналитика уже в run.analytics
+            self.assertEqual(self.client.get(f'/api/runs/{self.run.id}/analytics/').json(), data)
+        segments = self.client.get(f'/api/runs/{self.run.id}/analytics/?segments=1').json()
+        self.assertEqual(len(segments['segment_speeds_kmh']), 23)
+
+    def test_device_time_and_untimed_points(self):
+        run = Run.objects.create(athlete=self.athlete, status='in_progress')
+        start = datetime(2026, 5, 2, 6, 0, tzinfo=dt_timezone.utc)
+        items = [{'run': run.id, 'latitude': f'55.{7000 + 10 * i}', 'longitude': '37.6000',
+                  'time': (start + timedelta(seconds=30 * i)).isoformat()} for i in range(12)]
+        self.client.post('/api/positions/bulk/', items, content_type='application/json')
+        self.client.post('/api/positions/', {'run': run.id, 'latitude': '55.8200', 'longitude': '37.6000',
+                                             'time': '2026-05-02T06:06:00Z'})
+        self.assertEqual(run.positions().order_by('id').last().created_at, start + timedelta(minutes=6))
+        data = self.client.get(f'/api/runs/{run.id}/analytics/').json()
+        self.assertTrue(data['timestamps_ok'])
+        self.assertEqual(data['elapsed_time_s'], 360.0)
+        self.assertEqual(data['splits'][0]['km'], 1)
+
+        # те же точки пачкой без time: время у всех - момент приема, скорости не считаются
+        untimed = Run.objects.create(athlete=self.athlete, status='in_progress')
+        for item in items:
+            item.update(run=untimed.id, time=None)
+        self.client.post('/api/positions/bulk/', items, content_type='application/json')
+        data = self.client.get(f'/api/runs/{untimed.id}/analytics/').json()
+        self.assertFalse(data['timestamps_ok'])
+        self.assertEqual((data['avg_speed_kmh'], data['splits']), (None, []))
+        self.assertGreater(data['distance_km'], 1)
+
+        response = self.client.post('/api/positions/bulk/', [{**items[0], 'time': 'вчера'}],
+                                    content_type='application/json')
+        self.assertEqual(response.json()['errors'][0]['index'], 0)
+
+
+@override_settings(RUN_FINALIZE_WORKERS=0)
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.athletes = [User.objects.create(username=f'runner{i}') for i in range(3)]
+        self.day = datetime(2026, 5, 6, 7, 0, tzinfo=dt_timezone.utc) # среда
+        for athlete, distances in zip(self.athletes, [[5, 7], [12], [3]]):
+            for distance in distances:
+                run = Run.objects.create(athlete=athlete, status='finalizing', distance=distance, created_at=self.day)
+                finalize_run(run.id)
+        # забег прошлого месяца в текущую неделю/месяц не попадает
+        old = Run.objects.create(athlete=self.athletes[2], status='finalizing', distance=100,
+                                 created_at=self.day - timedelta(days=30))
+        finalize_run(old.id)
+
+    def get(self, **params):
+        response = self.client.get('/api/leaderboard/', {'date': '2026-05-06', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_top_and_rank(self):
+        data = self.get(metric='distance', period='week', athlete=self.athletes[0].id)
+        self.assertEqual(data['bucket'], '2026-05-04')
+        self.assertEqual([(row['username'], row['rank'], row['value']) for row in data['results']],
+                         [('runner0', 1, 12.0), ('runner1', 1, 12.0), ('runner2', 3, 3.0)])
+        self.assertEqual((data['athlete']['rank'], data['athlete']['total']), (1, 3))
+
+        data = self.get(metric='runs', period='all', athlete=self.athletes[2].id, size=1)
+        self.assertEqual([row['username'] for row in data['results']], ['runner0'])
+        self.assertEqual((data['athlete']['rank'], data['athlete']['value']), (1, 2))
+        self.assertEqual(self.get(metric='distance', period='all')['results'][0]['value'], 103.0)
+        self.assertEqual(self.client.get('/api/leaderboard/?period=year').status_code, 400)
+
+    def test_rank_follows_new_runs_and_rebuild(self):
+        self.assertEqual(self.get(athlete=self.athletes[2].id)['athlete']['rank'], 3)
+        run = Run.objects.create(athlete=self.athletes[2], status='finalizing', distance=20, created_at=self.day)
+        finalize_run(run.id)
+        self.assertEqual(self.get(athlete=self.athletes[2].id)['athlete']['rank'], 1)
+
+        before = sorted(LeaderboardEntry.objects.values_list('period', 'bucket', 'athlete', 'runs', 'distance'))
+        rebuild_leaderboard()
+        after = sorted(LeaderboardEntry.objects.values_list('period', 'bucket', 'athlete', 'runs', 'distance'))
+        self.assertEqual(before, after)
+
+    def test_rank_queries(self):
+        # место - COUNT по индексу, без выборки всей корзины: запросов столько же при любом кол-ве атлетов
+        more = User.objects.bulk_create(User(username=f'more{i}') for i in range(20))
+        LeaderboardEntry.objects.bulk_create(
+            LeaderboardEntry(athlete=athlete, period='week', bucket=date(2026, 5, 4), runs=1, distance=i)
+            for i, athlete in enumerate(more)
+        )
+        with self.assertNumQueries(4):
+            data = self.get(athlete=self.athletes[0].id, size=3)
+        self.assertEqual((data['athlete']['rank'], data['athlete']['total']), (8, 23)) # впереди 13..19 км
+        self.assertEqual([row['rank'] for row in data['results']], [1, 2, 3])
+        with self.assertNumQueries(3): # размер корзины уже в кэше
+            self.assertEqual(self.get(athlete=more[0].id, size=3)['athlete']['total'], 23)
+
+
+@override_settings(RUN_FINALIZE_WORKERS=0)
+class NearbyRunsTests(TestCase):
+    def setUp(self):
+        self.athlete = User.objects.create(username='runner')
+        self.park = Run.objects.create(athlete=self.athlete, status='in_progress')
+        self.river = Run.objects.create(athlete=self.athlete, status='in_progress')
+        self.far = Run.objects.create(athlete=self.athlete, status='in_progress')
+        # старт через точку (save), остальное - пачкой (bulk_create), ячейки должны заполниться в обоих случаях
+        self.client.post('/api/positions/', {'run': self.park.id, 'latitude': 55.7558, 'longitude': 37.6173})
+        self.client.post('/api/positions/bulk/', [
+            {'run': self.park.id, 'latitude': 55.7600, 'longitude': 37.6200},
+            {'run': self.river.id, 'latitude': 55.7300, 'longitude': 37.5800}, # ~4 км от парка
+            {'run': self.river.id, 'latitude': 55.7550, 'longitude': 37.6300}, # проходит рядом
+            {'run': self.far.id, 'latitude': 59.9386, 'longitude': 30.3141},
+        ], content_type='application/json')
+
+    def nearby(self, **params):
+        response = self.client.get('/api/runs/nearby/', {'lat': 55.7558, 'lon': 37.6173, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(item['id'], item['distance_to_point']) for item in response.json()]
+
+    def test_cells_and_start_points(self):
+        self.assertFalse(Position.objects.filter(cell__isnull=True).exists())
+        self.park.refresh_from_db()
+        self.assertEqual((self.park.start_latitude, self.park.start_longitude), (55.7558, 37.6173))
+
+    def test_started_and_passed_near(self):
+        self.assertEqual(self.nearby(radius=1), [(self.park.id, 0.0)])
+        self.assertEqual([run_id for run_id, _ in self.nearby(radius=5)], [self.park.id, self.river.id])
+
+        passed = self.nearby(radius=1, by='track')
+        self.assertEqual([run_id for run_id, _ in passed], [self.park.id, self.river.id])
+        self.assertAlmostEqual(passed[1][1], haversine((55.7558, 37.6173), (55.755, 37.63)), places=3)
+        self.assertEqual([run_id for run_id, _ in self.nearby(radius=1, by='track', size=1)], [self.park.id])
+        self.assertEqual(self.nearby(radius=1, by='track', athlete=self.athlete.id, status='finished'), [])
+        self.assertEqual(self.client.get('/api/runs/nearby/?lat=55&lon=37&radius=1000').status_code, 400)
+
+    def test_reindex_packed_and_archived_runs(self):
+        Run.objects.filter(id__in=[self.park.id, self.river.id]).update(status='finished')
+        track.pack_run(self.park)
+        archive_run(self.river)
+        # старт еще не заполнен - как у забегов, упакованных или заархивированных до появления поиска рядом
+        Run.objects.update(start_latitude=None, start_longitude=None, start_cell=None)
+        reindex_cells()
+        self.assertEqual([run_id for run_id, _ in self.nearby(radius=5)], [self.park.id, self.river.id])
+
+        Run.objects.update(start_latitude=None, start_longitude=None, start_cell=None)
+        import_module('app_run.migrations.0017_grid_cells').fill_cells(apps, None)
+        self.park.refresh_from_db()
+        self.assertEqual((self.park.start_latitude, self.park.start_longitude), (55.7558, 37.6173))
+        self.assertIsNotNone(self.park.start_cell)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.admin = User.objects.create(username='admin', is_superuser=True)
+        self.coach = User.objects.create(username='coach', is_staff=True)
+        athlete = User.objects.create(username='runner')
+        Run.objects.create(athlete=athlete, comment='test')
+
+    def test_histograms_and_access(self):
+        self.client.get('/api/runs/')
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+        self.client.force_login(self.coach) # is_staff - это тренер, а не админ
+        self.assertEqual(self.client.get('/api/_metrics').status_code, 403)
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/_metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        line = next(line for line in text.splitlines()
+                    if line.startswith('http_request_db_queries_count') and 'api/runs' in line and 'GET' in line)
+        self.assertTrue(line.endswith(' 1'))
+        self.assertIn('http_response_render_seconds_count', text)
+        self.assertIn('status="403"', text)
+
+    def test_unknown_method_label(self):
+        self.client.generic('BREW', '/api/runs/')
+        self.client.generic('PROPFIND', '/api/runs/')
+        text = metrics.render_prometheus()
+        self.assertIn('method="other"', text)
+        self.assertNotIn('BREW', text)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_request_log(self):
+        with self.assertLogs('app_run.metrics', 'WARNING') as logs:
+            self.client.get('/api/users/')
+        self.assertIn('/api/users/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+        self.assertEqual(metrics.fingerprint('SELECT 1 WHERE id IN (%s, %s, %s)'), 'SELECT 1 WHERE id IN (%s, ...)')
+
+
+class ApiBenchmarkTests(TestCase):
+    def test_query_budgets(self):
+        # кол-во SQL-запросов горячих эндпоинтов не должно расти вместе с данными (app_run/benchmark.py)
+        athlete_ids = benchmark.seed(athletes=5, runs=3, positions=5)
+        results = benchmark.run_benchmark(athlete_ids, repeat=2)
+        self.assertEqual(set(results), set(benchmark.ENDPOINTS))
+        self.assertEqual(benchmark.over_budget(results), [])
+
+
+class FastListTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='runner', first_name='Иван', last_name='Петров')
+        for i in range(5):
+            run = Run.objects.create(athlete=self.athlete, comment=f'забег "{i}" ', status='in_progress')
+            Position.objects.create(run=run, latitude=Decimal('55.7558'), longitude=Decimal('-37.0100'))
+            Position.objects.create(run=run, latitude=Decimal('-5.1'), longitude=Decimal('120'))
+            if i % 2:
+                Run.objects.filter(id=run.id).update(distance=i * 1.1 + 0.123456789)
+        self.run = run
+
+    def compare(self, viewset, url):
+        fast = self.client.get(url)
+        cache.clear()
+        with mock.patch.object(viewset, 'values_serializer_class', None):
+            regular = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, regular.content)
+        return fast.json()
+
+    def test_same_bytes_as_model_serializers(self):
+        from app_run.views import RunViewSet, PositionViewSet
+        data = self.compare(RunViewSet, '/api/runs/')
+        self.assertEqual(data[0]['athlete_data']['first_name'], 'Иван')
+        page = self.compare(RunViewSet, '/api/runs/?size=2&ordering=-created_at')
+        self.compare(RunViewSet, '/api/runs/?size=2&cursor=' + page['next'].split('cursor=')[1])
+        self.compare(RunViewSet, '/api/runs/?size=2&page=2&status=in_progress')
+        data = self.compare(PositionViewSet, f'/api/positions/?run={self.run.id}')
+        self.assertEqual((data[1]['latitude'], data[1]['longitude']), ('-5.1000', '120.0000'))
+        self.compare(PositionViewSet, f'/api/positions/?run={self.run.id}&size=1')
+        self.compare(PositionViewSet, '/api/positions/')
+        self.compare(PositionViewSet, '/api/positions/?size=1')
+        self.assertEqual(self.client.get('/api/positions/?run=abc').status_code, 400)
+
+
+@override_settings(RUN_FINALIZE_WORKERS=0, LIVE_POLL_INTERVAL=0.05)
+class AsyncEndpointsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=self.athlete, comment='test')
+
+    async def test_start_ingest_stop(self):
+        response = await self.async_client.post(f'/api/async/runs/{self.run.id}/start/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['status'], 'in_progress')
+        response = await self.async_client.post(f'/api/async/runs/{self.run.id}/start/')
+        self.assertEqual(response.status_code, 400)
+
+        data = {'run': self.run.id, 'latitude': 55.7558, 'longitude': 37.6173}
+        response = await self.async_client.post('/api/async/positions/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['latitude'], '55.7558')
+        data = [{'run': self.run.id, 'latitude': 55.7568, 'longitude': 37.6173}, {'run': self.run.id, 'latitude': 100}]
+        response = await self.async_client.post('/api/async/positions/', data, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['created'], 1)
+        response = await self.async_client.post('/api/async/positions/', {'run': self.run.id, 'latitude': 91, 'longitude': 0},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = await self.async_client.post(f'/api/async/runs/{self.run.id}/stop/')
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual(body['status'], 'finished')
+        self.assertAlmostEqual(body['distance'], 0.111, places=2)
+        response = await self.async_client.post('/api/async/positions/', {'run': self.run.id, 'latitude': 1, 'longitude': 1},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((await self.async_client.post('/api/async/runs/0/stop/')).status_code, 404)
+
+    async def test_live_feed(self):
+        await Run.objects.filter(id=self.run.id).aupdate(status='in_progress')
+        self.assertEqual((await self.async_client.get('/api/runs/0/live/')).status_code, 404)
+
+        first = live.subscribe(self.run.id)
+        second = live.subscribe(self.run.id)
+        self.assertIn('"status":"in_progress"', await anext(first))
+        self.assertIn('"status":"in_progress"', await anext(second))
+
+        data = {'run': self.run.id, 'latitude': 55.7558, 'longitude': 37.6173}
+        await self.async_client.post('/api/async/positions/', data, content_type='application/json')
+        event = await anext(first)
+        self.assertTrue(event.startswith('id: ') and 'event: position' in event)
+        self.assertEqual(event, await anext(second)) # одна трансляция на всех зрителей
+        self.assertEqual(len(live._loop_feeds()), 1)
+
+        await self.async_client.post(f'/api/async/runs/{self.run.id}/stop/')
+        events = [event async for event in first]
+        self.assertIn('"status":"finished"', events[-1])
+        await second.aclose()
+
+    @override_settings(LIVE_KEEPALIVE=0.05)
+    async def test_live_feed_error_closes_streams(self):
+        await Run.objects.filter(id=self.run.id).aupdate(status='in_progress')
+        stream = live.subscribe(self.run.id)
+        self.assertIn('"status":"in_progress"', await anext(stream))
+        with mock.patch.object(live.RunFeed, '_poll', side_effect=DatabaseError('boom')), \
+                self.assertLogs('app_run.live', 'ERROR'):
+            live.notify(self.run.id)
+            # поток закрывается, а не шлет ping вечно
+            with self.assertRaises(StopAsyncIteration):
+                await asyncio.wait_for(anext(stream), 1)
+        self.assertEqual(live._loop_feeds(), {})
+
+    def test_live_feed_requires_asgi(self):
+        response = self.client.get(f'/api/runs/{self.run.id}/live/')
+        self.assertEqual(response.status_code, 501)
+
+    async def test_idempotent_start(self):
+        url = f'/api/async/runs/{self.run.id}/start/'
+        first = await self.async_client.post(url, headers={'Idempotency-Key': 'start-1'})
+        again = await self.async_client.post(url, headers={'Idempotency-Key': 'start-1'})
+        self.assertEqual((first.status_code, again.status_code), (200, 200))
+        self.assertEqual(first.json(), again.json())
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        # без ключа повтор выполняется заново и получает ошибку
+        self.assertEqual((await self.async_client.post(url)).status_code, 400)
+
+
+@override_settings(RUN_FINALIZE_WORKERS=0)
+class RunTransitionsConcurrencyTests(TransactionTestCase):
+    # одновременные запросы в разных потоках, у каждого свое соединение с БД - поэтому TransactionTestCase
+    threads = 8
+
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='runner')
+        # девять законченных забегов: десятый дает челлендж "Сделай 10 Забегов!"
+        Run.objects.bulk_create(Run(athlete=self.athlete, comment='old', status='finished', distance=1) for _ in range(9))
+        rebuild_stats()
+        self.run = Run.objects.create(athlete=self.athlete, comment='test')
+
+    def _post_concurrently(self, url, headers=None):
+        # url - один адрес для всех потоков или список адресов (по потоку на адрес)
+        urls = url if isinstance(url, list) else [url] * self.threads
+        barrier = threading.Barrier(len(urls))
+        results = []
+
+        def worker(url):
+            try:
+                barrier.wait()
+                results.append(Client().post(url, headers=headers or {}))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(url,)) for url in urls]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return sorted(response.status_code for response in results)
+
+    def test_concurrent_start_and_stop(self):
+        codes = self._post_concurrently(f'/api/runs/{self.run.id}/start/')
+        self.assertEqual(codes, [200] + [400] * (self.threads - 1))
+
+        codes = self._post_concurrently(f'/api/runs/{self.run.id}/stop/')
+        self.assertEqual(codes, [200] + [400] * (self.threads - 1))
+        self.assertEqual(Run.objects.get(id=self.run.id).status, 'finished')
+        self.assertEqual(AthleteStats.objects.get(athlete=self.athlete).runs_finished, 10)
+        self.assertEqual(Challenge.objects.filter(athlete=self.athlete, full_name='Сделай 10 Забегов!').count(), 1)
+        self.assertEqual(LeaderboardEntry.objects.get(athlete=self.athlete, period='all').runs, 1)
+
+    def test_first_runs_of_new_athlete(self):
+        # у атлета еще нет строки статистики - одновременные остановки не должны падать на ее вставке
+        athlete = User.objects.create(username='newbie')
+        runs = Run.objects.bulk_create(Run(athlete=athlete, comment='new', status='in_progress') for _ in range(4))
+        codes = self._post_concurrently([f'/api/runs/{run.id}/stop/' for run in runs])
+        self.assertEqual(codes, [200] * 4)
+        self.assertEqual(AthleteStats.objects.get(athlete=athlete).runs_finished, 4)
+
+    def test_idempotency_key(self):
+        Run.objects.filter(id=self.run.id).update(status='in_progress')
+        codes = self._post_concurrently(f'/api/runs/{self.run.id}/stop/', {'Idempotency-Key': 'stop-1'})
+        # выполнился один запрос; остальные получили его ответ или 409 (если первый еще выполнялся)
+        self.assertEqual(codes.count(400), 0)
+        self.assertIn(200, codes)
+        self.assertEqual(set(codes) - {200, 409}, set())
+        self.assertEqual(AthleteStats.objects.get(athlete=self.athlete).runs_finished, 10)
+
+        response = self.client.post(f'/api/runs/{self.run.id}/stop/', headers={'Idempotency-Key': 'stop-1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(response.json()['status'], 'finished')
+        response = self.client.post(f'/api/runs/{self.run.id}/stop/', headers={'Idempotency-Key': 'stop-2'})
+        self.assertEqual(response.status_code, 400)
+        # ответ 4xx сохранен, хотя транзакция запроса откатилась
+        response = self.client.post(f'/api/runs/{self.run.id}/stop/', headers={'Idempotency-Key': 'stop-2'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+
+
+@override_settings(RUN_FINALIZE_WORKERS=0)
+class PositionArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=self.athlete, comment='test', status='in_progress')
+        for lat in ('55.7558', '55.7568', '55.7578'):
+            self.client.post('/api/positions/', {'run': self.run.id, 'latitude': lat, 'longitude': '37.6173'})
+
+    def test_archive_on_finish(self):
+        before = self.client.get(f'/api/positions/?run={self.run.id}').json()
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.run.refresh_from_db()
+        self.assertTrue(self.run.positions_archived)
+        self.assertFalse(Position.objects.exists())
+        self.assertEqual(PositionArchive.objects.filter(run=self.run).count(), 3)
+
+        # чтение точек идет из архива, ответы те же (и id точек те же)
+        self.assertEqual(self.client.get(f'/api/positions/?run={self.run.id}').json(), before)
+        self.assertEqual(self.client.get(f'/api/positions/{before[0]["id"]}/').json(), before[0])
+        response = self.client.get(f'/api/runs/nearby/?lat=55.7568&lon=37.6173&radius=0.5&by=track')
+        self.assertEqual([item['id'] for item in response.json()], [self.run.id])
+        csv = b''.join(self.client.get(f'/api/runs/{self.run.id}/track.csv').streaming_content)
+        self.assertEqual(csv.count(b'\n'), 4)
+
+        # точка удаляется прямо в архиве (забег обратно в Position не переносится), дистанция пересчитывается
+        response = self.client.delete(f'/api/positions/{before[2]["id"]}/')
+        self.assertEqual(response.status_code, 204)
+        self.run.refresh_from_db()
+        self.assertTrue(self.run.positions_archived)
+        self.assertEqual(PositionArchive.objects.filter(run=self.run).count(), 2)
+        self.assertFalse(Position.objects.exists())
+        self.assertAlmostEqual(self.run.distance, haversine((55.7558, 37.6173), (55.7568, 37.6173)), places=6)
+
+        # и правится тоже в архиве
+        point = {'run': self.run.id, 'latitude': '55.7588', 'longitude': '37.6173'}
+        response = self.client.put(f'/api/positions/{before[1]["id"]}/', point, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PositionArchive.objects.get(id=before[1]['id']).latitude, Decimal('55.7588'))
+        self.assertFalse(Position.objects.exists())
+        self.run.refresh_from_db()
+        self.assertAlmostEqual(self.run.distance, haversine((55.7558, 37.6173), (55.7588, 37.6173)), places=6)
+        # а в забег, который еще не начат, точку не добавить и не перенести
+        other = Run.objects.create(athlete=self.athlete, comment='other')
+        point['run'] = other.id
+        response = self.client.put(f'/api/positions/{before[1]["id"]}/', point, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_edits_update_stats_and_leaderboard(self):
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+        ids = list(PositionArchive.objects.filter(run=self.run).order_by('id').values_list('id', flat=True))
+        self.client.delete(f'/api/positions/{ids[2]}/')
+        point = {'run': self.run.id, 'latitude': '55.7658', 'longitude': '37.6173'}
+        self.client.put(f'/api/positions/{ids[1]}/', point, content_type='application/json')
+        self.run.refresh_from_db()
+        self.assertAlmostEqual(self.run.distance, haversine((55.7558, 37.6173), (55.7658, 37.6173)), places=6)
+        # то же, что получилось бы при пересчете с нуля
+        self.assertAlmostEqual(AthleteStats.objects.get(athlete=self.athlete).total_distance, self.run.distance)
+        for entry in LeaderboardEntry.objects.filter(athlete=self.athlete):
+            self.assertAlmostEqual(entry.distance, self.run.distance)
+        rebuild_stats()
+        rebuild_leaderboard()
+        self.assertAlmostEqual(AthleteStats.objects.get(athlete=self.athlete).total_distance, self.run.distance)
+
+    def test_list_without_run(self):
+        # без ?run= отдаются все точки - и из Position, и из архива, по порядку
+        active = Run.objects.create(athlete=self.athlete, comment='active', status='in_progress')
+        self.client.post(f'/api/runs/{self.run.id}/stop/')
+        self.client.post('/api/positions/', {'run': active.id, 'latitude': '55.7600', 'longitude': '37.6173'})
+        expected = [str(point.id) for point in PositionArchive.objects.order_by('created_at', 'id')] \
+            + [str(point.id) for point in Position.objects.all()]
+        data = self.client.get('/api/positions/').json()
+        self.assertEqual([str(point['id']) for point in data], expected)
+        self.assertEqual(data[-1], {'id': int(expected[-1]), 'run': active.id, 'latitude': '55.7600',
+                                    'longitude': '37.6173'})
+
+        # по страницам (keyset и номер страницы) - те же точки
+        ids, url = [], '/api/positions/?size=3'
+        while url:
+            page = self.client.get(url).json()
+            ids.extend(str(point['id']) for point in page['results'])
+            url = page['next']
+        self.assertEqual(ids, expected)
+        self.assertEqual(self.client.get('/api/positions/?size=3').json()['count'], 4)
+        page = self.client.get('/api/positions/?size=3&page=2').json()
+        self.assertEqual([str(point['id']) for point in page['results']], expected[3:])
+
+    def test_archive_command(self):
+        Run.objects.filter(id=self.run.id).update(status='finished') # забег, закончившийся до появления архива
+        call_command('archive_positions', '--chunk-size', '2', stdout=StringIO())
+        self.run.refresh_from_db()
+        self.assertTrue(self.run.positions_archived)
+        self.assertEqual(list(PositionArchive.objects.values_list('latitude', flat=True).order_by('id')),
+                         [Decimal('55.7558'), Decimal('55.7568'), Decimal('55.7578')])
+        call_command('archive_positions', '--restore', str(self.run.id), stdout=StringIO())
+        self.assertEqual(Position.objects.filter(run=self.run).count(), 3)
+        self.assertFalse(PositionArchive.objects.exists())
+
+
+class StartupProfileTests(TestCase):
+    def test_parse_importtime(self):
+        rows = startup.parse_importtime(
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       120 |        120 |     rest_framework.compat\n'
+            'import time:       300 |        420 |   rest_framework\n'
+            'import time:        80 |        500 | app_run.views\n'
+        )
+        self.assertEqual(rows[-1], ('app_run.views', 80, 500, 0))
+        self.assertEqual(rows[0][3], 2)
+        self.assertEqual(startup.by_package(rows), {'rest_framework': 420, 'app_run': 80})
+
+    def test_production_cold_start(self):
+        # в продакшне не должно быть debug_toolbar, а тяжелые необязательные библиотеки импортируются при первом использовании
+        result = startup.profile_startup('project_run.settings.production', repeat=1)
+        self.assertGreater(result['wall_ms'], 0)
+        self.assertIn('app_run.views', result['modules'])
+        self.assertNotIn('debug_toolbar', result['packages'])
+        self.assertNotIn('numpy', result['packages'])
+
+
+class WriteThroughputTests(TransactionTestCase):
+    def test_write_throughput(self):
+        # бенчмарк пишет в БД по-настоящему, с переоткрытием соединений - и после себя все удаляет
+        for conn_max_age in (0, None):
+            self.assertGreater(benchmark.write_throughput(requests=3, conn_max_age=conn_max_age), 0)
+        self.assertFalse(Run.objects.exists())
+        self.assertFalse(Position.objects.exists())
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], 0)
+
+
+class AthleteProfilesTests(TestCase):
+    def setUp(self):
+        self.athletes = [User.objects.create(username=f'runner{i}') for i in range(4)]
+        AthleteInfo.objects.create(user_id=self.athletes[0], goals='марафон', weight=70)
+        Challenge.objects.create(athlete=self.athletes[0], full_name='Сделай 10 Забегов!')
+
+    def test_single_profile_does_not_write(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/athlete_info/{self.athletes[1].id}/')
+        self.assertEqual(response.json(), {'goals': None, 'weight': None, 'user_id': self.athletes[1].id})
+        self.assertEqual(AthleteInfo.objects.count(), 1)
+        self.assertEqual(self.client.get('/api/athlete_info/0/').status_code, 404)
+
+    def test_batch_profiles(self):
+        ids = [self.athletes[2].id, self.athletes[0].id, 0]
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/athlete_info/?ids={",".join(map(str, ids))}')
+        self.assertEqual(response.json(), [
+            {'goals': None, 'weight': None, 'user_id': self.athletes[2].id},
+            {'goals': 'марафон', 'weight': 70, 'user_id': self.athletes[0].id},
+        ])
+        self.assertEqual(self.client.get('/api/athlete_info/?ids=1,abc').status_code, 400)
+
+    def test_users_expand(self):
+        url = '/api/users/?expand=athlete_info,challenges&ordering=date_joined'
+        with self.assertNumQueries(2):
+            data = self.client.get(url).json()
+        self.assertEqual(data[0]['athlete_info'], {'goals': 'марафон', 'weight': 70, 'user_id': self.athletes[0].id})
+        self.assertEqual(data[0]['challenges'], [{'full_name': 'Сделай 10 Забегов!', 'athlete': self.athletes[0].id}])
+        self.assertEqual(data[1]['challenges'], [])
+        # кол-во запросов не зависит от кол-ва юзеров
+        User.objects.bulk_create(User(username=f'more{i}') for i in range(10))
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        self.assertNotIn('challenges', self.client.get('/api/users/').json()[0])
+
+
+class RunSummaryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.athlete = User.objects.create(username='runner')
+        other = User.objects.create(username='other')
+        for athlete, day, dist in ((self.athlete, date(2026, 3, 2), 5.0), (self.athlete, date(2026, 3, 2), 3.5),
+                                   (self.athlete, date(2026, 3, 8), 10.0), (self.athlete, date(2026, 4, 1), 7.25),
+                                   (other, date(2026, 3, 2), 42.0)):
+            run = Run.objects.create(athlete=athlete, status='finished', distance=dist)
+            Run.objects.filter(id=run.id).update(created_at=datetime(2026, day.month, day.day, 8, tzinfo=dt_timezone.utc))
+
+    def summary(self, query):
+        return self.client.get(f'/api/runs/summary/?athlete={self.athlete.id}&{query}')
+
+    def test_group_by(self):
+        with self.assertNumQueries(1):
+            response = self.summary('group_by=day')
+        self.assertEqual(response.json(), [
+            {'period': '2026-03-02', 'runs': 2, 'distance': 8.5},
+            {'period': '2026-03-08', 'runs': 1, 'distance': 10.0},
+            {'period': '2026-04-01', 'runs': 1, 'distance': 7.25},
+        ])
+        self.assertEqual(self.summary('group_by=week').json(), [
+            {'period': '2026-03-02', 'runs': 3, 'distance': 18.5},
+            {'period': '2026-03-30', 'runs': 1, 'distance': 7.25},
+        ])
+        self.assertEqual(self.summary('group_by=month&created_at__lt=2026-04-01').json(), [
+            {'period': '2026-03-01', 'runs': 3, 'distance': 18.5},
+        ])
+        self.assertEqual(self.summary('group_by=year').status_code, 400)
+
+    def test_range_filters(self):
+        response = self.client.get('/api/runs/?created_at__gte=2026-03-03&created_at__lt=2026-04-02&distance__gte=8')
+        self.assertEqual([run['distance'] for run in response.json()], [10.0])
+        response = self.client.get('/api/runs/?distance__gte=7&distance__lte=10&ordering=created_at')
+        self.assertEqual([run['distance'] for run in response.json()], [10.0, 7.25])
+
+
+@override_settings(POSITIONS_FILTER_ENABLED=True)
+class PositionNoiseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        athlete = User.objects.create(username='runner')
+        self.run = Run.objects.create(athlete=athlete, status='in_progress')
+
+    def post(self, lat, lon):
+        with self.captureOnCommitCallbacks(execute=True): # состояние фильтра пишется в кэш после COMMIT
+            return self.client.post('/api/positions/', {'run': self.run.id, 'latitude': lat, 'longitude': lon})
+
+    def test_duplicates_and_jitter(self):
+        self.assertEqual(self.post(55.7558, 37.6173).status_code, 201)
+        response = self.post(55.7558, 37.6173)
+        self.assertEqual((response.status_code, response.json()), (200, {'dropped': 'duplicate'}))
+        # ~11 м от прошлой точки (шаг хранения координат) при пороге 20 м - стоим на месте
+        with self.settings(POSITIONS_MIN_DISTANCE_M=20):
+            self.assertEqual(self.post(55.7559, 37.6173).json(), {'dropped': 'too_close'})
+        self.assertEqual(self.post(55.7568, 37.6173).status_code, 201)
+
+        items = [{'run': self.run.id, 'latitude': lat, 'longitude': 37.6173}
+                 for lat in (55.7568, 55.7578, 55.7578, 55.7588)]
+        with self.assertNumQueries(8): # столько же, сколько без фильтра (2 из них - SAVEPOINT)
+            response = self.client.post('/api/positions/bulk/', items, content_type='application/json')
+        self.assertEqual(response.json(), {'created': 2, 'dropped': 2, 'errors': []})
+        self.assertEqual(Position.objects.filter(run=self.run).count(), 4)
+        self.run.refresh_from_db()
+        self.assertAlmostEqual(self.run.distance, haversine((55.7558, 37.6173), (55.7588, 37.6173)), places=6)
+        self.assertIn('positions_dropped_total{reason="duplicate"} 3', metrics.render_prometheus())
+
+    @override_settings(POSITIONS_MIN_INTERVAL=1, POSITIONS_MAX_SPEED=12)
+    def test_time_checks(self):
+        with mock.patch('app_run.noise.time.time', return_value=1000.0):
+            self.post(55.7558, 37.6173)
+            self.assertEqual(self.post(55.7568, 37.6173).json(), {'dropped': 'too_soon'})
+        with mock.patch('app_run.noise.time.time', return_value=1005.0):
+            # 1 км за 5 секунд
+            self.assertEqual(self.post(55.7648, 37.6173).json(), {'dropped': 'too_fast'})
+            self.assertEqual(self.post(55.7562, 37.6173).status_code, 201) # 45 м за 5 секунд
+
+    @override_settings(POSITIONS_MIN_INTERVAL=1, POSITIONS_MAX_SPEED=12)
+    def test_device_time(self):
+        # пачка, загруженная после потери связи: все точки пришли разом, но записаны с интервалом 10 секунд
+        items = [{'run': self.run.id, 'latitude': lat, 'longitude': 37.6173, 'time': f'2026-05-01T06:00:{sec}Z'}
+                 for lat, sec in ((55.7558, 10), (55.7562, 20), (55.7566, 30), (55.7666, 31))]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/positions/bulk/', items, content_type='application/json')
+        self.assertEqual(response.json(), {'created': 3, 'dropped': 1, 'errors': []}) # последняя - 1 км за секунду
+        self.assertIn('positions_dropped_total{reason="too_fast"} 1', metrics.render_prometheus())
+        # одиночная точка тоже судится по своему времени, а не по моменту приема
+        point = {'run': self.run.id, 'latitude': 55.7570, 'longitude': 37.6173, 'time': '2026-05-01T06:00:30.500Z'}
+        self.assertEqual(self.client.post('/api/positions/', point).json(), {'dropped': 'too_soon'})
+        point['time'] = '2026-05-01T06:00:40Z'
+        self.assertEqual(self.client.post('/api/positions/', point).status_code, 201)
+
+    @override_settings(POSITIONS_MAX_SPEED=12)
+    def test_rolled_back_insert(self):
+        with mock.patch('app_run.noise.time.time', return_value=1000.0):
+            self.post(55.7558, 37.6173)
+        with mock.patch('app_run.noise.time.time', return_value=1005.0):
+            with mock.patch('app_run.views.append_positions', side_effect=DatabaseError):
+                with self.assertRaises(DatabaseError):
+                    self.post(55.7562, 37.6173)
+            # откаченная точка не попала в кэш: скорость считается от прошлой сохраненной (1 км за 5 секунд)
+            self.assertEqual(self.post(55.7648, 37.6173).json(), {'dropped': 'too_fast'})
+
+    @override_settings(POSITIONS_FILTER_ENABLED=False)
+    def test_disabled(self):
+        self.post(55.7558, 37.6173)
+        self.assertEqual(self.post(55.7558, 37.6173).status_code, 201)
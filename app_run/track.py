@@ -0,0 +1,212 @@
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timezone
+from decimal import Decimal
+from itertools import accumulate, repeat
+from math import radians, cos, pi, hypot
+
+from django.db import transaction
+
+from app_run.distance import EARTH_RADIUS_KM
+from app_run.models import Run, Position
+
+
+# Формат упакованного трека (Run.track):
+#   заголовок '<BIq': версия формата, кол-во точек, время первой точки (мс от эпохи)
+#   дальше zlib от колонок (little-endian), каждая - дельты от предыдущей точки:
+#   широта и долгота в микроградусах (int32), время в мс и (с версии 2) id строки Position.
+# Соседние точки трека близки друг к другу, а id идут подряд, поэтому дельты маленькие и отлично жмутся.
+# id хранятся, чтобы после упаковки и распаковки у точек были те же id, что и до нее;
+# в треках версии 1 их нет - такие точки отдаются с id = null.
+# В версиях 1 и 2 время и id были int32: пауза между точками больше ~24.8 суток (или id больше 2^31)
+# не помещалась. С версии 3 эти колонки int64 - zlib сжимает старшие нулевые байты почти даром
+TRACK_FORMAT_VERSION = 3
+COLUMNS = {1: 'iii', 2: 'iiii', 3: 'iiqq'} # версия формата -> типы колонок (коды array)
+HEADER = struct.Struct('<BIq')
+MICRODEGREES = 1_000_000
+COORDINATE_STEP = Decimal('0.0001') # точность, с которой координаты хранятся в Position
+
+
+def _column(values, typecode='i'):
+    deltas = array(typecode, (b - a for a, b in zip([0, *values], values)))
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return deltas.tobytes()
+
+
+def _restore_column(raw, typecode='i'):
+    # дельты колонки; исходные значения получаются через accumulate()
+    deltas = array(typecode)
+    deltas.frombytes(raw)
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+    return deltas
+
+
+def encode_track(latitudes, longitudes, timestamps, ids):
+    """Упаковывает трек (координаты в градусах, время - datetime, id строк Position) в bytes"""
+    count = len(latitudes)
+    times_ms = [int(t.timestamp() * 1000) for t in timestamps] # время храним с точностью до мс
+    base_ms = times_ms[0] if count else 0
+    types = COLUMNS[TRACK_FORMAT_VERSION]
+    payload = b''.join([
+        _column([round(float(lat) * MICRODEGREES) for lat in latitudes], types[0]),
+        _column([round(float(lon) * MICRODEGREES) for lon in longitudes], types[1]),
+        _column([t - base_ms for t in times_ms], types[2]),
+        _column(ids, types[3]),
+    ])
+    return HEADER.pack(TRACK_FORMAT_VERSION, count, base_ms) + zlib.compress(payload, 9)
+
+
+def _decoded_columns(blob):
+    # (дельты по колонкам, время первой точки); у треков версии 1 колонки id нет
+    version, count, base_ms = HEADER.unpack_from(blob)
+    if version not in COLUMNS:
+        raise ValueError(f'Неизвестная версия формата трека: {version}')
+    payload = zlib.decompress(bytes(blob[HEADER.size:]))
+    columns = []
+    offset = 0
+    for typecode in COLUMNS[version]:
+        size = count * array(typecode).itemsize
+        columns.append(_restore_column(payload[offset:offset + size], typecode))
+        offset += size
+    return columns, base_ms
+
+
+def track_ids(blob):
+    """id точек упакованного трека по порядку или None для треков версии 1 (id тогда не сохранялись)"""
+    columns, _ = _decoded_columns(blob)
+    return list(accumulate(columns[3])) if len(columns) > 3 else None
+
+
+def iter_decoded(blob):
+    """
+    Лениво распаковывает трек: по одной точке (широта, долгота, время), координаты Decimal, как в Position.
+    В памяти держится только распакованный zlib-буфер (12-24 байта на точку), а не список объектов
+    """
+    columns, base_ms = _decoded_columns(blob)
+    for lat, lon, t in zip(*(accumulate(column) for column in columns[:3])):
+        yield (
+            (Decimal(lat) / MICRODEGREES).quantize(COORDINATE_STEP),
+            (Decimal(lon) / MICRODEGREES).quantize(COORDINATE_STEP),
+            datetime.fromtimestamp((base_ms + t) / 1000, tz=timezone.utc),
+        )
+
+
+def decode_track(blob):
+    """Обратно к спискам (широты, долготы, время)"""
+    points = list(iter_decoded(blob))
+    if not points:
+        return [], [], []
+    return tuple(list(column) for column in zip(*points))
+
+
+def iter_track(run, chunk_size=2000):
+    """
+    Точки забега по порядку (широта, долгота, время) - откуда бы они ни читались:
+    из упакованного run.track или из строк Position/PositionArchive (через серверный курсор, кусками по chunk_size).
+    Весь трек в память не загружается
+    """
+    if run.track is not None:
+        return iter_decoded(run.track)
+    return run.positions().order_by('id').values_list(
+        'latitude', 'longitude', 'created_at'
+    ).iterator(chunk_size=chunk_size)
+
+
+def simplify(latitudes, longitudes, tolerance_m):
+    """
+    Упрощение трека алгоритмом Дугласа-Пекера.
+    Возвращает индексы точек, которые надо оставить (первая и последняя остаются всегда).
+    Для расчета отклонений трек проецируется на плоскость (для масштабов забега этого достаточно).
+    """
+    count = len(latitudes)
+    if count < 3 or not tolerance_m:
+        return list(range(count))
+
+    meters_per_degree = EARTH_RADIUS_KM * 1000 * pi / 180
+    kx = meters_per_degree * cos(radians(sum(float(lat) for lat in latitudes) / count))
+    xs = [float(lon) * kx for lon in longitudes]
+    ys = [float(lat) * meters_per_degree for lat in latitudes]
+
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    stack = [(0, count - 1)] # без рекурсии, чтобы длинные треки не упирались в лимит стека
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        length2 = dx * dx + dy * dy
+        max_distance, max_index = 0.0, None
+        for i in range(first + 1, last):
+            px, py = xs[i] - ax, ys[i] - ay
+            t = 0.0 if length2 == 0 else max(0.0, min(1.0, (px * dx + py * dy) / length2))
+            d = hypot(px - t * dx, py - t * dy)
+            if d > max_distance:
+                max_distance, max_index = d, i
+        if max_index is not None and max_distance > tolerance_m:
+            keep[max_index] = True
+            stack.append((first, max_index))
+            stack.append((max_index, last))
+    return [i for i in range(count) if keep[i]]
+
+
+def pack_run(run, tolerance_m=None):
+    """
+    Переводит законченный забег в компактное хранение:
+    трек упаковывается в run.track, а строки Position (или архива) этого забега удаляются.
+    distance не меняется - она уже посчитана по полному (не упрощенному) треку.
+    Возвращает (кол-во точек в треке, размер упакованного трека в байтах) или None, если паковать нечего.
+    """
+    with transaction.atomic():
+        run = Run.objects.select_for_update().get(id=run.id)
+        if run.status != 'finished' or run.track is not None:
+            return None
+        rows = list(run.positions().order_by('id').values_list('latitude', 'longitude', 'created_at', 'id'))
+        if not rows:
+            return None
+        latitudes, longitudes, timestamps, ids = (list(column) for column in zip(*rows))
+        keep = simplify(latitudes, longitudes, tolerance_m)
+        run.track = encode_track(
+            [latitudes[i] for i in keep],
+            [longitudes[i] for i in keep],
+            [timestamps[i] for i in keep],
+            [ids[i] for i in keep],
+        )
+        run.positions().delete()
+        run.positions_archived = False
+        run.save(update_fields=['track', 'positions_archived'])
+    return len(keep), len(run.track)
+
+
+def unpack_run(run):
+    """Обратная операция: восстанавливает строки Position из run.track"""
+    with transaction.atomic():
+        run = Run.objects.select_for_update().get(id=run.id)
+        if run.track is None:
+            return 0
+        positions = unpacked_positions(run)
+        Position.objects.bulk_create(positions, batch_size=1000)
+        run.track = None
+        run.save(update_fields=['track'])
+    return len(positions)
+
+
+def unpacked_rows(run):
+    """
+    Точки упакованного трека в виде строк .values() Position (id, run_id, latitude, longitude, created_at) -
+    чтобы отдать их тем же сериализатором, что и строки из БД. id - те же, что были до упаковки
+    (у треков версии 1 - None)
+    """
+    ids = track_ids(run.track) or repeat(None)
+    return [
+        {'id': position_id, 'run_id': run.id, 'latitude': lat, 'longitude': lon, 'created_at': created_at}
+        for position_id, (lat, lon, created_at) in zip(ids, iter_decoded(run.track))
+    ]
+
+
+def unpacked_positions(run):
+    """Несохраненные объекты Position из упакованного трека (с прежними id, если трек их хранит)"""
+    return [Position(**row) for row in unpacked_rows(run)]
@@ -0,0 +1,122 @@
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal, InvalidOperation, ROUND_HALF_EVEN
+from pathlib import Path
+
+from defusedxml import DefusedXmlException
+from defusedxml.ElementTree import iterparse, ParseError
+
+
+# Разбор файлов треков GPX и TCX (запись в БД - в app_run/importers.py).
+# XML читается потоково (iterparse) и разобранные элементы сразу выбрасываются,
+# поэтому память не зависит от размера файла (кроме самих списков точек).
+# Файлы присылают пользователи, поэтому iterparse из defusedxml - он не раскрывает сущности
+# (billion laughs) и не ходит за внешними DTD.
+# Здесь нет импортов Django: модуль разбирает файлы в пуле процессов (manage.py import_tracks),
+# а при запуске процессов через spawn/forkserver Django в них не настроен
+
+COORDINATE_STEP = Decimal('0.0001') # в Position хранится 4 знака после запятой
+
+
+class TrackImportError(Exception):
+    pass
+
+
+def _local(tag):
+    # '{http://www.topografix.com/GPX/1/1}trkpt' -> 'trkpt'
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_time(text):
+    if not text:
+        return None
+    value = datetime.fromisoformat(text.strip().replace('Z', '+00:00'))
+    return value if value.tzinfo else value.replace(tzinfo=dt_timezone.utc)
+
+
+def _parse_gpx(source, track):
+    point = None
+    for event, element in iterparse(source, events=('start', 'end')):
+        tag = _local(element.tag)
+        if event == 'start':
+            if tag == 'trkpt':
+                point = [element.get('lat'), element.get('lon'), None]
+            continue
+        if tag == 'time' and point is not None:
+            point[2] = element.text
+        elif tag == 'name' and track['name'] is None and point is None:
+            track['name'] = (element.text or '').strip() or None
+        elif tag == 'trkpt':
+            track['points'].append(point)
+            point = None
+            element.clear()
+
+
+def _parse_tcx(source, track):
+    point = None
+    for event, element in iterparse(source, events=('start', 'end')):
+        tag = _local(element.tag)
+        if event == 'start':
+            if tag == 'Trackpoint':
+                point = [None, None, None]
+            continue
+        if point is None:
+            continue
+        if tag == 'LatitudeDegrees':
+            point[0] = element.text
+        elif tag == 'LongitudeDegrees':
+            point[1] = element.text
+        elif tag == 'Time':
+            point[2] = element.text
+        elif tag == 'Trackpoint':
+            if point[0] is not None: # точки без координат (только пульс и т.п.) пропускаем
+                track['points'].append(point)
+            point = None
+            element.clear()
+
+
+PARSERS = {
+    'gpx': _parse_gpx,
+    'tcx': _parse_tcx,
+}
+
+
+def parse_track(source, fmt):
+    """
+    Разбирает файл (путь или открытый файл) формата 'gpx' или 'tcx'.
+    Возвращает dict с name и списками latitudes, longitudes (Decimal, 4 знака), times (datetime или None),
+    плюс skipped - сколько точек отброшено из-за некорректных координат.
+    Ничего не пишет в БД, поэтому можно запускать в отдельных процессах
+    """
+    if fmt not in PARSERS:
+        raise TrackImportError(f'Неизвестный формат: {fmt}')
+    track = {'name': None, 'points': []}
+    try:
+        PARSERS[fmt](source, track)
+    except ParseError as e:
+        raise TrackImportError(f'Некорректный XML: {e}')
+    except DefusedXmlException:
+        raise TrackImportError('XML с сущностями или внешними ссылками не принимается')
+
+    result = {'name': track['name'], 'latitudes': [], 'longitudes': [], 'times': [], 'skipped': 0}
+    for lat, lon, time in track['points']:
+        try:
+            lat = Decimal(lat.strip()).quantize(COORDINATE_STEP, rounding=ROUND_HALF_EVEN)
+            lon = Decimal(lon.strip()).quantize(COORDINATE_STEP, rounding=ROUND_HALF_EVEN)
+            time = _parse_time(time)
+        except (AttributeError, InvalidOperation, ValueError):
+            result['skipped'] += 1
+            continue
+        # те же границы, что и в PositionSerializer
+        if not (-90 < lat < 90 and -180 < lon < 180):
+            result['skipped'] += 1
+            continue
+        result['latitudes'].append(lat)
+        result['longitudes'].append(lon)
+        result['times'].append(time)
+    return result
+
+
+def parse_file(path):
+    """parse_track для файла на диске, формат - по расширению"""
+    path = Path(path)
+    return parse_track(str(path), path.suffix.lower().lstrip('.'))
@@ -1,29 +1,72 @@
+from datetime import date
+
 from django.contrib.auth.models import User
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import Coalesce, TruncDay, TruncMonth, TruncWeek
+from django.http import HttpResponse, StreamingHttpResponse, Http404
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from haversine import haversine
-from rest_framework import viewsets, status
-from rest_framework.decorators import api_view # чтобы использовать декоратор
+from rest_framework import viewsets, status, serializers
+from rest_framework.decorators import api_view, action # чтобы использовать декоратор
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.permissions import BasePermission, SAFE_METHODS
 from rest_framework.response import Response # чтобы использовать Response от DRF
 from django.conf import settings # чтобы использовать переменные из settings
 from rest_framework.views import APIView
 
-from app_run.models import Run, AthleteInfo, Challenge, Position
+from app_run.analytics import run_analytics
+from app_run.cache import bump, cache_response
+from app_run.distance import append_positions, recalculate_run
+from app_run.export import CONTENT_TYPES, export_track
+from app_run.fastpath import FastListMixin, RunValuesSerializer, PositionValuesSerializer
+from app_run.filters import RunFilter
+from app_run.finalize import stop_run
+from app_run.idempotency import IDEMPOTENCY_HEADER, idempotent, idempotent_dispatch
+from app_run.importers import TrackImportError, import_track, parse_track
+from app_run.ingest import ingest_positions
+from app_run.leaderboard import PERIODS, METRICS, bucket_start, top, athlete_rank
+from app_run.metrics import render_prometheus
+from app_run.models import Run, AthleteInfo, Challenge, Position, PositionArchive
+from app_run.nearby import runs_started_near, runs_passed_near
+from app_run.noise import filter_positions
+from app_run.pagination import KeysetPagination, RunAndUserPagination, UserKeysetPagination
+from app_run.parsers import NDJSONParser
+from app_run.track import unpacked_rows
 from app_run.serializers import RunSerializer, UserSerializer, AthleteInfoSerializer, ChallengeSerializer, \
-    PositionSerializer
+    PositionSerializer, athlete_info_of
+
 
+class AtomicWriteMixin:
+    """
+    Запросы на запись (POST, PUT, PATCH, DELETE) целиком в одной транзакции: все запросы к БД
+    (проверки, вставка, пересчет забега, сброс кэша) уходят одним COMMIT-ом, а не каждый своим.
+    Если вьюха ответила ошибкой (4xx/5xx), все изменения откатываются.
+    Ключ Idempotency-Key обработчиков с @idempotent захватывается и сохраняется вне этой транзакции,
+    иначе откат стер бы сохраненный ответ 4xx и повтор выполнился бы заново
+    """
+    def dispatch(self, request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return super().dispatch(request, *args, **kwargs)
+        handler = getattr(self, request.method.lower(), None)
+        if getattr(handler, 'idempotent', False) and request.headers.get(IDEMPOTENCY_HEADER):
+            return idempotent_dispatch(request, lambda: self._atomic_dispatch(request, *args, **kwargs))
+        return self._atomic_dispatch(request, *args, **kwargs)
+
+    def _atomic_dispatch(self, request, *args, **kwargs):
+        with transaction.atomic():
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code >= 400:
+                # DRF сам откатывает только при ATOMIC_REQUESTS, а исключения превращает в ответ
+                transaction.set_rollback(True)
+        return response
 
-# Задача №7. Создаем класс для пагинации
-class RunAndUserPagination(PageNumberPagination):
-    # page_size = 10 # Количество объектов на странице по умолчанию (не обязательный параметр)
-    page_size_query_param = 'size' # Разрешаем изменять количество объектов через query параметр size в url
-    # max_page_size = 100 # Ограничиваем максимальное количество объектов на странице
 
 # Create your views here.
 @api_view(['GET'])
+@cache_response() # данные берутся из settings и между запросами не меняются
 def company_details_view(request):
     """
     Задание №1.
@@ -39,7 +82,7 @@ def company_details_view(request):
     return Response(details)
 
 
-class RunViewSet(viewsets.ModelViewSet):
+class RunViewSet(FastListMixin, viewsets.ModelViewSet):
     """
     Задание №2.
     Отдаем по АПИ список забегов с комментариями.
@@ -51,18 +94,112 @@ class RunViewSet(viewsets.ModelViewSet):
     """
     queryset = Run.objects.all().select_related('athlete')
     serializer_class = RunSerializer
+    # список отдается из .values() без ModelSerializer (app_run/fastpath.py), вывод тот же
+    values_serializer_class = RunValuesSerializer
 
     # класс для фильтрации - DjangoFilterBackend (должен быть импортирован)
     # класс для сортировки - DjangoFilterBackend (должен быть импортирован)
     # filter_backends - это атрибут класса ModelViewSet
     filter_backends = [DjangoFilterBackend, OrderingFilter]
-    # Поля, по которым будет происходить фильтрация
-    filterset_fields = ['status', 'athlete']
+    # Поля, по которым будет происходить фильтрация (status, athlete, диапазоны created_at и distance)
+    filterset_class = RunFilter
     # Поля, по которым будет происходить сортировка (/api/runs/?ordering=created_at. Или -created_at)
     ordering_fields = ['created_at']
 
-    # устанавливаем класс пагинации
-    pagination_class = RunAndUserPagination
+    # устанавливаем класс пагинации (keyset по (created_at, id), см. app_run/pagination.py)
+    pagination_class = KeysetPagination
+
+    # список забегов кэшируется (app_run/cache.py) до изменения забегов, точек или юзеров
+    @cache_response('runs')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    # группировка для /api/runs/summary/ - начало дня, недели (с понедельника) или месяца
+    SUMMARY_GROUPS = {'day': TruncDay, 'week': TruncWeek, 'month': TruncMonth}
+
+    @action(detail=False, methods=['get'])
+    @cache_response('runs')
+    def summary(self, request):
+        """
+        Итоги по периодам для дашбордов: /api/runs/summary/?athlete=1&group_by=day|week|month
+        (плюс все фильтры списка: ?status=finished, ?created_at__gte=... и т.д.).
+        Кол-во забегов и сумма дистанции считаются в БД одним запросом с GROUP BY
+        """
+        trunc = self.SUMMARY_GROUPS.get(request.query_params.get('group_by', 'day'))
+        if trunc is None:
+            return Response({'message': 'group_by может быть day, week или month'}, status=status.HTTP_400_BAD_REQUEST)
+        rows = self.filter_queryset(self.get_queryset()).values(
+            period=trunc('created_at', output_field=DateField()),
+        ).annotate(
+            runs=Count('id'),
+            distance=Coalesce(Sum('distance'), 0.0),
+        ).order_by('period')
+        return Response([
+            {'period': row['period'].isoformat(), 'runs': row['runs'], 'distance': round(row['distance'], 3)}
+            for row in rows
+        ])
+
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        """
+        Аналитика забега (/api/runs/<id>/analytics/): сплиты по км, время в движении, средняя и максимальная скорость.
+        Точки-выбросы GPS отбрасываются. ?segments=1 - еще и скорость на каждом отрезке трека
+        """
+        run = self.get_object()
+        include_segments = request.query_params.get('segments') in ('1', 'true')
+        return Response(run_analytics(run, include_segments))
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        """
+        Забеги рядом с точкой: /api/runs/nearby/?lat=55.75&lon=37.61&radius=2 (радиус в км).
+        ?by=start (по умолчанию) - забеги, начатые рядом; ?by=track - забеги, трек которых проходил рядом.
+        Работают и обычные фильтры списка (?status=finished, ?athlete=...). ?size - сколько забегов вернуть
+        """
+        try:
+            lat = float(request.query_params['lat'])
+            lon = float(request.query_params['lon'])
+            radius = float(request.query_params.get('radius', 1))
+            size = max(1, min(int(request.query_params.get('size', 20)), settings.NEARBY_MAX_RESULTS))
+        except (KeyError, ValueError):
+            return Response({'message': 'Нужно передать lat, lon (и radius в км)'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180 and 0 < radius <= settings.NEARBY_MAX_RADIUS_KM):
+            return Response({'message': f'Некорректные координаты или радиус (до {settings.NEARBY_MAX_RADIUS_KM} км)'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(self.get_queryset())
+        if request.query_params.get('by') == 'track':
+            found = runs_passed_near(queryset, lat, lon, radius, limit=size)
+        else:
+            found = runs_started_near(queryset, lat, lon, radius)[:size]
+
+        data = []
+        for run, distance_km in found:
+            item = RunSerializer(run).data
+            item['distance_to_point'] = round(distance_km, 3)
+            data.append(item)
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_file(self, request):
+        """
+        Импорт забега из файла GPX или TCX (/api/runs/import/, multipart: file, athlete, comment).
+        Создается сразу законченный забег со всеми точками и посчитанной дистанцией
+        """
+        upload = request.FILES.get('file')
+        athlete_id = str(request.data.get('athlete', ''))
+        if upload is None or not athlete_id.isdigit():
+            return Response({'message': 'Нужно передать file и athlete'}, status=status.HTTP_400_BAD_REQUEST)
+        athlete = get_object_or_404(User, id=athlete_id)
+        fmt = upload.name.rsplit('.', 1)[-1].lower()
+        try:
+            track = parse_track(upload, fmt)
+            run = import_track(athlete, track, request.data.get('comment'))
+        except TrackImportError as e:
+            return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        data = RunSerializer(run).data
+        data['points'] = len(track['latitudes'])
+        data['skipped'] = track['skipped']
+        return Response(data, status=status.HTTP_201_CREATED)
 
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """
@@ -73,7 +210,14 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     (запрос в данном случае идет на /api/users)
     В задании №7 добавляем сортировку и пагинацию
     """
-    queryset = User.objects.filter(is_superuser = False) # сразу исключаем суперадминов
+    # сразу исключаем суперадминов.
+    # Кол-во законченных забегов и т.п. берем из AthleteStats тем же запросом (LEFT JOIN),
+    # а не отдельным COUNT на каждого юзера. Заодно по этим полям можно сортировать
+    queryset = User.objects.filter(is_superuser = False).annotate(
+        runs_finished=Coalesce('stats__runs_finished', 0),
+        total_distance=Coalesce('stats__total_distance', 0.0),
+        last_run_at=F('stats__last_run_at'),
+    )
     serializer_class = UserSerializer
 
     # Задание №5. Добавляем поиск по имени и фамилии
@@ -81,82 +225,70 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = [SearchFilter, OrderingFilter] #сюда добавил фильтр для сортировки
     search_fields = ['first_name', 'last_name']
 
+    # что можно вложить в ответ через ?expand=athlete_info,challenges и как это подтянуть одним запросом
+    EXPANDABLE = {
+        'athlete_info': lambda qs: qs.select_related('athleteinfo'), # LEFT JOIN, без отдельного запроса
+        'challenges': lambda qs: qs.prefetch_related('challenge_set'), # один запрос на всю страницу
+    }
+
+    def get_expand(self):
+        expand = self.request.query_params.get('expand', '').split(',')
+        return [name for name in self.EXPANDABLE if name in expand]
+
     def get_queryset(self):
-        qs = self.queryset # наверное, можно и не вводить лишнюю переменную qs, а использовать прям queryset
+        # .all() - копия: сам self.queryset общий для всех запросов, и если его вычислить
+        # (список без фильтров), его результат закэшировался бы на уровне класса
+        qs = self.queryset.all()
         type_user = self.request.query_params.get('type', None) # .query_params. вместо .GET.
         if type_user == 'coach':
             qs = qs.filter(is_staff = True)
         if type_user == 'athlete':
             qs = qs.filter(is_staff = False)
+        for name in self.get_expand():
+            qs = self.EXPANDABLE[name](qs)
         return qs
 
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
+
     # добавляем сортировку по полю date_joined (/api/users/?ordering=data_joined. Или -data_joined)
-    ordering_fields = ['date_joined']
+    # и по статистике атлета (/api/users/?ordering=-runs_finished)
+    ordering_fields = ['date_joined', 'runs_finished', 'total_distance', 'last_run_at']
 
-    # устанавливаем класс пагинации
-    pagination_class = RunAndUserPagination
+    # устанавливаем класс пагинации (keyset по (date_joined, id), см. app_run/pagination.py)
+    pagination_class = UserKeysetPagination
 
 
 # Задача №6. Меняем статус с помощью вьюхи на базе APIView
-class StartRunAPIView(APIView):
+# Смена статуса - один условный UPDATE ... WHERE status=...: из одновременных запросов
+# (клиент повторил запрос на плохой сети) статус поменяет только один, остальные получат 400.
+# С заголовком Idempotency-Key повтор получит тот же ответ, что и первый запрос (app_run/idempotency.py)
+class StartRunAPIView(AtomicWriteMixin, APIView):
+    @idempotent
     def post(self,request, run_id): # Вначале делал GET, но проверка ругается, что надо POST
         # run = Run.objects.get(id=run_id)
         run = get_object_or_404(Run, id=run_id)
-        if run.status != 'init':
+        if not Run.objects.filter(id=run.id, status='init').update(status='in_progress'):
             return Response({'message': 'Забег уже идет или закончен'}, status=status.HTTP_400_BAD_REQUEST)
+        bump('runs') # UPDATE не шлет post_save
         run.status = 'in_progress'
-        run.save()
         serializer = RunSerializer(run)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-class StopRunAPIView(APIView):
+class StopRunAPIView(AtomicWriteMixin, APIView):
+    @idempotent
     def post(self,request, run_id): # Вначале делал GET, но проверка ругается, что надо POST
         run = get_object_or_404(Run, id=run_id)
-        if run.status != 'in_progress':
-            return Response({'message': 'Забег еще не начат или уже закончен'}, status=status.HTTP_400_BAD_REQUEST)
-        # ----------
-        # Задача №12. Видимо, в этот момент надо посчитать суммарное расстояние и записать в distance
-
-        # Отличный метод values_list!. Сразу получаем из QuerySet-а список кортежей с нужными полями
-        positions_list = Position.objects.filter(run_id=run_id).values_list('latitude', 'longitude')
-
-        # а потом проходимся по этому списку и считаем суммарное расстояние
-        # в данном случае используем генератор, но можно и list_comprehension (конструкция sum[])
-        total_distance = sum(haversine(positions_list[i], positions_list[i+1]) for i in range(len(positions_list) - 1))
-        # print(total_distance)
-
-        # ...и записываем результат в поле distance в run
-        run.distance = total_distance
         # ----------
-
-        run.status = 'finished'
-        run.save()
-
-        # Задача №10. Считаем кол-во завершенных забегов для челленджа
-        finished_runs_count = Run.objects.filter(athlete=run.athlete, status='finished').count()
-        # print(f'Это был {finished_runs_count}-й забег')
-        if finished_runs_count == 10:
-            # и создаем запись в модели Challenge
-            Challenge.objects.create( # get_or_create??? Разве просто create может приводить к "лишним" челленджам?
-                full_name=f'Сделай {finished_runs_count} Забегов!',
-                athlete=run.athlete
-            )
-            # print(f'Бинго! Челлендж завершен! ({finished_runs_count}-й забег)')
-
-        # ----------
-        # Задача №13. Считаем суммарное расстояние завершенных забегов для челленджа "Пробеги 50 километров!"
-        # Теперь с использованием агрегатной функции Sum (на уровне БД)
-        finished_runs_distance = Run.objects.filter(athlete=run.athlete, status='finished').aggregate(Sum('distance'))
-        # Кстати, получается, что мы здесь 2-й раз обращаемся в БД с тем же запросом, что и в задаче №10.
-        # Возможно, оптимальнее будет 1 раз получить qs, а потом уже вынимать из него нужное.
-        # Надо будет это проверить
-
-        if finished_runs_distance['distance__sum'] >= 50:
-            # а вот здесь похоже, надо именно get_or_create
-            Challenge.objects.get_or_create(
-                full_name='Пробеги 50 километров!',
-                athlete=run.athlete
-            )
+        # Задачи №10, №12, №13 (дистанция, челленджи) и статистика атлета теперь считаются
+        # не внутри запроса, а в app_run/finalize.py: здесь забег только переводится в статус 'finalizing'
+        # и ставится в очередь, итоги досчитывает пул потоков. Пока итоги не готовы,
+        # забег отдается со статусом 'finalizing', потом - 'finished'
+        if stop_run(run) is None:
+            return Response({'message': 'Забег еще не начат или уже закончен'}, status=status.HTTP_400_BAD_REQUEST)
+        run.refresh_from_db() # если пул выключен (RUN_FINALIZE_WORKERS = 0), итоги уже посчитаны
         # ----------
 
         serializer = RunSerializer(run)
@@ -164,21 +296,16 @@ class StopRunAPIView(APIView):
 
 
 # Задача №9. Вьюха для отдачи инфы из AthleteInfo (на базе APIView)
-class AthleteInfoAPIView(APIView):
+class AthleteInfoAPIView(AtomicWriteMixin, APIView):
 
     def get(self,request,user_id):
-        # есть ли вообще юзер с таким id в модели User ?
-        user = get_object_or_404(User, id=user_id)
-
-        athlete_info, created = AthleteInfo.objects.get_or_create(user_id=user)
-        serializer = AthleteInfoSerializer(athlete_info)
+        # есть ли вообще юзер с таким id в модели User ? AthleteInfo берем тем же запросом (LEFT JOIN).
+        # Раньше здесь был get_or_create, то есть запись в БД на обычном GET - теперь, если профиля еще нет,
+        # отдаем пустой (тот же ответ), а создается он только при PUT
+        user = get_object_or_404(User.objects.select_related('athleteinfo'), id=user_id)
+        serializer = AthleteInfoSerializer(athlete_info_of(user))
 
         return Response(serializer.data, status=status.HTTP_200_OK)
-        # на случай, если надо отдавать разные статусы отдавались
-        # if created:
-        #     return Response(serializer.data, status=status.HTTP_201_CREATED)
-        # else:
-        #     return Response(serializer.data, status=status.HTTP_200_OK)
 
     def put(self,request,user_id):
         user = get_object_or_404(User, id=user_id)
@@ -198,9 +325,27 @@ class AthleteInfoAPIView(APIView):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
+# Профили сразу нескольких атлетов одним запросом: /api/athlete_info/?ids=1,2,3
+# (экран состава команды вместо запроса на каждого атлета). Порядок - как в ids, несуществующие id пропускаются
+class AthleteInfoListAPIView(APIView):
+    def get(self, request):
+        ids = [item for item in request.query_params.get('ids', '').split(',') if item]
+        if not ids or not all(item.isdigit() for item in ids):
+            return Response({'message': 'Укажите id атлетов через запятую: ?ids=1,2,3'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > settings.ATHLETE_INFO_MAX_IDS:
+            return Response({'message': f'Не больше {settings.ATHLETE_INFO_MAX_IDS} атлетов за запрос'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        ids = list(dict.fromkeys(int(item) for item in ids))
+        users = User.objects.select_related('athleteinfo').in_bulk(ids)
+        profiles = [athlete_info_of(users[user_id]) for user_id in ids if user_id in users]
+        return Response(AthleteInfoSerializer(profiles, many=True).data, status=status.HTTP_200_OK)
+
+
 # Задача №10. Вьюха для возврата данных из модели Challenge. Пробуем через APIView
 class ChallengeAPIView(APIView):
 
+    @cache_response('challenges')
     def get(self,request):
         athlete = self.request.query_params.get('athlete', None) # чтобы можно было отдать по конкретному атлету
         challenges = Challenge.objects.all()
@@ -213,14 +358,196 @@ class ChallengeAPIView(APIView):
 
 
 # Задача №11. Вьюха для работы с моделью Position. Через ModelViewSet
-class PositionViewSet(viewsets.ModelViewSet):
+class PositionViewSet(AtomicWriteMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = Position.objects.all()
     serializer_class = PositionSerializer
+    values_serializer_class = PositionValuesSerializer
+    pagination_class = KeysetPagination # страницы только если передан ?size=, как и у забегов
+
+    run_archived = False # точки забега из ?run= лежат в архиве (выставляется в list)
+    dropped = None # почему новая точка не сохранена (дубль или шум GPS, см. app_run/noise.py)
 
     def get_queryset(self):
-        qs = self.queryset  # Используем базовый queryset определенный выше, на уровне класса
+        qs = self.queryset.all()  # Используем базовый queryset определенный выше, на уровне класса (копию)
         run = self.request.query_params.get('run', None)  # Получим параметр run
         if run:
+            if self.run_archived: # точки законченного забега уже перенесены в архив (app_run/archive.py)
+                qs = PositionArchive.objects.all()
             qs = qs.filter(run=run)  # Фильтруем по атлету, если параметр указан
         return qs
 
+    def list(self, request, *args, **kwargs):
+        # Точки лежат в разных местах (Position, архив, упакованный трек) - для ?run=<id> смотрим, где именно
+        run_id = request.query_params.get('run')
+        if run_id is None:
+            return self._list_all(request)
+        if not run_id.isdigit():
+            return Response({'message': 'Некорректный id забега: /api/positions/?run=<id>'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        run = Run.objects.filter(id=run_id).only('id', 'track', 'positions_archived').first()
+        if run is not None and run.track is not None:
+            return self._list_packed(request, run)
+        self.run_archived = run is not None and run.positions_archived
+        return super().list(request, *args, **kwargs)
+
+    def _list_all(self, request):
+        # Все точки: из Position и из архива вместе, по порядку (created_at, id) - id при архивации сохраняются.
+        # Упакованные треки (run.track) сюда не попадают: их точки есть только в ?run=<id>
+        serializer = (self.values_serializer_class or PositionValuesSerializer)()
+        parts = [model.objects.values(*serializer.columns()) for model in (Position, PositionArchive)]
+        page = self.paginate_queryset(parts)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        rows = self.paginator.union(parts).order_by(*self.paginator.keyset)
+        return Response(serializer.to_representation(rows))
+
+    def _list_packed(self, request, run):
+        # У законченного забега точки могут храниться упакованными в run.track (см. app_run/track.py) -
+        # тогда распаковываем их и отдаем в том же виде (и с теми же id), как если бы это были строки Position.
+        # Страницы - только по номеру (?size=&page=): курсор keyset-пагинации строится по строкам БД
+        if self.paginator.cursor_query_param in request.query_params:
+            return Response({'message': 'Трек забега упакован - страницы только по номеру: ?size=&page='},
+                            status=status.HTTP_400_BAD_REQUEST)
+        rows = unpacked_rows(run)
+        paginator = RunAndUserPagination()
+        page = paginator.paginate_queryset(rows, request, self)
+        rows = rows if page is None else page
+        if self.values_serializer_class is not None:
+            data = self.values_serializer_class().to_representation(rows)
+        else:
+            data = self.get_serializer([Position(**row) for row in rows], many=True).data
+        return Response(data) if page is None else paginator.get_paginated_response(data)
+
+    def get_object(self):
+        # точка законченного забега могла уйти в архив - тогда читаем, меняем и удаляем ее прямо там,
+        # не возвращая весь забег в Position (perform_destroy пересчитает забег по архиву)
+        try:
+            return super().get_object()
+        except Http404:
+            pk = str(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, ''))
+            archived = PositionArchive.objects.filter(pk=pk).first() if pk.isdigit() else None
+            if archived is None:
+                raise
+            self.check_object_permissions(self.request, archived)
+            return archived
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        if self.dropped:
+            # не ошибка: иначе устройство стало бы присылать ту же точку снова
+            return Response({'dropped': self.dropped}, status=status.HTTP_200_OK)
+        return response
+
+    # Дистанция забега копится по мере поступления точек: на каждую новую точку +1 отрезок.
+    # Забег блокируем (select_for_update), чтобы параллельные вставки точек одного забега
+    # не перетирали друг другу distance и последнюю точку
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            run = Run.objects.select_for_update().get(id=serializer.validated_data['run'].id)
+            if run.status != 'in_progress': # пока ждали блокировку, забег могли остановить
+                raise serializers.ValidationError('Забег должен быть в статусе "in progress"')
+            self.dropped = filter_positions(
+                run, [serializer.validated_data['latitude']], [serializer.validated_data['longitude']],
+                [serializer.validated_data.get('created_at')],
+            )[0]
+            if self.dropped:
+                return
+            position = serializer.save()
+            append_positions(run, [float(position.latitude)], [float(position.longitude)])
+
+    # если точку поменяли или удалили - проще честно пересчитать весь трек
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            old_run_id = serializer.instance.run_id
+            if isinstance(serializer.instance, PositionArchive) and serializer.validated_data['run'].id != old_run_id:
+                # иначе точка осталась бы в архиве, но в забеге, точки которого лежат в Position
+                raise serializers.ValidationError('Точку из архива нельзя перенести в другой забег')
+            position = serializer.save()
+            # точку могли перенести в другой забег - тогда пересчитываем оба
+            for run in Run.objects.select_for_update().filter(id__in={old_run_id, position.run_id}):
+                recalculate_run(run)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            run = Run.objects.select_for_update().get(id=instance.run_id)
+            instance.delete()
+            recalculate_run(run)
+
+    @action(detail=False, methods=['post'], url_path='bulk', parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Пакетная загрузка точек (/api/positions/bulk/).
+        Принимает JSON-массив или NDJSON (Content-Type: application/x-ndjson)
+        с элементами вида {"run": 1, "latitude": 55.7558, "longitude": 37.6173}
+        (и необязательным "time": "2026-05-01T06:00:00Z" - временем записи точки на устройстве).
+        Ошибочные элементы не мешают сохранить остальные - они возвращаются в errors с индексом.
+        Дубли и шум GPS (app_run/noise.py) не сохраняются, их кол-во - в dropped.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'message': 'Ожидается массив точек'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.POSITIONS_BULK_MAX_ITEMS:
+            return Response({'message': f'Не больше {settings.POSITIONS_BULK_MAX_ITEMS} точек за запрос'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        created, dropped, errors = ingest_positions(items, chunk_size=settings.POSITIONS_BULK_CHUNK_SIZE)
+        return Response({'created': created, 'dropped': dropped, 'errors': errors},
+                        status=status.HTTP_201_CREATED if created or dropped else status.HTTP_400_BAD_REQUEST)
+
+
+
+# Выгрузка трека забега целиком: /api/runs/<id>/track.gpx (или .ndjson, .csv)
+class RunTrackExportAPIView(APIView):
+    def get(self, request, run_id, fmt):
+        if fmt not in CONTENT_TYPES:
+            raise Http404
+        run = get_object_or_404(Run, id=run_id)
+        # StreamingHttpResponse: точки читаются из БД кусками и сразу уходят клиенту
+        response = StreamingHttpResponse(
+            export_track(run, fmt, settings.TRACK_EXPORT_CHUNK_SIZE),
+            content_type=CONTENT_TYPES[fmt],
+        )
+        response['Content-Disposition'] = f'attachment; filename="run_{run.id}.{fmt}"'
+        return response
+
+
+# Таблица лидеров: /api/leaderboard/?metric=distance|runs&period=week|month|all
+# &size=10 - сколько атлетов в топе, &athlete=<id> - еще и место этого атлета,
+# &date=YYYY-MM-DD - неделя/месяц, в которые попадает эта дата (по умолчанию текущие)
+class LeaderboardAPIView(APIView):
+    def get(self, request):
+        metric = request.query_params.get('metric', 'distance')
+        period = request.query_params.get('period', 'week')
+        if metric not in METRICS or period not in PERIODS:
+            return Response({'message': 'Неизвестный metric или period'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            day = date.fromisoformat(request.query_params['date']) if 'date' in request.query_params \
+                else timezone.localdate()
+            size = max(1, min(int(request.query_params.get('size', 10)), settings.LEADERBOARD_MAX_SIZE))
+        except ValueError:
+            return Response({'message': 'Некорректный date или size'}, status=status.HTTP_400_BAD_REQUEST)
+        bucket = bucket_start(period, day)
+
+        data = {
+            'metric': metric,
+            'period': period,
+            'bucket': bucket,
+            'results': top(metric, period, bucket, size),
+        }
+        athlete = request.query_params.get('athlete')
+        if athlete and athlete.isdigit():
+            data['athlete'] = athlete_rank(int(athlete), metric, period, bucket)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class IsSuperUser(BasePermission):
+    # is_staff здесь - признак тренера (UserSerializer.get_type), поэтому IsAdminUser не подходит
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_superuser)
+
+
+# Метрики запросов (app_run/metrics.py) в формате Prometheus, только для суперпользователей
+class MetricsAPIView(APIView):
+    permission_classes = [IsSuperUser]
+
+    def get(self, request):
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -32,6 +32,66 @@ MY_COMPANY_NAME = 'ООО "Бегунчики"'
 MY_COMPANY_SLOGAN = 'Бегать - это прикольно'
 MY_COMPANY_ADDRESS = 'г. Выдропужск, Красный тупик, д.13'
 
+# профили нескольких атлетов одним запросом (/api/athlete_info/?ids=1,2,3)
+ATHLETE_INFO_MAX_IDS = 200
+
+# пакетная загрузка точек (/api/positions/bulk/)
+POSITIONS_BULK_MAX_ITEMS = 50000 # сколько точек максимум принимаем за один запрос
+POSITIONS_BULK_CHUNK_SIZE = 1000 # по сколько строк вставляем через bulk_create
+
+# отсев дублей и шума GPS при приеме точек (app_run/noise.py).
+# Выключен по умолчанию: отброшенная точка получает 200 {"dropped": ...} вместо 201 - включать после обновления клиентов
+POSITIONS_FILTER_ENABLED = False
+POSITIONS_MIN_DISTANCE_M = 3 # ближе к предыдущей точке - стоим на месте, точка не нужна
+# Проверки по времени считают от момента приема точки сервером, а не записи на устройстве,
+# поэтому включать их стоит, только если устройства шлют точки сразу, а не пачкой после потери связи
+POSITIONS_MIN_INTERVAL = None # секунд; раньше - повторная отправка. None - не проверять
+POSITIONS_MAX_SPEED = None # м/с; быстрее - выброс GPS (как ANALYTICS_MAX_SPEED). None - не проверять
+POSITIONS_FILTER_STATE_TTL = 60 * 60 # секунд храним в кэше время приема последней точки забега
+
+# компактное хранение треков законченных забегов (app_run/track.py)
+TRACK_PACK_ON_FINISH = False # упаковывать трек сразу при остановке забега
+TRACK_SIMPLIFY_TOLERANCE_M = None # упрощение Дугласа-Пекера при упаковке, в метрах (None - без упрощения)
+TRACK_EXPORT_CHUNK_SIZE = 2000 # по сколько точек читать из БД при выгрузке трека
+
+# архив точек законченных забегов (app_run/archive.py)
+POSITIONS_ARCHIVE_ON_FINISH = True # переносить точки в архив сразу при подсчете итогов (если трек не упаковывается)
+
+# метрики запросов (app_run/metrics.py, /api/_metrics)
+METRICS_ENABLED = True
+METRICS_SLOW_REQUEST_MS = 500 # запросы дольше пишутся в лог с самыми частыми SQL; None - не писать
+
+# поиск забегов рядом (app_run/geo.py, app_run/nearby.py)
+GEO_CELL_DEGREES = 0.01 # размер ячейки сетки, ~1.1 км по широте; после изменения - manage.py reindex_cells
+NEARBY_MAX_RADIUS_KM = 50
+NEARBY_MAX_RESULTS = 100
+
+# таблица лидеров (app_run/leaderboard.py)
+LEADERBOARD_MAX_SIZE = 100 # максимум атлетов в топе за один запрос
+LEADERBOARD_TOTAL_TTL = 60 # секунд кэшируем кол-во атлетов в корзине (total в "моем месте")
+
+# аналитика забега (app_run/analytics.py)
+ANALYTICS_MAX_SPEED = 12 # м/с; точка, до которой и от которой бежали быстрее - выброс GPS
+ANALYTICS_MOVING_SPEED = 0.5 # м/с; медленнее - стоим, в "время в движении" не идет
+# доля отрезков без времени (точки пришли пачкой без time), при которой скорости и сплиты не считаются
+ANALYTICS_MAX_UNTIMED_SHARE = 0.1
+
+# живая трансляция забега (app_run/live.py, /api/runs/<id>/live/).
+# Только под ASGI-сервером (uvicorn project_run.asgi:application, см. requirements.txt);
+# под WSGI (Zappa/Lambda, runserver без daphne) эндпоинт отвечает 501
+LIVE_POLL_INTERVAL = 1.0 # секунд между опросами БД на новые точки (одна задача на забег, не на зрителя)
+LIVE_KEEPALIVE = 15 # секунд тишины, после которых зрителю уходит ping
+LIVE_QUEUE_SIZE = 1000 # событий в очереди зрителя; кто не успевает читать - отключается
+
+# подсчет итогов остановленных забегов (app_run/finalize.py)
+RUN_FINALIZE_WORKERS = 2 # потоков в локальном пуле; 0 - считать итоги прямо в запросе на остановку
+RUN_FINALIZE_MAX_ATTEMPTS = 5 # после стольких ошибок задача остается в статусе 'failed'
+RUN_FINALIZE_RETRY_DELAY = 10 # секунд до первого повтора, дальше задержка удваивается
+RUN_FINALIZE_STUCK_AFTER = 300 # через сколько секунд задачу в статусе 'running' считаем зависшей
+
+# повторы запросов с заголовком Idempotency-Key (app_run/idempotency.py)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60 # секунд храним ответ; старые ключи чистит manage.py purge_idempotency_keys
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -49,6 +109,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app_run.metrics.MetricsMiddleware', # первым, чтобы мерить весь запрос целиком
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,6 +139,18 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'project_run.wsgi.application'
 
+# Кэш. По умолчанию в памяти процесса; если процессов несколько - лучше общий бэкенд
+# (например, FileBasedCache или Redis), иначе сброс кэша при изменении данных виден только в своем процессе
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# сколько секунд хранить закэшированные ответы АПИ (app_run/cache.py).
+# Сбрасываются они и раньше - при изменении данных, это только верхняя граница
+API_CACHE_TIMEOUT = 300
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -7,6 +7,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # транзакция сразу берет блокировку на запись: параллельные записи (пул app_run/finalize.py,
+        # одновременные запросы) ждут друг друга до timeout секунд, а не падают с "database is locked"
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+        # тестовая БД в файле, а не в памяти: у общей in-memory БД блокировки не ждут,
+        # и тесты с параллельными потоками (RunTransitionsConcurrencyTests) падали бы на "table is locked"
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
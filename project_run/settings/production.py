@@ -1,5 +1,7 @@
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 from .base import *
 
 # Не редактируйте этот production файл, что не сломать наш продакшн сайт!
@@ -26,3 +28,32 @@ AWS_DEFAULT_ACL = None
 STATIC_LOCATION = 'static'
 STATIC_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/{STATIC_LOCATION}/'
 STATICFILES_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+
+# Соединения с БД (значения - из переменных окружения, чтобы менять их без выкладки кода).
+# Раньше каждый запрос открывал новое соединение с Postgres и закрывал его в конце.
+# DB_CONN_MAX_AGE - сколько секунд переиспользовать соединение (0 - как раньше, закрывать после каждого запроса).
+# DB_POOL_MAX_SIZE - вместо этого пул соединений psycopg 3 (Django >= 5.1, нужен pip install "psycopg[binary,pool]");
+# с пулом постоянные соединения Django выключаются - соединения держит сам пул
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+# перед переиспользованием соединение проверяется (Postgres мог его закрыть, пока контейнер Lambda спал)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = os.environ.get('DB_CONN_HEALTH_CHECKS', '1') == '1'
+if os.environ.get('DB_POOL_MAX_SIZE'):
+    # пул есть только в psycopg 3; с psycopg2 Django упал бы только на первом соединении с БД, а не при старте
+    try:
+        import psycopg_pool # noqa: F401
+    except ImportError:
+        raise ImproperlyConfigured('DB_POOL_MAX_SIZE требует psycopg 3 с пулом: pip install "psycopg[binary,pool]"')
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+            'max_size': int(os.environ['DB_POOL_MAX_SIZE']),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)), # секунд ждать свободное соединение
+        },
+    }
+
+# Итоги остановленных забегов (app_run/finalize.py) считаем прямо в запросе на остановку.
+# На Lambda после ответа процесс замораживается: ни пул потоков, ни отложенные повторы (threading.Timer)
+# не доработают. Задачи, упавшие с ошибкой, ждут повтора в очереди - их подбирает расписание Zappa
+# ("events" в zappa_settings.json): {"function": "app_run.finalize.scheduled_drain", "expression": "rate(5 minutes)"}
+RUN_FINALIZE_WORKERS = 0
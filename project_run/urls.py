@@ -14,16 +14,17 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from debug_toolbar.toolbar import debug_toolbar_urls
 from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 from rest_framework.routers import DefaultRouter
 
+from app_run import async_views
 from app_run.models import AthleteInfo, Position
 from app_run.views import company_details_view, RunViewSet, UserViewSet, StartRunAPIView, StopRunAPIView, \
-    AthleteInfoAPIView, ChallengeAPIView, PositionViewSet
+    AthleteInfoAPIView, AthleteInfoListAPIView, ChallengeAPIView, PositionViewSet, RunTrackExportAPIView, LeaderboardAPIView, \
+    MetricsAPIView
 
 router = DefaultRouter()
 router.register('api/runs', RunViewSet)
@@ -39,11 +40,33 @@ urlpatterns = [
     path('api/runs/<int:run_id>/start/', StartRunAPIView.as_view()),
     path('api/runs/<int:run_id>/stop/', StopRunAPIView.as_view()),
 
+    # выгрузка трека забега (gpx, ndjson, csv)
+    path('api/runs/<int:run_id>/track.<str:fmt>', RunTrackExportAPIView.as_view()),
+
     # добавляем маршрут для задачи №9
     path('api/athlete_info/<int:user_id>/', AthleteInfoAPIView.as_view()),
+    path('api/athlete_info/', AthleteInfoListAPIView.as_view()), # ?ids=1,2,3 - сразу несколько профилей
 
     # добавляем маршрут для задачи №10
     path('api/challenges/', ChallengeAPIView.as_view()),
 
-] + debug_toolbar_urls()
+    # таблица лидеров
+    path('api/leaderboard/', LeaderboardAPIView.as_view()),
+
+    # асинхронные версии загрузки точек и старта/остановки забега (под ASGI) и живая трансляция забега (SSE)
+    path('api/async/positions/', async_views.positions_ingest),
+    path('api/async/runs/<int:run_id>/start/', async_views.run_start),
+    path('api/async/runs/<int:run_id>/stop/', async_views.run_stop),
+    path('api/runs/<int:run_id>/live/', async_views.run_live),
+
+    # метрики для Prometheus (только админам)
+    path('api/_metrics', MetricsAPIView.as_view()),
+
+]
+
+# django debug toolbar подключен только в локальных настройках (settings/local.py) - в продакшне его нет,
+# и импортировать его там нельзя (его модели не в INSTALLED_APPS, да и лишнее время на холодный старт)
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    from debug_toolbar.toolbar import debug_toolbar_urls
+    urlpatterns += debug_toolbar_urls()
 